@@ -0,0 +1,216 @@
+"""
+Japa Genie conversation analytics.
+
+Compacts the JSONL conversation log (visa_intelligence.jsonl plus its
+rotated .gz segments) into a compressed Parquet file and runs a few
+streaming queries over it, one row group at a time.
+
+    python analytics.py export visa_intelligence.jsonl -o conversations.parquet
+    python analytics.py top-keywords conversations.parquet --limit 5
+    python analytics.py stressed-users conversations.parquet
+    python analytics.py questions-by-hour conversations.parquet
+
+Needs pyarrow (pip install pyarrow); the bot itself does not.
+"""
+import argparse
+import glob
+import gzip
+import json
+import sys
+from datetime import datetime
+from typing import Dict, Iterator, List
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.json as pa_json
+    import pyarrow.parquet as pq
+except ImportError:
+    sys.exit("❌ analytics.py needs pyarrow: pip install pyarrow")
+
+SCHEMA = pa.schema([
+    ("user_id", pa.int64()),
+    ("user_name", pa.string()),
+    ("username", pa.string()),
+    ("text", pa.string()),
+    ("keywords", pa.list_(pa.string())),
+    ("sentiment", pa.string()),
+    ("is_question", pa.bool_()),
+    ("chat_id", pa.int64()),
+    ("chat_title", pa.string()),
+    ("chat_type", pa.string()),
+    ("timestamp", pa.timestamp("us")),
+    ("priority", pa.string())
+])
+
+# ========== EXPORT ==========
+def log_segments(path: str) -> List[str]:
+    """Rotated segments oldest first, then the live log"""
+    segments = sorted(glob.glob(glob.escape(path) + ".*.gz"))
+    if glob.glob(glob.escape(path)):
+        segments.append(path)
+    return segments
+
+def read_records(path: str, skip: int = 0) -> Iterator[Dict]:
+    """Stream records from one JSONL (optionally gzipped) file, skipping bad lines
+    and the first `skip` non-blank lines (already read by Arrow, so all valid)"""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if skip and line.strip():
+                skip -= 1
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            timestamp = record.get("timestamp")
+            try:
+                record["timestamp"] = datetime.fromisoformat(timestamp) if timestamp else None
+            except ValueError:
+                record["timestamp"] = None
+            yield {name: record.get(name) for name in SCHEMA.names}
+
+def read_segment(path: str, batch_rows: int) -> Iterator[pa.Table]:
+    """One segment as tables of batch_rows: Arrow's native JSON reader, one block
+    at a time, then a per-line fallback from the first block it cannot parse"""
+    done = 0  # rows already yielded; the fallback resumes after them
+    try:
+        stream = pa.input_stream(path, compression="gzip" if path.endswith(".gz") else None)
+        reader = pa_json.open_json(
+            stream,
+            read_options=pa_json.ReadOptions(block_size=16 << 20),
+            parse_options=pa_json.ParseOptions(explicit_schema=SCHEMA, unexpected_field_behavior="ignore")
+        )
+        pending: List[pa.RecordBatch] = []
+        rows = 0
+        for block in reader:
+            pending.append(block)
+            rows += block.num_rows
+            if rows < batch_rows:
+                continue
+            table = pa.Table.from_batches(pending).select(SCHEMA.names).cast(SCHEMA)
+            full = rows - rows % batch_rows
+            for i in range(0, full, batch_rows):
+                yield table.slice(i, batch_rows)
+                done += batch_rows
+            pending, rows = table.slice(full).to_batches(), rows - full
+        if rows:
+            yield pa.Table.from_batches(pending).select(SCHEMA.names).cast(SCHEMA)
+        return
+    except (pa.ArrowInvalid, pa.ArrowTypeError) as e:
+        print(f"⚠️ {path}: {e} - falling back to line-by-line parsing after row {done}", file=sys.stderr)
+    
+    batch = []
+    for record in read_records(path, skip=done):
+        batch.append(record)
+        if len(batch) == batch_rows:
+            yield pa.Table.from_pylist(batch, schema=SCHEMA)
+            batch = []
+    if batch:
+        yield pa.Table.from_pylist(batch, schema=SCHEMA)
+
+def export(log_path: str, out_path: str, batch_rows: int) -> int:
+    """JSONL log -> Parquet (zstd), one row group per batch"""
+    total = 0
+    with pq.ParquetWriter(out_path, SCHEMA, compression="zstd") as writer:
+        for segment in log_segments(log_path):
+            for table in read_segment(segment, batch_rows):
+                writer.write_table(table, row_group_size=batch_rows)
+                total += table.num_rows
+    return total
+
+# ========== QUERIES ==========
+def scan(path: str, columns: List[str]) -> Iterator[pa.RecordBatch]:
+    """Only the needed columns, one row group at a time (memory-mapped)"""
+    parquet = pq.ParquetFile(path, memory_map=True)
+    for i in range(parquet.num_row_groups):
+        yield from parquet.read_row_group(i, columns=columns).to_batches()
+
+def top_keywords(path: str, limit: int) -> Dict[str, Dict[str, int]]:
+    """Most frequent keywords per ISO week"""
+    counts: Dict[str, Dict[str, int]] = {}
+    for batch in scan(path, ["timestamp", "keywords"]):
+        keywords = batch.column("keywords")
+        weeks = pc.strftime(
+            pc.floor_temporal(batch.column("timestamp"), unit="week", week_starts_monday=True), "%Y-%m-%d"
+        )
+        flat = pa.table({
+            "week": pc.take(weeks, pc.list_parent_indices(keywords)),
+            "keyword": pc.list_flatten(keywords)
+        })
+        for row in flat.group_by(["week", "keyword"]).aggregate([("keyword", "count")]).to_pylist():
+            if row["week"] is None:
+                continue  # no usable timestamp
+            week = counts.setdefault(row["week"], {})
+            week[row["keyword"]] = week.get(row["keyword"], 0) + row["keyword_count"]
+    return {
+        week: dict(sorted(kw.items(), key=lambda item: item[1], reverse=True)[:limit])
+        for week, kw in sorted(counts.items())
+    }
+
+def stressed_users(path: str) -> List[Dict]:
+    """Distinct stressed users per chat"""
+    users: Dict[int, set] = {}
+    titles: Dict[int, str] = {}
+    for batch in scan(path, ["chat_id", "chat_title", "user_id", "sentiment"]):
+        stressed = pa.Table.from_batches([batch]).filter(pc.equal(batch.column("sentiment"), "stressed"))
+        for row in stressed.group_by(["chat_id", "user_id"]).aggregate([("chat_title", "max")]).to_pylist():
+            users.setdefault(row["chat_id"], set()).add(row["user_id"])
+            titles[row["chat_id"]] = row["chat_title_max"]
+    return sorted(
+        ({"chat_id": chat, "chat_title": titles.get(chat), "stressed_users": len(ids)} for chat, ids in users.items()),
+        key=lambda row: row["stressed_users"], reverse=True
+    )
+
+def questions_by_hour(path: str) -> List[int]:
+    """Question volume per hour of day (older records without is_question fall back to '?')"""
+    hours = [0] * 24
+    for batch in scan(path, ["timestamp", "text", "is_question"]):
+        is_question = pc.fill_null(
+            batch.column("is_question"), pc.match_substring(pc.fill_null(batch.column("text"), ""), "?")
+        )
+        hour = pc.filter(pc.hour(batch.column("timestamp")), pc.fill_null(is_question, False))
+        for row in pa.table({"hour": hour}).group_by("hour").aggregate([("hour", "count")]).to_pylist():
+            if row["hour"] is not None:
+                hours[row["hour"]] += row["hour_count"]
+    return hours
+
+# ========== CLI ==========
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Japa Genie conversation analytics")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    export_cmd = commands.add_parser("export", help="compact the JSONL log into Parquet")
+    export_cmd.add_argument("log", nargs="?", default="visa_intelligence.jsonl")
+    export_cmd.add_argument("-o", "--out", default="conversations.parquet")
+    export_cmd.add_argument("--batch-rows", type=int, default=100_000)
+    
+    keywords_cmd = commands.add_parser("top-keywords", help="top keywords by week")
+    keywords_cmd.add_argument("parquet")
+    keywords_cmd.add_argument("--limit", type=int, default=10)
+    
+    stressed_cmd = commands.add_parser("stressed-users", help="stressed users per chat")
+    stressed_cmd.add_argument("parquet")
+    
+    hours_cmd = commands.add_parser("questions-by-hour", help="question volume by hour of day")
+    hours_cmd.add_argument("parquet")
+    
+    args = parser.parse_args(argv)
+    if args.command == "export":
+        total = export(args.log, args.out, args.batch_rows)
+        print(f"✅ Exported {total} records to {args.out}")
+    elif args.command == "top-keywords":
+        for week, keywords in top_keywords(args.parquet, args.limit).items():
+            print(f"{week}: " + ", ".join(f"{k} ({n})" for k, n in keywords.items()))
+    elif args.command == "stressed-users":
+        for row in stressed_users(args.parquet):
+            print(f"{row['stressed_users']:>6}  {row['chat_title'] or row['chat_id']}")
+    elif args.command == "questions-by-hour":
+        hours = questions_by_hour(args.parquet)
+        peak = max(max(hours), 1)
+        for hour, count in enumerate(hours):
+            print(f"{hour:02d}:00  {count:>8}  {'█' * (count * 40 // peak)}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,30 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 import httpx
 import os
 import random
 import asyncio
+import bisect
+import fcntl
+import glob
+import gzip
+import hashlib
+from collections import OrderedDict, deque
 from datetime import datetime
+import itertools
 import json
 import logging
-from typing import Dict, List, Optional
-import google.generativeai as genai
-
-app = FastAPI()
+import math
+import queue
+import re
+import shutil
+import signal
+import sqlite3
+import sys
+import threading
+import time
+from typing import Awaitable, Dict, List, Optional, Tuple, Union
 
 # ========== CONFIGURATION ==========
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -18,13 +32,286 @@ GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")  # Your Google AI key
 BOT_NAME = "Japa Genie"
 VERSION = "3.0 - AI Powered"
 
+# Gemini model. gemini-pro (1.0) rejects system instructions, so the static
+# persona + knowledge prefix is sent inline for it and as a system instruction
+# for newer models. Either way the prefix is sent, and billed, on every call:
+# GenerativeModel copies system_instruction into each request. Only building
+# the string is saved; explicit context caching (CachedContent) needs a far
+# larger prompt than this prefix, so it is not used.
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-pro")
+GEMINI_SYSTEM_INSTRUCTION = os.getenv(
+    "GEMINI_SYSTEM_INSTRUCTION",
+    "0" if GEMINI_MODEL.startswith(("gemini-pro", "gemini-1.0")) else "1"
+) == "1"
+
+# Gemini call limits (keep the event loop free while the model thinks)
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_TIMEOUT = float(os.getenv("GEMINI_TIMEOUT", "20"))
+
+# Past this deadline the user gets a cached or template answer while the call
+# finishes in the background and fills the cache (seconds, 0 = off)
+GEMINI_DEADLINE = float(os.getenv("GEMINI_DEADLINE", "0"))
+
+# Faster/smaller models in order (e.g. "gemini-1.5-flash"), used when the
+# primary is tripped or more than GEMINI_FAST_LOAD of the call slots are busy
+GEMINI_FAST_MODELS = [m.strip() for m in os.getenv("GEMINI_FAST_MODELS", "").split(",") if m.strip()]
+GEMINI_FAST_LOAD = float(os.getenv("GEMINI_FAST_LOAD", "0.75"))
+
+# Circuit breaker per model: trips when too many recent calls failed or were slow
+BREAKER_WINDOW = int(os.getenv("BREAKER_WINDOW", "20"))          # recent calls considered
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATIO = float(os.getenv("BREAKER_FAILURE_RATIO", "0.5"))
+BREAKER_SLOW_CALL = float(os.getenv("BREAKER_SLOW_CALL", "8"))    # seconds; slower counts as a failure
+BREAKER_COOLDOWN = float(os.getenv("BREAKER_COOLDOWN", "30"))     # seconds open before probing
+BREAKER_PROBES = int(os.getenv("BREAKER_PROBES", "1"))            # concurrent half-open probe calls
+
+# Telegram Bot API connection pool
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "https://api.telegram.org")
+TELEGRAM_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_MAX_CONNECTIONS", "100"))
+TELEGRAM_MAX_KEEPALIVE = int(os.getenv("TELEGRAM_MAX_KEEPALIVE", "20"))
+TELEGRAM_TIMEOUT = float(os.getenv("TELEGRAM_TIMEOUT", "10"))
+
+# Telegram send limits (messages/second)
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", str(20 / 60)))
+TYPING_COALESCE_WINDOW = float(os.getenv("TYPING_COALESCE_WINDOW", "5"))  # typing shows ~5s
+
+# Webhook job queue
+QUEUE_BACKEND = os.getenv("QUEUE_BACKEND", "memory")  # memory | sqlite
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH", "jobs.sqlite3")
+QUEUE_WORKERS = int(os.getenv("QUEUE_WORKERS", "8"))
+QUEUE_MAX_SIZE = int(os.getenv("QUEUE_MAX_SIZE", "1000"))
+QUEUE_SHED_POLICY = os.getenv("QUEUE_SHED_POLICY", "drop_oldest")  # drop_oldest | drop_newest
+QUEUE_MAX_ATTEMPTS = int(os.getenv("QUEUE_MAX_ATTEMPTS", "3"))
+QUEUE_RETRY_BASE = float(os.getenv("QUEUE_RETRY_BASE", "1.0"))  # seconds, doubled per attempt
+QUEUE_DRAIN_TIMEOUT = float(os.getenv("QUEUE_DRAIN_TIMEOUT", "10"))
+
+# Telegram retries webhooks; remember update_ids this long
+DEDUP_TTL = float(os.getenv("DEDUP_TTL", "3600"))
+DEDUP_MAX_ENTRIES = int(os.getenv("DEDUP_MAX_ENTRIES", "100000"))
+DEDUP_DB_PATH = os.getenv("DEDUP_DB_PATH")  # shared store for multi-worker deployments
+
+# Knowledge retrieval: top-k knowledge-base bullets per prompt (0 = send it all)
+KNOWLEDGE_TOP_K = int(os.getenv("KNOWLEDGE_TOP_K", "6"))
+
+# Answer cache for repeated immigration questions
+RESPONSE_CACHE_BACKEND = os.getenv("RESPONSE_CACHE_BACKEND", "memory")  # memory | sqlite | off
+RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH", "response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "21600"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+RESPONSE_CACHE_MIN_SIMILARITY = float(os.getenv("RESPONSE_CACHE_MIN_SIMILARITY", "0.75"))  # Jaccard
+# Looser match accepted when the model is down or past its deadline
+RESPONSE_CACHE_DEGRADED_SIMILARITY = float(os.getenv("RESPONSE_CACHE_DEGRADED_SIMILARITY", "0.5"))
+
+# Per-user conversation memory
+MEMORY_TURNS = int(os.getenv("MEMORY_TURNS", "6"))             # turns kept verbatim
+MEMORY_TURN_CHARS = int(os.getenv("MEMORY_TURN_CHARS", "300"))  # longer turns are clipped
+MEMORY_IDLE_TTL = float(os.getenv("MEMORY_IDLE_TTL", "3600"))
+MEMORY_MAX_BYTES = int(os.getenv("MEMORY_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# Conversation log (JSONL, written in batches off the event loop)
+CONVERSATION_LOG_PATH = os.getenv("CONVERSATION_LOG_PATH", "visa_intelligence.jsonl")
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "200"))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", "1.0"))
+LOG_ROTATE_BYTES = int(os.getenv("LOG_ROTATE_BYTES", str(64 * 1024 * 1024)))  # 0 = never rotate
+STATS_CHECKPOINT_PATH = os.getenv("STATS_CHECKPOINT_PATH", CONVERSATION_LOG_PATH + ".stats.json")
+STATS_CHECKPOINT_INTERVAL = float(os.getenv("STATS_CHECKPOINT_INTERVAL", "10"))  # seconds
+
+# Group bursts: answer messages arriving within the window with one reply
+AGGREGATE_WINDOW = float(os.getenv("AGGREGATE_WINDOW", "4"))  # seconds, 0 = off
+AGGREGATE_MAX_BATCH = int(os.getenv("AGGREGATE_MAX_BATCH", "5"))
+
+# Group pre-filter: mentions of / replies to the bot are always answered, and
+# reply sampling is keyed on (seed, chat, message) so replays decide the same way
+TELEGRAM_BOT_USERNAME = os.getenv("TELEGRAM_BOT_USERNAME", "").lstrip("@")
+SAMPLING_SEED = os.getenv("SAMPLING_SEED", "japa-genie")
+
+# Private chats see the reply grow via editMessageText while Gemini streams
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # seconds between edits
+
+# Per-request sampling profiler (send "X-Profile: 1" on a webhook call)
+PROFILE_REQUESTS = os.getenv("PROFILE_REQUESTS", "0") == "1"
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+
+# Optional keyword file (one phrase per line), picked up again when it changes
+VISA_KEYWORDS_FILE = os.getenv("VISA_KEYWORDS_FILE")
+
 # Setup logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Configure Gemini AI
-genai.configure(api_key=GEMINI_API_KEY)
-model = genai.GenerativeModel('gemini-pro')
+# Configure Gemini AI on first use: the SDK import is most of a cold start,
+# and health checks or ignored updates never need it
+genai = None
+model = None
+_gemini_lock = threading.Lock()
+
+def _load_gemini():
+    """Import and configure the Gemini SDK and the default model (idempotent)"""
+    global genai, model
+    with _gemini_lock:
+        if genai is None:
+            import google.generativeai as sdk
+            sdk.configure(api_key=GEMINI_API_KEY)
+            genai = sdk
+        if model is None:
+            model = genai.GenerativeModel(GEMINI_MODEL)
+
+# ========== METRICS ==========
+# Prometheus text exposition with preallocated buckets. Everything runs on the
+# event loop (or bumps plain ints under the GIL), so the hot path takes no locks.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+STAGE_BUCKETS = (0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 1500, 2000, 3000, 5000, 8000)
+
+class Histogram:
+    """Fixed-bucket histogram; observe() is a bisect and three increments"""
+    
+    __slots__ = ("buckets", "counts", "sum", "count")
+    
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+class MetricsRegistry:
+    """Histograms, counters and scrape-time gauges, keyed by (name, label value)"""
+    
+    def __init__(self):
+        self._help: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._label_names: Dict[str, str] = {}
+        self._histograms: Dict[str, Dict[str, Histogram]] = {}
+        self._bucket_sets: Dict[str, tuple] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+        self._gauges: Dict[str, object] = {}  # name -> callable returning {label value: number}
+    
+    def histogram(self, name: str, help_text: str, buckets, label: str = "", values=()):
+        self._help[name] = ("histogram", help_text)
+        self._label_names[name] = label
+        self._bucket_sets[name] = tuple(buckets)
+        self._histograms[name] = {value: Histogram(buckets) for value in (values if label else ("",))}
+    
+    def counter(self, name: str, help_text: str, label: str = ""):
+        self._help[name] = ("counter", help_text)
+        self._label_names[name] = label
+        self._counters[name] = {}
+    
+    def gauge(self, name: str, help_text: str, read, label: str = ""):
+        self._help[name] = ("gauge", help_text)
+        self._label_names[name] = label
+        self._gauges[name] = read
+    
+    def observe(self, name: str, value: float, label: str = ""):
+        series = self._histograms[name]
+        histogram = series.get(label)
+        if histogram is None:
+            histogram = series[label] = Histogram(self._bucket_sets[name])
+        histogram.observe(value)
+    
+    def inc(self, name: str, amount: float = 1, label: str = ""):
+        series = self._counters[name]
+        series[label] = series.get(label, 0) + amount
+    
+    def _labels(self, name: str, value: str, extra: str = "") -> str:
+        parts = [f'{self._label_names[name]}="{value}"'] if self._label_names[name] else []
+        if extra:
+            parts.append(extra)
+        return "{" + ",".join(parts) + "}" if parts else ""
+    
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text) in self._help.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for value, h in list(self._histograms[name].items()):
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                        lines.append(f"{name}_bucket{self._labels(name, value, le)} {cumulative}")
+                    lines.append(f"{name}_sum{self._labels(name, value)} {h.sum}")
+                    lines.append(f"{name}_count{self._labels(name, value)} {h.count}")
+            elif kind == "counter":
+                for value, count in list(self._counters[name].items()):
+                    lines.append(f"{name}{self._labels(name, value)} {count}")
+            else:
+                try:
+                    readings = self._gauges[name]()
+                except Exception as e:
+                    logger.error(f"❌ Gauge {name} error: {e}")
+                    continue
+                for value, reading in readings.items():
+                    lines.append(f"{name}{self._labels(name, value)} {reading}")
+        return "\n".join(lines) + "\n"
+
+metrics = MetricsRegistry()
+metrics.histogram("japa_webhook_ack_seconds", "Time to acknowledge a webhook", LATENCY_BUCKETS)
+metrics.histogram("japa_stage_seconds", "process_message stage latency", STAGE_BUCKETS, "stage",
+                  ("keyword_detection", "sentiment", "logging", "should_respond"))
+metrics.histogram("japa_gemini_seconds", "Gemini call latency", LATENCY_BUCKETS, "mode", ("complete", "stream"))
+metrics.histogram("japa_gemini_prompt_tokens", "Prompt tokens per Gemini call", TOKEN_BUCKETS)
+metrics.counter("japa_gemini_tokens_total", "Gemini tokens", "kind")
+metrics.counter("japa_replies_total", "Replies produced", "source")  # model | cache | degraded_cache | fallback
+metrics.counter("japa_gemini_deadline_missed_total", "Replies sent without waiting for a slow Gemini call")
+metrics.counter("japa_duplicate_updates_total", "Redelivered Telegram updates dropped")
+metrics.histogram("japa_telegram_seconds", "Telegram Bot API call latency", LATENCY_BUCKETS, "method")
+metrics.counter("japa_telegram_errors_total", "Failed Telegram Bot API calls", "method")
+
+class SamplingProfiler:
+    """SIGPROF stack sampler for one request at a time (main thread only)"""
+    
+    def __init__(self, interval: float = PROFILE_INTERVAL):
+        self.interval = interval
+        self.active = False
+        self.samples: Dict[str, int] = {}
+    
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+            frame = frame.f_back
+        key = ";".join(reversed(stack))
+        self.samples[key] = self.samples.get(key, 0) + 1
+    
+    def start(self) -> bool:
+        if self.active or threading.current_thread() is not threading.main_thread():
+            return False
+        self.active = True
+        self.samples = {}
+        signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        return True
+    
+    def stop(self, label: str) -> Optional[str]:
+        """Stop sampling and write collapsed stacks (flamegraph.pl / speedscope format)"""
+        if not self.active:
+            return None
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+        self.active = False
+        path = os.path.join(PROFILE_DIR, f"profile-{label}-{int(time.time())}.folded")
+        try:
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            with open(path, "w") as f:
+                for stack, count in sorted(self.samples.items(), key=lambda item: item[1], reverse=True):
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            logger.error(f"❌ Profile write error: {e}")
+            return None
+        logger.info(f"🔬 Profile for {label}: {sum(self.samples.values())} samples -> {path}")
+        return path
+
+profiler = SamplingProfiler()
 
 # ========== PERSONALITY SYSTEM ==========
 PERSONALITY_PROMPT = """
@@ -149,30 +436,669 @@ PROCESSING TIMES (Approximate):
 - Australia 189: 8-12 months
 """
 
+# ========== KNOWLEDGE RETRIEVAL ==========
+KNOWLEDGE_STOPWORDS = {
+    "a", "an", "the", "and", "or", "to", "of", "in", "on", "for", "is", "it", "i", "my", "me",
+    "you", "your", "we", "do", "does", "can", "be", "with", "how", "what", "when", "where",
+    "why", "this", "that", "am", "are", "was", "there", "any", "anyone", "about", "get", "from",
+    "please", "pls", "know", "now", "long", "guys", "hi", "hello", "someone", "much", "need"
+}
+
+# Words that point a query at one country's section
+COUNTRY_ALIASES = {
+    "canada": {"canada", "canadian", "crs", "pnp", "ircc", "pgwp", "express", "wes", "cad"},
+    "usa": {"usa", "us", "america", "american", "h-1b", "l-1", "o-1", "uscis", "green"},
+    "uk": {"uk", "britain", "british", "england", "london", "ilr", "brexit", "nhs"},
+    "germany": {"germany", "german", "blue", "anabin", "berlin", "eur"},
+    "australia": {"australia", "australian", "skillselect", "189", "190", "482", "aud"}
+}
+
+KNOWLEDGE_TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+def _knowledge_terms(text: str) -> List[str]:
+    """Lowercase tokens without stopwords, with a crude plural strip"""
+    terms = []
+    for token in KNOWLEDGE_TOKEN_RE.findall(text.lower()):
+        if token in KNOWLEDGE_STOPWORDS:
+            continue
+        if len(token) > 4 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        terms.append(token)
+    return terms
+
+class KnowledgeIndex:
+    """Local BM25 over knowledge-base bullets, tagged by country and topic"""
+    
+    COUNTRY_BOOST = 1.5
+    
+    def __init__(self, knowledge: str, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks: List[Dict] = []
+        for block in knowledge.strip().split("\n\n"):
+            lines = [line.strip() for line in block.strip().splitlines() if line.strip()]
+            if not lines:
+                continue
+            title = lines[0]
+            first_word = title.split()[0].lower()
+            country = first_word if first_word in COUNTRY_ALIASES else None
+            for line in lines[1:]:
+                terms = _knowledge_terms(title + " " + line)
+                line_terms = _knowledge_terms(line)
+                # Cross-country sections ("PROCESSING TIMES") name the country per line
+                line_country = country or next(
+                    (c for c, aliases in COUNTRY_ALIASES.items() if line_terms and line_terms[0] in aliases), None
+                )
+                self.chunks.append({
+                    "title": title,
+                    "country": line_country,
+                    "text": line,
+                    "tf": {t: terms.count(t) for t in set(terms)},
+                    "length": len(terms)
+                })
+        
+        self.avg_length = sum(c["length"] for c in self.chunks) / max(len(self.chunks), 1)
+        doc_freq: Dict[str, int] = {}
+        for chunk in self.chunks:
+            for term in chunk["tf"]:
+                doc_freq[term] = doc_freq.get(term, 0) + 1
+        n = len(self.chunks)
+        self.idf = {t: math.log(1 + (n - df + 0.5) / (df + 0.5)) for t, df in doc_freq.items()}
+    
+    def search(self, query: str, keywords: Optional[List[str]] = None, k: int = KNOWLEDGE_TOP_K) -> List[Dict]:
+        """Top-k chunks for a message and its detected visa keywords"""
+        query_terms = list(dict.fromkeys(_knowledge_terms(query + " " + " ".join(keywords or []))))
+        # Aliases ("london", "ircc") rarely appear in the knowledge base itself,
+        # so countries come from the whole query, before the vocabulary filter
+        countries = {c for c, aliases in COUNTRY_ALIASES.items() if aliases.intersection(query_terms)}
+        terms = [t for t in query_terms if t in self.idf]
+        if not terms:
+            return []
+        
+        scored = []
+        for i, chunk in enumerate(self.chunks):
+            norm = self.k1 * (1 - self.b + self.b * chunk["length"] / self.avg_length)
+            score = 0.0
+            for term in terms:
+                tf = chunk["tf"].get(term)
+                if tf:
+                    score += self.idf[term] * tf * (self.k1 + 1) / (tf + norm)
+            if score and chunk["country"] in countries:
+                score *= self.COUNTRY_BOOST
+            if score:
+                scored.append((score, i))
+        
+        top = sorted(scored, reverse=True)[:k]
+        return [self.chunks[i] for _, i in sorted(top, key=lambda item: item[1])]
+    
+    def render(self, chunks: List[Dict]) -> str:
+        """Chunks grouped under their section titles, in knowledge-base order"""
+        lines = []
+        title = None
+        for chunk in chunks:
+            if chunk["title"] != title:
+                title = chunk["title"]
+                lines.append(title)
+            lines.append(chunk["text"])
+        return "\n".join(lines)
+
+knowledge_index = KnowledgeIndex(IMMIGRATION_KNOWLEDGE)
+
+# ========== RESPONSE CACHE ==========
+class ResponseCache:
+    """Exact + near-duplicate answer cache with LRU/TTL eviction and a memory cap"""
+    
+    NEAR_CANDIDATES = 200  # most recent entries per scope compared for near-duplicates
+    
+    def __init__(self, ttl: float = RESPONSE_CACHE_TTL, max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+                 min_similarity: float = RESPONSE_CACHE_MIN_SIMILARITY):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.min_similarity = min_similarity
+        self.stats = {"lookups": 0, "hits": 0, "near_hits": 0, "misses": 0, "saved_seconds": 0.0}
+    
+    @staticmethod
+    def _features(message: str, context: Dict) -> Tuple[str, str, frozenset]:
+        """(scope, exact key, term set) for a question in its context"""
+        terms = frozenset(_knowledge_terms(message))
+        # Near-duplicates must share chat kind and detected keywords; group
+        # replies are truncated, so they never stand in for private ones
+        scope = ("private" if context.get('chat_type') == "private" else "group") + "|" + \
+            ",".join(sorted(context.get('keywords') or []))
+        return scope, scope + "|" + " ".join(sorted(terms)), terms
+    
+    @staticmethod
+    def _size(key: str, terms: frozenset, response: str) -> int:
+        """Bytes an entry holds, as counted against max_bytes"""
+        return sys.getsizeof(key) + sys.getsizeof(terms) + sys.getsizeof(response)
+    
+    @staticmethod
+    def _similar(a: frozenset, b: frozenset, threshold: float) -> bool:
+        """Jaccard similarity of the two questions' terms"""
+        union = len(a | b)
+        return union > 0 and len(a & b) / union >= threshold
+    
+    async def get(self, message: str, context: Dict, expected_latency: float = 0.0,
+                  min_similarity: Optional[float] = None) -> Optional[str]:
+        """Cached reply for this question (or a near-identical one), if fresh"""
+        self.stats["lookups"] += 1
+        threshold = self.min_similarity if min_similarity is None else min_similarity
+        response = await self._lookup(*self._features(message, context), threshold)
+        if response is None:
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["saved_seconds"] += expected_latency
+        return response
+    
+    async def put(self, message: str, context: Dict, response: str):
+        await self._store(*self._features(message, context), response)
+    
+    def hit_rate(self) -> float:
+        return self.stats["hits"] / self.stats["lookups"] if self.stats["lookups"] else 0.0
+
+class MemoryResponseCache(ResponseCache):
+    """Per-process cache"""
+    
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._entries = OrderedDict()  # key -> (scope, terms, response, created), LRU first
+        self._scopes: Dict[str, OrderedDict] = {}  # scope -> keys, least recent first
+        self._bytes = 0
+    
+    def _remove(self, key: str):
+        scope, terms, response, _ = self._entries.pop(key)
+        self._bytes -= self._size(key, terms, response)
+        keys = self._scopes[scope]
+        keys.pop(key, None)
+        if not keys:
+            del self._scopes[scope]
+    
+    def _touch(self, scope: str, key: str):
+        self._entries.move_to_end(key)
+        self._scopes[scope].move_to_end(key)
+    
+    async def _lookup(self, scope: str, key: str, terms: frozenset, threshold: float) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            for candidate in list(reversed(self._scopes.get(scope, {})))[:self.NEAR_CANDIDATES]:
+                if self._similar(terms, self._entries[candidate][1], threshold):
+                    key, entry = candidate, self._entries[candidate]
+                    self.stats["near_hits"] += 1
+                    break
+        if entry is None:
+            return None
+        if entry[3] < time.time() - self.ttl:
+            self._remove(key)
+            return None
+        self._touch(scope, key)
+        return entry[2]
+    
+    async def _store(self, scope: str, key: str, terms: frozenset, response: str):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (scope, terms, response, time.time())
+        self._scopes.setdefault(scope, OrderedDict())[key] = None
+        self._bytes += self._size(key, terms, response)
+        while self._bytes > self.max_bytes and self._entries:
+            self._remove(next(iter(self._entries)))
+
+class SQLiteResponseCache(ResponseCache):
+    """On-disk cache shared by workers and kept across restarts"""
+    
+    def __init__(self, path: str = RESPONSE_CACHE_DB_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY, scope TEXT NOT NULL, terms TEXT NOT NULL, response TEXT NOT NULL,
+                size INTEGER NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL
+            )
+        """)
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_scope ON responses (scope, accessed)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)")
+    
+    def _lookup_sync(self, scope: str, key: str, terms: frozenset, threshold: float) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT key, response FROM responses WHERE key = ? AND created >= ?", (key, now - self.ttl)
+            ).fetchone()
+            if row is None:
+                for c_key, c_terms, c_response in self._db.execute(
+                    "SELECT key, terms, response FROM responses WHERE scope = ? AND created >= ? "
+                    "ORDER BY accessed DESC LIMIT ?",
+                    (scope, now - self.ttl, self.NEAR_CANDIDATES)
+                ).fetchall():
+                    if self._similar(terms, frozenset(c_terms.split()), threshold):
+                        row = (c_key, c_response)
+                        self.stats["near_hits"] += 1
+                        break
+            if row is None:
+                return None
+            self._db.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, row[0]))
+            return row[1]
+    
+    def _store_sync(self, scope: str, key: str, terms: frozenset, response: str):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (key, scope, " ".join(sorted(terms)), response, self._size(key, terms, response), now, now)
+            )
+            self._db.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+            (total,) = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()
+            if total > self.max_bytes:
+                # Drop least recently used rows until back under the cap
+                self._db.execute("""
+                    DELETE FROM responses WHERE key IN (
+                        SELECT key FROM (
+                            SELECT key, SUM(size) OVER (ORDER BY accessed, key) AS running FROM responses
+                        ) WHERE running - size < ?
+                    )
+                """, (total - self.max_bytes,))
+    
+    async def _lookup(self, scope: str, key: str, terms: frozenset, threshold: float) -> Optional[str]:
+        return await asyncio.to_thread(self._lookup_sync, scope, key, terms, threshold)
+    
+    async def _store(self, scope: str, key: str, terms: frozenset, response: str):
+        await asyncio.to_thread(self._store_sync, scope, key, terms, response)
+
+def _make_response_cache() -> Optional[ResponseCache]:
+    if RESPONSE_CACHE_BACKEND == "sqlite":
+        return SQLiteResponseCache()
+    if RESPONSE_CACHE_BACKEND == "memory":
+        return MemoryResponseCache()
+    return None
+
+response_cache = _make_response_cache()
+
+# ========== CONVERSATION MEMORY ==========
+class Conversation:
+    """Last few turns of one user in one chat, plus a rolling summary of older ones"""
+    
+    __slots__ = ("turns", "topics", "earlier_question", "last_seen", "size")
+    
+    def __init__(self, max_turns: int):
+        self.turns: deque = deque(maxlen=max_turns)  # (role, text)
+        self.topics: List[str] = []
+        self.earlier_question = ""
+        self.last_seen = 0.0
+        self.size = 0
+
+class ConversationMemory:
+    """Per-chat/per-user ring buffers with idle eviction and a global byte ceiling"""
+    
+    # Measured with benchmarks/memory.py; text is counted with sys.getsizeof, since
+    # non-ASCII text (any emoji) takes 2-4 bytes per character
+    OVERHEAD = 1100  # bytes per conversation beyond its text (deque, dict slot, key)
+    TURN_OVERHEAD = 64  # (role, text) tuple + deque slot
+    TOPIC_OVERHEAD = 16  # list slot; topic strings are the matcher's own keywords
+    MAX_TOPICS = 8
+    
+    def __init__(self, max_turns: int = MEMORY_TURNS, turn_chars: int = MEMORY_TURN_CHARS,
+                 idle_ttl: float = MEMORY_IDLE_TTL, max_bytes: int = MEMORY_MAX_BYTES):
+        self.max_turns = max_turns
+        self.turn_chars = turn_chars
+        self.idle_ttl = idle_ttl
+        self.max_bytes = max_bytes
+        self._conversations = OrderedDict()  # (chat_id, user_id) -> Conversation, least recent first
+        self._bytes = 0
+        self.stats = {"evicted_idle": 0, "evicted_full": 0}
+    
+    def __len__(self) -> int:
+        return len(self._conversations)
+    
+    @property
+    def bytes_used(self) -> int:
+        return self._bytes
+    
+    def _drop(self, key, reason: str):
+        conversation = self._conversations.pop(key)
+        self._bytes -= conversation.size + self.OVERHEAD
+        self.stats[reason] += 1
+    
+    def _evict(self, now: float):
+        cutoff = now - self.idle_ttl
+        while self._conversations:
+            key, oldest = next(iter(self._conversations.items()))
+            if oldest.last_seen < cutoff:
+                self._drop(key, "evicted_idle")
+            elif self._bytes > self.max_bytes:
+                self._drop(key, "evicted_full")
+            else:
+                break
+    
+    def add(self, key, role: str, text: str, keywords: Optional[List[str]] = None):
+        """Append a turn; the turn it pushes out is folded into the summary"""
+        now = time.time()
+        conversation = self._conversations.get(key)
+        if conversation is None:
+            conversation = self._conversations[key] = Conversation(self.max_turns)
+            self._bytes += self.OVERHEAD
+        else:
+            self._conversations.move_to_end(key)
+        conversation.last_seen = now
+        
+        size = conversation.size
+        if len(conversation.turns) == self.max_turns:
+            old_role, old_text = conversation.turns[0]
+            size -= sys.getsizeof(old_text) + self.TURN_OVERHEAD
+            if old_role == "user":
+                if conversation.earlier_question:
+                    size -= sys.getsizeof(conversation.earlier_question)
+                conversation.earlier_question = old_text[:120]
+                if conversation.earlier_question:
+                    size += sys.getsizeof(conversation.earlier_question)
+        if len(text) > self.turn_chars:
+            text = text[:self.turn_chars - 3] + "..."
+        conversation.turns.append((role, text))
+        size += sys.getsizeof(text) + self.TURN_OVERHEAD
+        
+        if keywords:
+            topics = conversation.topics
+            size -= len(topics) * self.TOPIC_OVERHEAD
+            for keyword in keywords:
+                if keyword in topics:
+                    topics.remove(keyword)
+                topics.append(keyword)
+            del topics[:-self.MAX_TOPICS]
+            size += len(topics) * self.TOPIC_OVERHEAD
+        
+        self._bytes += size - conversation.size
+        conversation.size = size
+        self._evict(now)
+    
+    def active(self, key) -> bool:
+        """Whether render(key) would return any history"""
+        conversation = self._conversations.get(key)
+        return conversation is not None and time.time() - conversation.last_seen <= self.idle_ttl
+    
+    def render(self, key) -> str:
+        """Summary + recent turns for the prompt (bounded size)"""
+        conversation = self._conversations.get(key)
+        if conversation is None or time.time() - conversation.last_seen > self.idle_ttl:
+            return ""
+        lines = []
+        if conversation.topics:
+            lines.append(f"- Topics so far: {', '.join(conversation.topics)}")
+        if conversation.earlier_question:
+            lines.append(f'- Earlier they asked: "{conversation.earlier_question}"')
+        for role, text in conversation.turns:
+            lines.append(f'- {"User" if role == "user" else "You"}: "{text}"')
+        return "\n".join(lines)
+
+# ========== CIRCUIT BREAKER ==========
+class ModelUnavailable(Exception):
+    """Every model tier is tripped; answer without calling Gemini"""
+
+class CircuitBreaker:
+    """Closed -> open when too many recent calls failed or ran slow; half-open probes after a cooldown"""
+    
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+    
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_ratio: float = BREAKER_FAILURE_RATIO, slow_call: float = BREAKER_SLOW_CALL,
+                 cooldown: float = BREAKER_COOLDOWN, probes: int = BREAKER_PROBES):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_ratio = failure_ratio
+        self.slow_call = slow_call
+        self.cooldown = cooldown
+        self.probes = probes
+        self.state = self.CLOSED
+        self._outcomes: deque = deque(maxlen=window)  # True = failed or slow
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = 0
+        self.stats = {"calls": 0, "failures": 0, "slow": 0, "rejected": 0, "trips": 0}
+    
+    def acquire(self) -> Optional[str]:
+        """State the call was admitted under, or None if it must not be made"""
+        if self.state == self.OPEN:
+            if time.monotonic() - self._opened_at < self.cooldown:
+                self.stats["rejected"] += 1
+                return None
+            self.state = self.HALF_OPEN
+            self._probing = 0
+            logger.info(f"🔌 Breaker {self.name}: half-open, probing")
+        if self.state == self.HALF_OPEN:
+            if self._probing >= self.probes:
+                self.stats["rejected"] += 1
+                return None
+            self._probing += 1
+        return self.state
+    
+    def record(self, admitted: str, elapsed: Optional[float]):
+        """Outcome of an admitted call: its latency, or None if it failed"""
+        slow = elapsed is not None and elapsed > self.slow_call
+        failed = elapsed is None or slow
+        self.stats["calls"] += 1
+        self.stats["failures"] += elapsed is None
+        self.stats["slow"] += slow
+        if admitted != self.state:
+            # Started before the last transition; says nothing about the current state
+            if admitted == self.HALF_OPEN:
+                self._probing = max(0, self._probing - 1)
+            return
+        if self.state == self.HALF_OPEN:
+            self._probing -= 1
+            self._trip() if failed else self._close()
+            return
+        if len(self._outcomes) == self._outcomes.maxlen:
+            self._failures -= self._outcomes[0]
+        self._outcomes.append(failed)
+        self._failures += failed
+        if len(self._outcomes) >= self.min_calls and self._failures >= self.failure_ratio * len(self._outcomes):
+            self._trip()
+    
+    def release(self, admitted: str):
+        """The admitted call never finished (cancelled)"""
+        if admitted == self.HALF_OPEN and self.state == self.HALF_OPEN:
+            self._probing = max(0, self._probing - 1)
+    
+    def _trip(self):
+        self.state = self.OPEN
+        self._opened_at = time.monotonic()
+        self.stats["trips"] += 1
+        logger.warning(f"🔌 Breaker {self.name}: open for {self.cooldown:.0f}s")
+    
+    def _close(self):
+        self.state = self.CLOSED
+        self._outcomes.clear()
+        self._failures = 0
+        logger.info(f"🔌 Breaker {self.name}: closed")
+    
+    def snapshot(self) -> Dict:
+        return dict(self.stats, state=self.state)
+
 # ========== AI CONVERSATION ENGINE ==========
 class AIConversationEngine:
     """Gemini-powered empathetic conversation"""
     
-    def __init__(self):
-        self.conversation_history = {}  # Store per user
-        
-    async def generate_response(self, user_message: str, context: Dict) -> str:
-        """Generate empathetic AI response"""
-        try:
-            # Build context-aware prompt
-            current_date = datetime.now().strftime("%B %d, %Y")
-            
-            full_prompt = f"""
+    def __init__(self, use_system_instruction: bool = GEMINI_SYSTEM_INSTRUCTION,
+                 fast_models: Optional[List[str]] = None):
+        self.conversation_history = ConversationMemory()  # Store per user
+        self._gemini_slots = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+        self._inflight = 0
+        self.use_system_instruction = use_system_instruction
+        self._prefix_date = None
+        self._prefix = ""
+        self._prefix_model = None
+        # Primary first, then faster tiers; each tier trips on its own
+        self.tiers = [GEMINI_MODEL] + list(GEMINI_FAST_MODELS if fast_models is None else fast_models)
+        self.breakers = {name: CircuitBreaker(name) for name in self.tiers}
+        self.tier_models: Dict[str, object] = {}  # fast tier name -> model instance
+        self._background: set = set()
+        self.token_stats = {"calls": 0, "prompt_tokens": 0, "output_tokens": 0}
+        self.latency_ema = 0.0  # recent Gemini latency, credited to cache hits
+    
+    def _static_prefix(self) -> str:
+        """Persona + knowledge base, rebuilt only when the date changes"""
+        current_date = datetime.now().strftime("%B %d, %Y")
+        if current_date != self._prefix_date:
+            self._prefix = f"""
 {PERSONALITY_PROMPT.format(current_date=current_date)}
-
+"""
+            # Without retrieval the whole knowledge base rides along in the prefix
+            if KNOWLEDGE_TOP_K <= 0:
+                self._prefix += f"""
 KNOWLEDGE BASE:
 {IMMIGRATION_KNOWLEDGE}
-
+"""
+            self._prefix_date = current_date
+            self._prefix_model = None
+            if self.use_system_instruction:
+                self.tier_models.clear()
+        return self._prefix
+    
+    async def _ensure_gemini(self, tier: str = GEMINI_MODEL):
+        """Load the SDK in a thread the first time a reply is needed, so acks keep flowing"""
+        needs_sdk = self.use_system_instruction or (tier != GEMINI_MODEL and tier not in self.tier_models)
+        if model is None or (needs_sdk and genai is None):
+            await asyncio.to_thread(_load_gemini)
+    
+    def _model_and_prompt(self, message_prompt: str, tier: str = GEMINI_MODEL):
+        """Pick the model instance and the text that must be sent for this message"""
+        prefix = self._static_prefix()
+        if tier != GEMINI_MODEL:
+            gemini = self.tier_models.get(tier)
+            if gemini is None:
+                gemini = self.tier_models[tier] = genai.GenerativeModel(
+                    tier, **({"system_instruction": prefix} if self.use_system_instruction else {})
+                )
+            return gemini, message_prompt if self.use_system_instruction else prefix + message_prompt
+        if not self.use_system_instruction:
+            return model, prefix + message_prompt
+        if self._prefix_model is None:
+            self._prefix_model = genai.GenerativeModel(GEMINI_MODEL, system_instruction=prefix)
+        return self._prefix_model, message_prompt
+    
+    def _admit(self) -> Tuple[str, str]:
+        """(tier, admitted state) for the next call: the primary unless it is tripped or
+        the call slots are nearly full, in which case the next faster tier that is closed"""
+        start = 1 if len(self.tiers) > 1 and self._inflight >= GEMINI_FAST_LOAD * GEMINI_MAX_CONCURRENCY else 0
+        # Under load prefer the fast tiers, but a busy primary beats no answer
+        for tier in self.tiers[start:] + self.tiers[:start]:
+            admitted = self.breakers[tier].acquire()
+            if admitted is not None:
+                return tier, admitted
+        raise ModelUnavailable("every Gemini tier is tripped")
+    
+    def _record_usage(self, response):
+        """Track prompt/output token counts reported by Gemini"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+        output_tokens = getattr(usage, "candidates_token_count", 0) or 0
+        self.token_stats["calls"] += 1
+        self.token_stats["prompt_tokens"] += prompt_tokens
+        self.token_stats["output_tokens"] += output_tokens
+        if prompt_tokens:
+            metrics.observe("japa_gemini_prompt_tokens", prompt_tokens)
+        metrics.inc("japa_gemini_tokens_total", prompt_tokens, "prompt")
+        metrics.inc("japa_gemini_tokens_total", output_tokens, "output")
+        logger.info(f"🧮 Tokens: prompt={prompt_tokens} output={output_tokens}")
+        
+    async def _call_model(self, prompt: str):
+        """Run one Gemini call without blocking the event loop"""
+        tier, admitted = self._admit()
+        return await self._complete(tier, admitted, prompt)
+    
+    async def _complete(self, tier: str, admitted: str, prompt: str):
+        breaker = self.breakers[tier]
+        self._inflight += 1
+        try:
+            await self._ensure_gemini(tier)
+            gemini, prompt = self._model_and_prompt(prompt, tier)
+            async with self._gemini_slots:
+                started = time.perf_counter()
+                if hasattr(gemini, "generate_content_async"):
+                    call = gemini.generate_content_async(prompt)
+                else:
+                    call = asyncio.to_thread(gemini.generate_content, prompt)
+                response = await asyncio.wait_for(call, timeout=GEMINI_TIMEOUT)
+                elapsed = time.perf_counter() - started
+        except asyncio.CancelledError:
+            breaker.release(admitted)
+            raise
+        except Exception:
+            breaker.record(admitted, None)
+            raise
+        finally:
+            self._inflight -= 1
+        breaker.record(admitted, elapsed)
+        metrics.observe("japa_gemini_seconds", elapsed, "complete")
+        self.latency_ema = elapsed if not self.latency_ema else 0.8 * self.latency_ema + 0.2 * elapsed
+        self._record_usage(response)
+        return response
+    
+    async def _call_with_deadline(self, prompt: str, user_message: str, context: Dict, cacheable: bool):
+        """Model response, or None once GEMINI_DEADLINE passes (the call keeps going)"""
+        if GEMINI_DEADLINE <= 0:
+            return await self._call_model(prompt)
+        call = asyncio.ensure_future(self._call_model(prompt))
+        done, _ = await asyncio.wait({call}, timeout=GEMINI_DEADLINE)
+        if done:
+            return call.result()
+        metrics.inc("japa_gemini_deadline_missed_total")
+        logger.warning(f"⏱️ No reply within {GEMINI_DEADLINE}s deadline, answering without the model")
+        self._spawn(self._late_reply(call, user_message, context, cacheable))
+        return None
+    
+    async def _late_reply(self, call, user_message: str, context: Dict, cacheable: bool):
+        """Let a call that missed its deadline finish, caching a shareable answer for the next asker"""
+        try:
+            response = await call
+        except Exception:
+            return  # already counted by the breaker
+        if not cacheable:
+            return
+        reply = self._limit(response.text.strip(), context)
+        if reply:
+            await response_cache.put(user_message, context, reply)
+    
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+        
+    def _cacheable(self, context: Dict, history_key) -> bool:
+        """Topical first turns only: the cache key has no user in it, so a shared
+        reply must not be shaped by one user's name or earlier conversation.
+        Aggregated bursts are skipped too: their text carries speaker names,
+        so the key would never come round again."""
+        return response_cache is not None and bool(context.get('keywords')) \
+            and not context.get('aggregated') and not self.conversation_history.active(history_key)
+    
+    def _build_prompt(self, user_message: str, context: Dict, history_key, cacheable: bool = False) -> str:
+        """Per-message part of the prompt; the static prefix is added by _model_and_prompt"""
+        knowledge = ""
+        if KNOWLEDGE_TOP_K > 0:
+            chunks = knowledge_index.search(user_message, context.get('keywords'))
+            if chunks:
+                knowledge = f"""
+KNOWLEDGE BASE (relevant excerpts):
+{knowledge_index.render(chunks)}
+"""
+        
+        history = "" if cacheable else self.conversation_history.render(history_key)
+        if history:
+            history = f"""
+RECENT CONVERSATION WITH THIS USER:
+{history}
+"""
+        # Cached answers are shared between users, so they must not greet anyone by name
+        user_name = "not shown (this answer is shared; don't use a name)" if cacheable \
+            else context.get('user_name', 'Friend')
+        
+        return f"""{knowledge}{history}
 CONVERSATION CONTEXT:
 - User said: "{user_message}"
 - Chat type: {context.get('chat_type', 'private')}
 - Detected topics: {', '.join(context.get('keywords', [])) if context.get('keywords') else 'General chat'}
-- User name: {context.get('user_name', 'Friend')}
+- User name: {user_name}
 
 TASK:
 Respond as Japa Genie - warm, personal, helpful. Reference specific knowledge when relevant.
@@ -181,27 +1107,208 @@ Show empathy, share brief experiences, give actionable advice.
 
 YOUR RESPONSE:
 """
+    
+    @staticmethod
+    def _limit(text: str, context: Dict) -> str:
+        """Ensure it's not too long (max 500 chars for group chat)"""
+        if context.get('chat_type') != 'private' and len(text) > 500:
+            return text[:497] + "..."
+        return text
+    
+    async def _cached(self, user_message: str, context: Dict, history_key, cacheable: bool) -> Optional[str]:
+        # Only topical first turns are cached; chit-chat and follow-ups should stay fresh
+        if not cacheable:
+            return None
+        cached = await response_cache.get(user_message, context, self.latency_ema)
+        if cached:
+            logger.info(f"💾 Cache hit ({response_cache.hit_rate():.0%} hit rate)")
+            metrics.inc("japa_replies_total", label="cache")
+            self._remember(history_key, user_message, cached, context)
+        return cached
+    
+    async def _finish(self, user_message: str, context: Dict, history_key, ai_response: str, cacheable: bool):
+        logger.info(f"🤖 AI Response generated: {len(ai_response)} chars")
+        metrics.inc("japa_replies_total", label="model")
+        if cacheable:
+            await response_cache.put(user_message, context, ai_response)
+        self._remember(history_key, user_message, ai_response, context)
+        
+    async def generate_response(self, user_message: str, context: Dict) -> str:
+        """Generate empathetic AI response"""
+        try:
+            history_key = (context.get('chat_id'), context.get('user_id'))
+            cacheable = self._cacheable(context, history_key)
+            cached = await self._cached(user_message, context, history_key, cacheable)
+            if cached:
+                return cached
+            
+            full_prompt = self._build_prompt(user_message, context, history_key, cacheable)
             
             # Generate with Gemini
-            response = model.generate_content(full_prompt)
+            response = await self._call_with_deadline(full_prompt, user_message, context, cacheable)
+            if response is None:
+                return await self._degraded_response(user_message, context, history_key)
             
             # Clean up response
-            ai_response = response.text.strip()
-            
-            # Ensure it's not too long (max 500 chars for group chat)
-            if context.get('chat_type') != 'private' and len(ai_response) > 500:
-                ai_response = ai_response[:497] + "..."
+            ai_response = self._limit(response.text.strip(), context)
             
-            logger.info(f"🤖 AI Response generated: {len(ai_response)} chars")
+            await self._finish(user_message, context, history_key, ai_response, cacheable)
             return ai_response
             
+        except asyncio.TimeoutError:
+            logger.error(f"⏱️ AI generation timed out after {GEMINI_TIMEOUT}s")
+            return await self._degraded_response(user_message, context, history_key)
+        except ModelUnavailable as e:
+            logger.warning(f"🔌 {e}, answering without the model")
+            return await self._degraded_response(user_message, context, history_key)
         except Exception as e:
             logger.error(f"❌ AI generation error: {e}")
-            # Fallback to personality-driven template
-            return self._fallback_response(user_message, context)
+            # Fallback to a looser cache match or a personality-driven template
+            return await self._degraded_response(user_message, context, history_key)
+    
+    async def stream_response(self, user_message: str, context: Dict):
+        """Yield the reply text as it grows, for progressive message edits"""
+        history_key = (context.get('chat_id'), context.get('user_id'))
+        cacheable = self._cacheable(context, history_key)
+        reply = ""
+        try:
+            cached = await self._cached(user_message, context, history_key, cacheable)
+            if cached:
+                yield cached
+                return
+            
+            full_prompt = self._build_prompt(user_message, context, history_key, cacheable)
+            tier, admitted = self._admit()
+            try:
+                await self._ensure_gemini(tier)
+                gemini, prompt = self._model_and_prompt(full_prompt, tier)
+            except asyncio.CancelledError:
+                self.breakers[tier].release(admitted)
+                raise
+            except Exception:
+                # Counted like a failed call, as _complete does; a half-open probe must not leak
+                self.breakers[tier].record(admitted, None)
+                raise
+            if not hasattr(gemini, "generate_content_async"):
+                response = await self._complete(tier, admitted, full_prompt)
+                reply = response.text
+                yield self._limit(reply.strip(), context)
+            else:
+                async for reply in self._stream_tier(tier, admitted, gemini, prompt, context):
+                    yield reply.strip()
+        except Exception as e:
+            if isinstance(e, ModelUnavailable):
+                logger.warning(f"🔌 {e}, answering without the model")
+            elif isinstance(e, asyncio.TimeoutError) and not reply:
+                metrics.inc("japa_gemini_deadline_missed_total")
+                logger.warning("⏱️ No first chunk before the deadline, answering without the model")
+            else:
+                logger.error(f"❌ AI streaming error: {e}")
+            if not reply:
+                yield await self._degraded_response(user_message, context, history_key)
+            else:
+                # The user saw a cut-off reply: it must not be cached or remembered
+                metrics.inc("japa_replies_total", label="fallback")
+            return
+        
+        reply = self._limit(reply.strip(), context)
+        if reply:
+            await self._finish(user_message, context, history_key, reply, cacheable)
+    
+    async def _stream_tier(self, tier: str, admitted: str, gemini, prompt: str, context: Dict):
+        """Yield the limited reply as it grows. A separate task reads the model while
+        holding the call slot, so a slow consumer (throttled Telegram edits) never
+        keeps a slot busy; it just gets fewer, longer updates"""
+        updates: asyncio.Queue = asyncio.Queue()
+        reader = asyncio.ensure_future(self._read_stream(tier, admitted, gemini, prompt, context, updates))
+        reader.add_done_callback(lambda _: updates.put_nowait(None))
+        try:
+            while True:
+                texts = [await updates.get()]
+                while not updates.empty():
+                    texts.append(updates.get_nowait())
+                newest = next((text for text in reversed(texts) if text is not None), None)
+                if newest is not None:
+                    yield newest
+                if texts[-1] is None:
+                    break
+            await reader  # raises what the read failed with
+        finally:
+            if not reader.done():
+                reader.cancel()
+    
+    async def _read_stream(self, tier: str, admitted: str, gemini, prompt: str, context: Dict,
+                           updates: asyncio.Queue):
+        """Put the limited reply on `updates` as chunks arrive; the breaker sees time to first chunk"""
+        breaker = self.breakers[tier]
+        first_wait = min(GEMINI_TIMEOUT, GEMINI_DEADLINE) if GEMINI_DEADLINE > 0 else GEMINI_TIMEOUT
+        reply = ""
+        first_chunk = None
+        self._inflight += 1
+        try:
+            async with self._gemini_slots:
+                started = time.perf_counter()
+                response = await asyncio.wait_for(
+                    gemini.generate_content_async(prompt, stream=True), timeout=first_wait
+                )
+                chunks = response.__aiter__()
+                while True:
+                    # Until the first chunk, the deadline covers the call and the chunk together
+                    wait = GEMINI_TIMEOUT if first_chunk is not None else \
+                        max(0.0, started + first_wait - time.perf_counter())
+                    try:
+                        chunk = await asyncio.wait_for(chunks.__anext__(), timeout=wait)
+                    except StopAsyncIteration:
+                        break
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - started
+                        breaker.record(admitted, first_chunk)
+                    reply += chunk.text
+                    limited = self._limit(reply, context)
+                    updates.put_nowait(limited)
+                    # Truncate on the fly: stop reading once the group limit is hit
+                    if limited != reply:
+                        break
+                elapsed = time.perf_counter() - started
+        except asyncio.CancelledError:
+            if first_chunk is None:
+                breaker.release(admitted)
+            raise
+        except Exception:
+            if first_chunk is None:
+                breaker.record(admitted, None)
+            raise
+        finally:
+            self._inflight -= 1
+        if first_chunk is None:
+            breaker.record(admitted, elapsed)  # empty stream
+        metrics.observe("japa_gemini_seconds", elapsed, "stream")
+        self.latency_ema = elapsed if not self.latency_ema else 0.8 * self.latency_ema + 0.2 * elapsed
+        self._record_usage(response)
+    
+    async def _degraded_response(self, user_message: str, context: Dict, history_key) -> str:
+        """Best answer without the model: a looser cache match, else a template"""
+        if response_cache is not None and context.get('keywords'):
+            try:
+                cached = await response_cache.get(user_message, context,
+                                                  min_similarity=RESPONSE_CACHE_DEGRADED_SIMILARITY)
+            except Exception as e:
+                logger.error(f"❌ Cache error: {e}")
+                cached = None
+            if cached:
+                metrics.inc("japa_replies_total", label="degraded_cache")
+                self._remember(history_key, user_message, cached, context)
+                return cached
+        return self._fallback_response(user_message, context)
+    
+    def _remember(self, key, user_message: str, reply: str, context: Dict):
+        """Record both sides of the exchange in the user's conversation memory"""
+        self.conversation_history.add(key, "user", user_message, context.get('keywords'))
+        self.conversation_history.add(key, "assistant", reply)
     
     def _fallback_response(self, message: str, context: Dict) -> str:
         """Fallback responses if AI fails"""
+        metrics.inc("japa_replies_total", label="fallback")
         visa_detected = len(context.get('keywords', [])) > 0
         
         if visa_detected:
@@ -220,111 +1327,1025 @@ YOUR RESPONSE:
         return random.choice(responses)
 
 # ========== SENTIMENT ANALYSIS ==========
+# Weighted lexicon: phrase -> weight in (0, 1]. Matched on whole tokens, so
+# "can" no longer fires on "canada" nor "hard" on "hardly".
+SENTIMENT_LEXICON = {
+    "stress": {
+        "stressed": 0.9, "stress": 0.6, "stressful": 0.8, "worried": 0.8, "worry": 0.6,
+        "anxious": 0.9, "anxiety": 0.8, "scared": 0.8, "nervous": 0.7, "overwhelmed": 0.9,
+        "frustrated": 0.8, "frustrating": 0.7, "confused": 0.6, "confusing": 0.5,
+        "difficult": 0.5, "hard": 0.4, "struggling": 0.8, "rejected": 0.7, "refused": 0.7
+    },
+    "positive": {
+        "excited": 0.8, "happy": 0.6, "approved": 0.9, "accepted": 0.8, "got it": 0.5,
+        "success": 0.7, "successful": 0.7, "yes !": 0.6, "finally": 0.5, "thank you": 0.4,
+        "thanks": 0.4, "congrats": 0.6, "congratulations": 0.6
+    },
+    # Question words count fully at the start of a sentence, partly elsewhere
+    "question": {
+        "?": 0.9, "how": 0.6, "what": 0.6, "when": 0.6, "where": 0.6, "why": 0.6,
+        "which": 0.5, "can": 0.6, "could": 0.6, "should": 0.6, "would": 0.6,
+        "is it": 0.5, "is there": 0.5, "are there": 0.5, "do i": 0.6, "does": 0.5,
+        "anyone know": 0.7, "help": 0.5
+    }
+}
+NEGATIONS = {"not", "no", "never", "dont", "don't", "isnt", "isn't", "wasnt", "wasn't",
+             "arent", "aren't", "cant", "can't", "cannot", "wont", "won't", "without", "hardly"}
+NEGATION_WINDOW = 3          # tokens before a hit that can negate it
+MID_SENTENCE_QUESTION = 0.5  # weight factor for question words not opening a sentence
+SENTIMENT_THRESHOLD = float(os.getenv("SENTIMENT_THRESHOLD", "0.5"))
+
+# Only "n't" stays attached (it negates); "what's" splits into "what" + "s"
+SENTIMENT_TOKEN_RE = re.compile(r"[a-z0-9]+(?:'t(?![a-z]))?|[?!.]")
+SENTENCE_ENDS = {"?", "!", "."}
+
+def _compile_lexicon(lexicon: Dict[str, Dict[str, float]]):
+    """Single-token entries as a plain dict, longer phrases indexed by first token (longest first)"""
+    words: Dict[str, Tuple[str, float]] = {}
+    phrases: Dict[str, List[Tuple[Tuple[str, ...], str, float]]] = {}
+    for category, entries in lexicon.items():
+        for phrase, weight in entries.items():
+            tokens = tuple(phrase.split())
+            if len(tokens) == 1:
+                words[tokens[0]] = (category, weight)
+            else:
+                phrases.setdefault(tokens[0], []).append((tokens, category, weight))
+    for entries in phrases.values():
+        entries.sort(key=lambda e: len(e[0]), reverse=True)
+    return words, phrases
+
+_SENTIMENT_WORDS, _SENTIMENT_PHRASES = _compile_lexicon(SENTIMENT_LEXICON)
+# Tokens analyze() has to look at; every other token is skipped with one set test
+_SENTIMENT_TOKENS = frozenset(_SENTIMENT_WORDS) | frozenset(_SENTIMENT_PHRASES) | NEGATIONS | SENTENCE_ENDS
+
 class SentimentAnalyzer:
     """Detect emotional tone and respond appropriately"""
     
+    # Result for text with no lexicon hit (most chatter); copied, callers keep it in context
+    NEUTRAL = {
+        'stress_score': 0.0, 'positive_score': 0.0, 'question_score': 0.0,
+        'is_stressed': False, 'is_positive': False, 'is_question': False,
+        'needs_empathy': False, 'needs_celebration': False
+    }
+    
     def analyze(self, text: str) -> Dict:
         """Analyze sentiment and emotional state"""
-        text_lower = text.lower()
-        
-        # Stress/Anxiety indicators
-        stress_words = ['stressed', 'worried', 'anxious', 'scared', 'nervous', 'overwhelmed', 
-                       'frustrated', 'confused', 'difficult', 'hard', 'struggling']
-        
-        # Positive/Excited indicators
-        positive_words = ['excited', 'happy', 'approved', 'accepted', 'got it', 'success', 
-                         'yes!', 'finally', 'approved', 'thank you']
-        
-        # Question indicators
-        question_words = ['how', 'what', 'when', 'where', 'why', 'can', 'should', 'would', 
-                         'is it', 'do i', 'help', '?']
-        
-        sentiment = {
-            'is_stressed': any(word in text_lower for word in stress_words),
-            'is_positive': any(word in text_lower for word in positive_words),
-            'is_question': any(word in text_lower for word in question_words),
-            'needs_empathy': False,
-            'needs_celebration': False
-        }
+        tokens = SENTIMENT_TOKEN_RE.findall(text.lower())
+        # Noisy-OR accumulators: score = 1 - prod(1 - weight)
+        misses = {"stress": 1.0, "positive": 1.0, "question": 1.0}
+        scored = False
+        sentence_start = 0
+        last_negation = -NEGATION_WINDOW - 1
         
-        # Determine response type
-        if sentiment['is_stressed']:
-            sentiment['needs_empathy'] = True
-        if sentiment['is_positive']:
-            sentiment['needs_celebration'] = True
+        resume = 0  # first token after the last phrase hit
+        for i, token in enumerate(tokens):
+            if token not in _SENTIMENT_TOKENS or i < resume:
+                continue
+            if token in NEGATIONS:
+                last_negation = i
+            
+            # A plain dict hit; only a few tokens open a longer phrase
+            hit = _SENTIMENT_WORDS.get(token)
+            length = 1
+            for phrase, category, weight in _SENTIMENT_PHRASES.get(token, ()):
+                if tuple(tokens[i:i + len(phrase)]) == phrase:
+                    hit, length = (category, weight), len(phrase)
+                    break
             
-        return sentiment
+            if hit:
+                category, weight = hit
+                if category == "question":
+                    if token != "?" and i != sentence_start:
+                        weight *= MID_SENTENCE_QUESTION
+                elif i - last_negation <= NEGATION_WINDOW and last_negation >= sentence_start:
+                    # "not worried" leans positive, "not happy" leans stressed
+                    category = "positive" if category == "stress" else "stress"
+                    weight *= 0.5
+                misses[category] *= 1.0 - weight
+                scored = True
+            resume = i + length
+            
+            if token in SENTENCE_ENDS:
+                sentence_start = resume
+        
+        if not scored:
+            return dict(self.NEUTRAL)
+        stress = round(1.0 - misses["stress"], 3)
+        positive = round(1.0 - misses["positive"], 3)
+        question = round(1.0 - misses["question"], 3)
+        return {
+            'stress_score': stress,
+            'positive_score': positive,
+            'question_score': question,
+            'is_stressed': stress >= SENTIMENT_THRESHOLD,
+            'is_positive': positive >= SENTIMENT_THRESHOLD,
+            'is_question': question >= SENTIMENT_THRESHOLD,
+            # Determine response type
+            'needs_empathy': stress >= SENTIMENT_THRESHOLD,
+            'needs_celebration': positive >= SENTIMENT_THRESHOLD
+        }
 
 # ========== VISA INTELLIGENCE ==========
+DEFAULT_VISA_KEYWORDS = [
+    # Core terms
+    "visa", "immigration", "immigrate", "migrate", "relocation", "relocate",
+    "work permit", "residence permit", "green card", "citizenship", "passport",
+    
+    # Visa types
+    "student visa", "tourist visa", "business visa", "work visa", "family visa",
+    "skilled worker", "express entry", "provincial nominee", "h-1b", "l-1 visa",
+    "eu blue card", "schengen", "tier 2", "skilled independent",
+    
+    # Process terms
+    "visa application", "visa renewal", "sponsorship", "documentation",
+    "consulate", "embassy", "interview", "biometrics", "medical exam",
+    "police clearance", "background check", "coe", "certificate of eligibility",
+    
+    # Country-specific
+    "canada pr", "usa green card", "uk visa", "australia pr", "germany visa",
+    "japan visa", "residence card", "permanent residence", "temporary residence",
+    
+    # Common questions
+    "how to apply", "visa requirements", "processing time", "visa fee",
+    "ielts", "language test", "proof of funds", "job offer", "invitation letter"
+]
+
+class KeywordMatcher:
+    """All phrases compiled into one trie-shaped regex: a single pass, whole words only"""
+    
+    TOKEN_RE = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*", re.IGNORECASE)
+    
+    def __init__(self, keywords: List[str]):
+        self.keywords = list(dict.fromkeys(k.strip().lower() for k in keywords if k.strip()))
+        self._lookup: Dict[str, str] = {}  # normalized matched text -> keyword
+        phrases = {}
+        for keyword in self.keywords:
+            tokens = tuple(self.TOKEN_RE.findall(keyword))
+            if tokens:
+                phrases[keyword] = tokens
+                self._lookup[" ".join(tokens)] = keyword
+                # Accept simple plurals on the last word ("visas", "work permits")
+                self._lookup.setdefault(" ".join(tokens) + "s", keyword)
+        
+        # Every match starts with one of these tokens
+        self.first_tokens = frozenset(key.split(" ", 1)[0] for key in self._lookup)
+        
+        # Shared prefixes are factored out so the regex engine never retries
+        # sixty alternatives at each position; greedy optionals keep the
+        # longest phrase ("student visa" over "visa", "visa fee" over "visa")
+        body = self._trie_pattern(self._lookup)
+        self._pattern = r"(?<![\w-])" + body + r"(?![\w-])" if body else None
+        self._regex = re.compile(self._pattern) if body else None
+        self._regex_nocase = None
+        
+        # Shorter phrases that start where a longer one does ("visa" in "visa fee"),
+        # as (keyword, token count)
+        self._prefixes: Dict[str, List[Tuple[str, int]]] = {}
+        # Later tokens of a phrase that can start another one ("visa" in "work visa",
+        # for "visa application"): the scan resumes after a match, so these are tried in place
+        self._inner_starts: Dict[str, Tuple[int, ...]] = {}
+        for keyword, tokens in phrases.items():
+            for other, inner in phrases.items():
+                if len(inner) < len(tokens) and tokens[:len(inner)] == inner:
+                    self._prefixes.setdefault(keyword, []).append((other, len(inner)))
+            starts = tuple(i for i in range(1, len(tokens)) if tokens[i] in self.first_tokens)
+            if starts:
+                self._inner_starts[keyword] = starts
+    
+    @staticmethod
+    def _trie_pattern(phrases) -> str:
+        trie: Dict = {}
+        for phrase in phrases:
+            node = trie
+            for char in phrase:
+                node = node.setdefault(char, {})
+            node[""] = {}
+        
+        def emit(node: Dict) -> str:
+            branches = [
+                (r"\s+" if char == " " else re.escape(char)) + emit(child)
+                for char, child in sorted(node.items()) if char
+            ]
+            if not branches:
+                return ""
+            pattern = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+            return "(?:" + pattern + ")?" if "" in node else pattern
+        
+        return emit(trie)
+    
+    def find(self, text: str) -> List[Tuple[str, int, int]]:
+        """Return (keyword, start, end) for every phrase found in text"""
+        if self._regex is None:
+            return []
+        lowered = text.lower()
+        if len(lowered) == len(text):
+            regex = self._regex
+        else:
+            # Rare code points change length when lowered; keep positions exact
+            if self._regex_nocase is None:
+                self._regex_nocase = re.compile(self._pattern, re.IGNORECASE)
+            regex, lowered = self._regex_nocase, text
+        
+        matches = []
+        for m in regex.finditer(lowered):
+            self._add(regex, lowered, m, m.end(), matches)
+        return matches
+    
+    def _add(self, regex: re.Pattern, text: str, m: re.Match, resume: int, matches: List):
+        """Record a match, the shorter phrases sharing its start, and phrases that
+        start at its later tokens before `resume`, where the scan picks up again"""
+        found = m.group()
+        keyword = self._lookup.get(found) or self._lookup.get(" ".join(found.lower().split()))
+        if keyword is None:
+            return
+        start = m.start()
+        matches.append((keyword, start, m.end()))
+        prefixes = self._prefixes.get(keyword)
+        inner = self._inner_starts.get(keyword)
+        if prefixes is None and inner is None:
+            return
+        spans = [t.span() for t in self.TOKEN_RE.finditer(found)]
+        for other, n in prefixes or ():
+            matches.append((other, start, start + spans[n - 1][1]))
+        for i in inner or ():
+            position = start + spans[i][0]
+            if position < resume:
+                overlap = regex.match(text, position)
+                if overlap is not None:
+                    self._add(regex, text, overlap, resume, matches)
+
 class VisaIntelligence:
     """Enhanced visa keyword detection"""
     
-    def __init__(self):
-        self.visa_keywords = [
-            # Core terms
-            "visa", "immigration", "immigrate", "migrate", "relocation", "relocate",
-            "work permit", "residence permit", "green card", "citizenship", "passport",
-            
-            # Visa types
-            "student visa", "tourist visa", "business visa", "work visa", "family visa",
-            "skilled worker", "express entry", "provincial nominee", "h-1b", "l-1 visa",
-            "eu blue card", "schengen", "tier 2", "skilled independent",
-            
-            # Process terms
-            "visa application", "visa renewal", "sponsorship", "documentation",
-            "consulate", "embassy", "interview", "biometrics", "medical exam",
-            "police clearance", "background check", "coe", "certificate of eligibility",
-            
-            # Country-specific
-            "canada pr", "usa green card", "uk visa", "australia pr", "germany visa",
-            "japan visa", "residence card", "permanent residence", "temporary residence",
-            
-            # Common questions
-            "how to apply", "visa requirements", "processing time", "visa fee",
-            "ielts", "language test", "proof of funds", "job offer", "invitation letter"
-        ]
+    # Phrases dropped when any of these words appear in the same message
+    EXCLUSIONS = {"visa": ("credit", "debit")}
+    _BLOCKERS = {keyword: re.compile(r"(?<![\w-])(?:" + "|".join(words) + r")(?![\w-])", re.IGNORECASE)
+                 for keyword, words in EXCLUSIONS.items()}
+    RELOAD_CHECK_INTERVAL = 30  # seconds between keyword file mtime checks
+    
+    def __init__(self, keywords_file: Optional[str] = VISA_KEYWORDS_FILE):
+        self.keywords_file = keywords_file
+        self._file_mtime = None
+        self._next_reload_check = 0.0
+        self.matcher = KeywordMatcher(DEFAULT_VISA_KEYWORDS)
+        if keywords_file:
+            self.reload()
+    
+    @property
+    def visa_keywords(self) -> List[str]:
+        return self.matcher.keywords
+    
+    def reload(self, path: Optional[str] = None) -> bool:
+        """Rebuild the matcher from a keyword file (one phrase per line, # comments)"""
+        path = path or self.keywords_file
+        try:
+            mtime = os.path.getmtime(path)
+            with open(path, "r", encoding="utf-8") as f:
+                keywords = [line.split("#", 1)[0] for line in f]
+            matcher = KeywordMatcher(keywords)
+        except Exception as e:
+            logger.error(f"❌ Keyword reload error: {e}")
+            return False
+        
+        # Swap in one assignment so concurrent detect() calls never see a half-built matcher
+        self.matcher = matcher
+        self.keywords_file = path
+        self._file_mtime = mtime
+        logger.info(f"🔑 Loaded {len(matcher.keywords)} visa keywords from {path}")
+        return True
+    
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if now < self._next_reload_check:
+            return
+        self._next_reload_check = now + self.RELOAD_CHECK_INTERVAL
+        try:
+            if os.path.getmtime(self.keywords_file) != self._file_mtime:
+                self.reload()
+        except OSError:
+            pass
+    
+    def find(self, text: str) -> List[Tuple[str, int, int]]:
+        """Keyword matches with their character positions"""
+        if self.keywords_file:
+            self._maybe_reload()
+        matches = self.matcher.find(text)
+        if not matches:
+            return matches
+        
+        # Avoid false positives; a substring test spares most messages the
+        # case-insensitive whole-word scan
+        lowered = None
+        for keyword, words in self.EXCLUSIONS.items():
+            if any(m[0] == keyword for m in matches):
+                lowered = lowered or text.lower()
+                if (not lowered.isascii() or any(word in lowered for word in words)) \
+                        and self._BLOCKERS[keyword].search(text):
+                    matches = [m for m in matches if m[0] != keyword]
+        return matches
         
     def detect(self, text: str) -> List[str]:
         """Detect visa-related keywords"""
-        text_lower = text.lower()
-        detected = []
+        return list(dict.fromkeys(m[0] for m in self.find(text)))  # Remove duplicates
+
+# ========== TELEGRAM API ==========
+class TelegramAPI:
+    """Every outbound Bot API call goes through one pooled client"""
+    
+    def __init__(self, bot_token: str, base_url: str = TELEGRAM_API_BASE):
+        self.bot_token = bot_token
+        self.base_url = base_url.rstrip("/")
+        self._client: Optional[httpx.AsyncClient] = None
+        
+    async def start(self):
+        """Open the shared client (keep-alive + HTTP/2)"""
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                http2=True,
+                timeout=httpx.Timeout(TELEGRAM_TIMEOUT, connect=5.0),
+                limits=httpx.Limits(
+                    max_connections=TELEGRAM_MAX_CONNECTIONS,
+                    max_keepalive_connections=TELEGRAM_MAX_KEEPALIVE,
+                    keepalive_expiry=60.0
+                )
+            )
+    
+    async def close(self):
+        """Close the shared client"""
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+    
+    async def call(self, method: str, payload: Dict) -> Dict:
+        """Call a Bot API method and return the decoded reply"""
+        # Serverless runtimes may skip lifespan hooks, so open on demand
+        await self.start()
+        url = f"{self.base_url}/bot{self.bot_token}/{method}"
+        started = time.perf_counter()
+        try:
+            response = await self._client.post(url, json=payload)
+            result = response.json()
+        except Exception:
+            metrics.inc("japa_telegram_errors_total", label=method)
+            raise
+        finally:
+            metrics.observe("japa_telegram_seconds", time.perf_counter() - started, method)
+        if not result.get("ok"):
+            metrics.inc("japa_telegram_errors_total", label=method)
+        return result
+    
+    async def send_message(self, chat_id, text: str, parse_mode: Optional[str] = "Markdown") -> Dict:
+        """sendMessage"""
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        return await self.call("sendMessage", payload)
+    
+    async def send_chat_action(self, chat_id, action: str = "typing") -> Dict:
+        """sendChatAction"""
+        return await self.call("sendChatAction", {"chat_id": chat_id, "action": action})
+
+telegram = TelegramAPI(TELEGRAM_BOT_TOKEN)
+
+# ========== OUTBOUND DISPATCHER ==========
+class TokenBucket:
+    """Classic token bucket; refills continuously at rate tokens/second"""
+    
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+    
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+    
+    def take(self):
+        self.tokens -= 1
+
+class TimerWheel:
+    """Hashed timer wheel: one ticking task for every scheduled callback"""
+    
+    def __init__(self, tick: float = 0.05, slots: int = 512):
+        self.tick = tick
+        self.slots: List[List] = [[] for _ in range(slots)]
+        self._position = 0
+        self._pending = 0
+        self._task: Optional[asyncio.Task] = None
+    
+    def schedule(self, delay: float, callback):
+        """Run callback() after roughly delay seconds (rounded up to a tick)"""
+        ticks = max(1, int(math.ceil(delay / self.tick)))
+        # The first slot visited is position + 1, so `ticks` from now is offset + 1
+        rounds, offset = divmod(ticks - 1, len(self.slots))
+        self.slots[(self._position + offset + 1) % len(self.slots)].append([rounds, callback])
+        self._pending += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self):
+        next_tick = time.monotonic()
+        while self._pending:
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - time.monotonic()))
+            self._position = (self._position + 1) % len(self.slots)
+            slot = self.slots[self._position]
+            due = [entry for entry in slot if entry[0] == 0]
+            if due:
+                slot[:] = [entry for entry in slot if entry[0] > 0]
+            for entry in slot:
+                entry[0] -= 1
+            for _, callback in due:
+                self._pending -= 1
+                try:
+                    callback()
+                except Exception as e:
+                    logger.error(f"❌ Timer callback error: {e}")
+    
+    def cancel_all(self):
+        for slot in self.slots:
+            slot.clear()
+        self._pending = 0
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+class OutboundDispatcher:
+    """Rate-limited, ordered per-chat sending with 429 back-off and typing coalescing"""
+    
+    def __init__(self, api: TelegramAPI, global_rate: float = TELEGRAM_GLOBAL_RATE,
+                 chat_rate: float = TELEGRAM_CHAT_RATE, group_rate: float = TELEGRAM_GROUP_RATE,
+                 typing_window: float = TYPING_COALESCE_WINDOW):
+        self.api = api
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.typing_window = typing_window
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.wheel = TimerWheel()
+        self._chat_buckets: Dict = {}
+        self._bucket_sweep_at = 10000    # sweep idle chat buckets past this many
+        self._pending: Dict = {}         # chat_id -> deque of (method, payload, future)
+        self._ready: deque = deque()     # chats with work, not busy, not paused
+        self._queued: set = set()        # chats currently in _ready
+        self._busy: set = set()          # chats with a request in flight (keeps per-chat order)
+        self._paused_until: Dict = {}    # chat_id -> monotonic time (429 retry_after)
+        self._last_typing: Dict = {}     # chat_id -> monotonic time
+        self._pump_scheduled = False
+        self._inflight: set = set()
+        self.stats = {"sent": 0, "typing_coalesced": 0, "rate_limited": 0, "errors": 0}
+    
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            if len(self._chat_buckets) >= self._bucket_sweep_at:
+                self._sweep_buckets(now)
+            # Groups have negative ids and a stricter limit (about 20/minute)
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.chat_rate
+            bucket = self._chat_buckets[chat_id] = TokenBucket(rate, 1)
+        return bucket
+    
+    def _sweep_buckets(self, now: float):
+        """Drop buckets idle long enough to have refilled: a new one would be identical"""
+        self._chat_buckets = {
+            chat_id: bucket for chat_id, bucket in self._chat_buckets.items()
+            if now - bucket.updated < bucket.capacity / bucket.rate
+        }
+        self._bucket_sweep_at = max(10000, 2 * len(self._chat_buckets))
+    
+    def _mark_ready(self, chat_id):
+        if chat_id in self._pending and chat_id not in self._busy and chat_id not in self._queued:
+            self._queued.add(chat_id)
+            self._ready.append(chat_id)
+            self._pump()
+    
+    def _enqueue(self, chat_id, method: str, payload: Dict) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._pending.setdefault(chat_id, deque()).append((method, payload, future))
+        self._mark_ready(chat_id)
+        return future
+    
+    def send_message(self, chat_id, text: str, parse_mode: Optional[str] = "Markdown",
+                     delay: float = 0.0) -> asyncio.Future:
+        """Queue a message, optionally after a delay; the future resolves to the API reply"""
+        payload = {"chat_id": chat_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        if delay <= 0:
+            return self._enqueue(chat_id, "sendMessage", payload)
         
-        for keyword in self.visa_keywords:
-            if keyword in text_lower:
-                # Avoid false positives
-                if keyword == "visa" and ("credit" in text_lower or "debit" in text_lower):
+        future = asyncio.get_running_loop().create_future()
+        
+        def release():
+            inner = self._enqueue(chat_id, "sendMessage", payload)
+            inner.add_done_callback(lambda f: future.done() or future.set_result(f.result()))
+        
+        self.wheel.schedule(delay, release)
+        return future
+    
+    def edit_message(self, chat_id, message_id: int, text: str,
+                     parse_mode: Optional[str] = "Markdown") -> asyncio.Future:
+        """Queue an editMessageText (shares the chat's ordering and rate limits)"""
+        payload = {"chat_id": chat_id, "message_id": message_id, "text": text}
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
+        return self._enqueue(chat_id, "editMessageText", payload)
+    
+    def send_typing(self, chat_id) -> Optional[asyncio.Future]:
+        """Typing indicator, skipped if one was sent for this chat within the window"""
+        now = time.monotonic()
+        if now - self._last_typing.get(chat_id, -self.typing_window) < self.typing_window:
+            self.stats["typing_coalesced"] += 1
+            return None
+        self._last_typing[chat_id] = now
+        if len(self._last_typing) > 10000:
+            cutoff = now - self.typing_window
+            self._last_typing = {c: t for c, t in self._last_typing.items() if t >= cutoff}
+        return self._enqueue(chat_id, "sendChatAction", {"chat_id": chat_id, "action": "typing"})
+    
+    def _pump(self):
+        """Start as many requests as the buckets allow (runs on the event loop, never sleeps)"""
+        now = time.monotonic()
+        for _ in range(len(self._ready)):
+            global_wait = self.global_bucket.wait_time(now)
+            if global_wait:
+                if not self._pump_scheduled:
+                    self._pump_scheduled = True
+                    self.wheel.schedule(global_wait, self._scheduled_pump)
+                return
+            
+            chat_id = self._ready.popleft()
+            self._queued.discard(chat_id)
+            # Chat actions are not messages, so they skip the per-chat message limit
+            is_message = self._pending[chat_id][0][0] != "sendChatAction"
+            wait = self._paused_until.get(chat_id, 0) - now
+            if is_message:
+                wait = max(wait, self._chat_bucket(chat_id, now).wait_time(now))
+            if wait > 0:
+                self.wheel.schedule(wait, lambda c=chat_id: self._mark_ready(c))
+                continue
+            
+            self.global_bucket.take()
+            if is_message:
+                self._chat_bucket(chat_id, now).take()
+            item = self._pending[chat_id].popleft()
+            if not self._pending[chat_id]:
+                del self._pending[chat_id]
+            self._busy.add(chat_id)
+            task = asyncio.get_running_loop().create_task(self._deliver(chat_id, item))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+    
+    def _scheduled_pump(self):
+        self._pump_scheduled = False
+        self._pump()
+    
+    async def _deliver(self, chat_id, item):
+        method, payload, future = item
+        try:
+            result = await self.api.call(method, payload)
+            if result.get("error_code") == 429:
+                retry_after = (result.get("parameters") or {}).get("retry_after", 1)
+                self.stats["rate_limited"] += 1
+                logger.warning(f"🐢 429 for chat {chat_id}, retrying in {retry_after}s")
+                self._paused_until[chat_id] = time.monotonic() + retry_after
+                self._pending.setdefault(chat_id, deque()).appendleft(item)
+                return
+            if method == "sendMessage":
+                self.stats["sent"] += 1
+            if not future.done():
+                future.set_result(result)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"❌ {method} error for chat {chat_id}: {e}")
+            if not future.done():
+                future.set_result({"ok": False, "description": str(e)})
+        finally:
+            self._busy.discard(chat_id)
+            if chat_id in self._paused_until and self._paused_until[chat_id] <= time.monotonic():
+                del self._paused_until[chat_id]
+            self._mark_ready(chat_id)
+    
+    def depth(self) -> int:
+        """Requests queued or in flight (delayed messages not yet released excluded)"""
+        return sum(len(q) for q in self._pending.values()) + len(self._inflight)
+    
+    async def drain(self, timeout: float = QUEUE_DRAIN_TIMEOUT):
+        """Wait for delayed and queued sends to go out, then stop the wheel"""
+        deadline = time.monotonic() + timeout
+        while (self.depth() or self.wheel._pending) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.depth() or self.wheel._pending:
+            logger.warning(f"⚠️ Dispatcher stopped with {self.depth()} sends pending")
+        self.wheel.cancel_all()
+
+dispatcher = OutboundDispatcher(telegram)
+
+# ========== CONVERSATION LOG WRITER ==========
+class BatchedLogWriter:
+    """Appends JSONL records from a dedicated thread, in batches, with rotation"""
+    
+    _STOP = object()
+    
+    def __init__(self, path: str = CONVERSATION_LOG_PATH, batch_size: int = LOG_BATCH_SIZE,
+                 flush_interval: float = LOG_FLUSH_INTERVAL, rotate_bytes: int = LOG_ROTATE_BYTES,
+                 tracker: Optional["ConversationStats"] = None,
+                 checkpoint_interval: float = STATS_CHECKPOINT_INTERVAL):
+        self.path = path
+        self.tracker = tracker
+        self.checkpoint_interval = checkpoint_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.rotate_bytes = rotate_bytes
+        self._queue: queue.Queue = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.stats = {"records": 0, "batches": 0, "rotations": 0, "errors": 0}
+    
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="conversation-log", daemon=True)
+                self._thread.start()
+    
+    def write(self, record: Dict):
+        """Serialize a record and queue it; never blocks the event loop on disk I/O"""
+        if self._thread is None:
+            self.start()
+        # Encoding here keeps the writer thread off the GIL except for the write itself
+        try:
+            line = (json.dumps(record) + "\n").encode("utf-8")
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"❌ Unserializable log record: {e}")
+            return
+        self._queue.put((line, record))
+    
+    def close(self, timeout: float = 5.0):
+        """Flush everything queued and stop the writer thread"""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join(timeout)
+            self._thread = None
+    
+    def _run(self):
+        # Counters must cover what is already on disk before this process appends
+        if self.tracker is not None:
+            self.tracker.ensure_loaded()
+        next_sync = time.monotonic() + self.checkpoint_interval
+        while True:
+            try:
+                batch = [self._queue.get(timeout=max(next_sync - time.monotonic(), 0))]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.flush_interval
+            while batch and batch[-1] is not self._STOP and len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            
+            stop = bool(batch) and batch[-1] is self._STOP
+            records = batch[:-1] if stop else batch
+            if records:
+                self._flush(records)
+            # Counting is on a timer and outside the log lock, so appends never wait on it
+            if stop or time.monotonic() >= next_sync:
+                if self.tracker is not None:
+                    self.tracker.sync()
+                next_sync = time.monotonic() + self.checkpoint_interval
+            if stop:
+                return
+    
+    def _flush(self, records: List[Tuple[bytes, Dict]]):
+        data = b"".join(line for line, _ in records)
+        rotated = None
+        try:
+            fd = self._open_locked()
+            try:
+                # One O_APPEND write under an exclusive lock: batches from
+                # different workers never interleave mid-record
+                view = memoryview(data)
+                while view:
+                    view = view[os.write(fd, view):]
+                if self.rotate_bytes and os.fstat(fd).st_size >= self.rotate_bytes:
+                    rotated = f"{self.path}.{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.{os.getpid()}"
+                    if self.tracker is not None:
+                        # Count the segment to its end before it leaves the live path
+                        self.tracker.sync(rotated)
+                    else:
+                        os.rename(self.path, rotated)
+                    self.stats["rotations"] += 1
+            finally:
+                os.close(fd)  # also releases the lock
+            self.stats["records"] += len(records)
+            self.stats["batches"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"❌ Log write error: {e}")
+        if rotated:
+            self._compress(rotated)
+    
+    def _open_locked(self) -> int:
+        """Open the live segment locked, retrying if another worker just rotated it"""
+        while True:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                if os.fstat(fd).st_ino == os.stat(self.path).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+    
+    def _compress(self, path: str):
+        try:
+            with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(path)
+        except Exception as e:
+            logger.error(f"❌ Log compression error: {e}")
+
+class ConversationStats:
+    """Running counters over the conversation log, checkpointed next to it
+    
+    The checkpoint is a cursor into the log: counters plus the (inode, offset)
+    they cover. sync() takes the checkpoint's own lock, adopts the checkpoint
+    if another worker moved it, counts whatever was appended since, and writes
+    it back. Writers call it on a timer, and the log lock is never held while
+    counting, except at rotation, where the segment must be counted before it
+    is renamed away.
+    
+    Per-chat state is bounded: the busiest chats are kept in CHAT_SLOTS
+    Space-Saving counters (the newcomer takes over the smallest count), and
+    chats_seen is a HyperLogLog estimate.
+    """
+    
+    RECENT_HOURS = 168    # hourly histogram kept for the last week
+    TOP_N = 10
+    CHAT_SLOTS = 256      # chats with exact-ish counts; top_chats come from these
+    CHAT_REGISTERS = 1024  # HyperLogLog registers for chats_seen, about 3% error
+    SNAPSHOT_MAX_AGE = 1.0  # seconds a served snapshot may lag behind the counters
+    
+    def __init__(self, log_path: str = CONVERSATION_LOG_PATH, checkpoint_path: str = STATS_CHECKPOINT_PATH):
+        self.log_path = log_path
+        self.checkpoint_path = checkpoint_path
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._reset()
+        self._snapshot: Optional[Dict] = None
+        self._snapshot_at = 0.0
+        self._written: Optional[Tuple[int, int]] = None  # checkpoint (inode, mtime) this process wrote last
+    
+    def _reset(self):
+        self.total = 0
+        self.high_priority = 0
+        self.keywords: Dict[str, int] = {}
+        self.sentiments: Dict[str, int] = {}
+        self.chats: Dict[str, int] = {}
+        self.chat_titles: Dict[str, str] = {}
+        self.chat_registers = bytearray(self.CHAT_REGISTERS)
+        self.hours: Dict[str, int] = {}  # "YYYY-MM-DDTHH" -> count
+        self.hour_of_day = [0] * 24
+        self.first_seen: Optional[str] = None
+        self.last_seen: Optional[str] = None
+        self.log_inode: Optional[int] = None  # live segment the counters cover, up to log_offset
+        self.log_offset = 0
+    
+    def _count(self, record: Dict):
+        self.total += 1
+        if record.get('priority') == 'high':
+            self.high_priority += 1
+        for keyword in record.get('keywords') or []:
+            self.keywords[keyword] = self.keywords.get(keyword, 0) + 1
+        sentiment = record.get('sentiment', 'neutral')
+        self.sentiments[sentiment] = self.sentiments.get(sentiment, 0) + 1
+        chat = str(record.get('chat_id'))
+        count = self.chats.get(chat)
+        if count is None:
+            self._see_chat(chat)
+            count = 0
+            if len(self.chats) >= self.CHAT_SLOTS:
+                evicted = min(self.chats, key=self.chats.get)
+                count = self.chats.pop(evicted)
+                self.chat_titles.pop(evicted, None)
+        self.chats[chat] = count + 1
+        if record.get('chat_title'):
+            self.chat_titles[chat] = record['chat_title']
+        timestamp = record.get('timestamp') or ""
+        if len(timestamp) >= 13:
+            hour = timestamp[:13]
+            self.hours[hour] = self.hours.get(hour, 0) + 1
+            if timestamp[11:13].isdigit():
+                self.hour_of_day[int(timestamp[11:13]) % 24] += 1
+            self.first_seen = min(self.first_seen or timestamp, timestamp)
+            self.last_seen = max(self.last_seen or timestamp, timestamp)
+    
+    def _see_chat(self, chat: str):
+        """Fold a chat into the HyperLogLog registers (repeats change nothing)"""
+        digest = int.from_bytes(hashlib.blake2b(chat.encode(), digest_size=8).digest(), "big")
+        index_bits = self.CHAT_REGISTERS.bit_length() - 1
+        register = digest & (self.CHAT_REGISTERS - 1)
+        rank = 64 - index_bits - (digest >> index_bits).bit_length() + 1  # leading zeros + 1
+        if rank > self.chat_registers[register]:
+            self.chat_registers[register] = rank
+    
+    def chats_seen(self) -> int:
+        """Estimated number of distinct chats ever logged"""
+        m = self.CHAT_REGISTERS
+        zeros = self.chat_registers.count(0)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / sum(2.0 ** -r for r in self.chat_registers)
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)  # linear counting while registers are sparse
+        return round(estimate)
+    
+    def _stream(self, path: str, offset: int = 0) -> int:
+        """Count every record in a segment from offset on; returns the end offset"""
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partial record still being written
+                offset += len(line)
+                try:
+                    self._count(json.loads(line))
+                except ValueError:
                     continue
-                detected.append(keyword)
+        return offset
+    
+    def _live_inode(self) -> Optional[int]:
+        try:
+            return os.stat(self.log_path).st_ino
+        except FileNotFoundError:
+            return None
+    
+    _FIELDS = ("total", "high_priority", "keywords", "sentiments", "chats", "chat_titles",
+               "hours", "hour_of_day", "first_seen", "last_seen", "log_inode", "log_offset")
+    
+    def _read_checkpoint(self) -> Optional[Dict]:
+        try:
+            with open(self.checkpoint_path, "r") as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        # An older layout (unbounded chats, no registers) is rebuilt from the log
+        if "chat_registers" not in checkpoint or len(checkpoint["chats"]) > self.CHAT_SLOTS:
+            return None
+        return checkpoint
+    
+    def _restore(self, checkpoint: Dict):
+        for name in self._FIELDS:
+            setattr(self, name, checkpoint[name])
+        self.chat_registers = bytearray.fromhex(checkpoint["chat_registers"])
+    
+    def _catch_up(self):
+        """Bring the counters up to the end of the live log (both locks held)"""
+        if not self._loaded or self._checkpoint_stat() != self._written:
+            checkpoint = self._read_checkpoint()
+            if checkpoint is not None:
+                self._restore(checkpoint)
+            elif not self._loaded:
+                self._reset()
+                for segment in sorted(glob.glob(glob.escape(self.log_path) + ".*.gz")):
+                    self._stream(segment)
+        inode = self._live_inode()
+        if inode is not None:
+            offset = self.log_offset if inode == self.log_inode else 0
+            self.log_offset = self._stream(self.log_path, offset)
+            self.log_inode = inode
+        if len(self.hours) > self.RECENT_HOURS:
+            for hour in sorted(self.hours)[:-self.RECENT_HOURS]:
+                del self.hours[hour]
+        self._loaded = True
+    
+    def _locked(self) -> int:
+        """Exclusive lock shared by every worker checkpointing this log"""
+        fd = os.open(self.checkpoint_path + ".lock", os.O_WRONLY | os.O_CREAT, 0o644)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+    
+    def ensure_loaded(self):
+        """Cold start: restore the checkpoint and catch up, or rebuild from the log in one streaming pass"""
+        with self._lock:
+            if self._loaded:
+                return
+            started = time.perf_counter()
+            try:
+                fd = self._locked()
+                try:
+                    self._catch_up()
+                finally:
+                    os.close(fd)
+            except Exception as e:
+                logger.error(f"❌ Stats rebuild error: {e}")
+                self._reset()
+                self._loaded = True
+            logger.info(f"📈 Stats loaded: {self.total} conversations in {time.perf_counter() - started:.2f}s")
+    
+    def sync(self, rotated_path: Optional[str] = None):
+        """Count records appended since the checkpoint and write it back
         
-        return list(set(detected))  # Remove duplicates
+        With rotated_path (the caller holds the log lock), the live log is
+        renamed there once counted and the next live file starts from zero.
+        """
+        with self._lock:
+            try:
+                fd = self._locked()
+            except OSError as e:
+                logger.error(f"❌ Stats checkpoint error: {e}")
+                if rotated_path:
+                    os.rename(self.log_path, rotated_path)
+                return
+            try:
+                try:
+                    self._catch_up()
+                except Exception as e:
+                    logger.error(f"❌ Stats merge error: {e}")
+                if rotated_path:
+                    os.rename(self.log_path, rotated_path)
+                    self.log_inode, self.log_offset = None, 0
+                state = {name: getattr(self, name) for name in self._FIELDS}
+                state["chat_registers"] = self.chat_registers.hex()
+                try:
+                    tmp = f"{self.checkpoint_path}.{os.getpid()}.tmp"
+                    with open(tmp, "w") as f:
+                        json.dump(state, f)
+                    os.replace(tmp, self.checkpoint_path)
+                    self._written = self._checkpoint_stat()
+                except OSError as e:
+                    logger.error(f"❌ Stats checkpoint error: {e}")
+            finally:
+                os.close(fd)
+    
+    def _checkpoint_stat(self) -> Optional[Tuple[int, int]]:
+        try:
+            info = os.stat(self.checkpoint_path)
+            return info.st_ino, info.st_mtime_ns
+        except FileNotFoundError:
+            return None
+    
+    def snapshot(self) -> Dict:
+        """Aggregates for /api/stats, recomputed at most once per SNAPSHOT_MAX_AGE"""
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._snapshot_at < self.SNAPSHOT_MAX_AGE:
+            return self._snapshot
+        self.ensure_loaded()
+        with self._lock:
+            top_chats = sorted(self.chats.items(), key=lambda item: item[1], reverse=True)[:self.TOP_N]
+            self._snapshot = {
+                "total_conversations": self.total,
+                "high_priority": self.high_priority,
+                "top_keywords": dict(sorted(self.keywords.items(), key=lambda item: item[1], reverse=True)[:self.TOP_N]),
+                "sentiment": dict(self.sentiments),
+                "top_chats": [
+                    {"chat_id": chat, "title": self.chat_titles.get(chat), "conversations": count}
+                    for chat, count in top_chats
+                ],
+                "chats_seen": self.chats_seen(),
+                "by_hour_of_day": list(self.hour_of_day),
+                "last_24_hours": dict(sorted(self.hours.items())[-24:]),
+                "first_seen": self.first_seen,
+                "last_seen": self.last_seen
+            }
+            self._snapshot_at = now
+        return self._snapshot
 
 # ========== FEEDBACK SYSTEM ==========
 class FeedbackSystem:
     """Log conversations for improvement"""
     
-    def __init__(self, bot_token: str):
-        self.bot_token = bot_token
+    def __init__(self):
         self.feedback_channel_id = os.getenv("FEEDBACK_CHANNEL_ID", "@JapaGenieFeedback")
-        self.local_storage = "visa_intelligence.jsonl"
+        self.local_storage = CONVERSATION_LOG_PATH
+        self.tracker = ConversationStats(self.local_storage)
+        self.writer = BatchedLogWriter(self.local_storage, tracker=self.tracker)
         
     async def log_conversation(self, data: Dict):
         """Log important conversations"""
         try:
-            # Save locally
-            with open(self.local_storage, "a") as f:
-                f.write(json.dumps(data) + "\n")
+            # Save locally (batched by the writer thread)
+            self.writer.write(data)
             
-            # Send to Telegram channel if high priority
+            # Send to Telegram channel if high priority (queued, not awaited: the
+            # channel's 1/s limit must not hold up the job that logged it)
             if data.get('priority') == 'high':
-                await self._send_to_channel(data)
+                self._send_to_channel(data)
                 
             logger.info(f"📊 Logged: {data.get('user_name')} - {len(data.get('keywords', []))} keywords")
             
         except Exception as e:
             logger.error(f"❌ Logging error: {e}")
     
-    async def _send_to_channel(self, data: Dict):
-        """Send to feedback channel"""
+    def _send_to_channel(self, data: Dict):
+        """Queue a post to the feedback channel"""
         try:
             message = f"""
 🚨 **HIGH PRIORITY CONVERSATION**
@@ -337,16 +2358,169 @@ class FeedbackSystem:
 🕒 {datetime.now().strftime('%Y-%m-%d %H:%M')}
 """
             
-            url = f"https://api.telegram.org/bot{self.bot_token}/sendMessage"
-            async with httpx.AsyncClient() as client:
-                await client.post(url, json={
-                    "chat_id": self.feedback_channel_id,
-                    "text": message,
-                    "parse_mode": "Markdown"
-                })
+            dispatcher.send_message(self.feedback_channel_id, message)
         except Exception as e:
             logger.error(f"❌ Channel send error: {e}")
 
+# ========== GROUP MESSAGE AGGREGATION ==========
+class ChatAggregator:
+    """Collects a burst of group messages per chat and answers them with one model call
+    
+    Each message gets a future for the batch reply, so its job stays unacked
+    until the reply lands. The last message carries the Telegram result (and
+    so the retry if it failed); the others settle with it.
+    """
+    
+    def __init__(self, respond, window: float = AGGREGATE_WINDOW, max_batch: int = AGGREGATE_MAX_BATCH):
+        self.respond = respond  # async (chat_id, [(text, context), ...]) -> (reply, Telegram result)
+        self.window = window
+        self.max_batch = max_batch
+        self._batches: Dict = {}  # chat_id -> [(text, context)]
+        self._waiters: Dict = {}  # chat_id -> [asyncio.Future], one per held message
+        self._timers: Dict = {}   # chat_id -> asyncio.TimerHandle
+        self._tasks: set = set()
+        self.stats = {"messages": 0, "batches": 0, "model_calls_saved": 0}
+    
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0 and self.max_batch > 1
+    
+    def add(self, chat_id, text: str, context: Dict) -> asyncio.Future:
+        """Hold a message; the batch goes out when the window closes or it is full
+        
+        Returns a future of the batch's (reply, Telegram result); the result is
+        None for every message but the last.
+        """
+        self.stats["messages"] += 1
+        loop = asyncio.get_running_loop()
+        batch = self._batches.get(chat_id)
+        if batch is None:
+            batch = self._batches[chat_id] = []
+            self._waiters[chat_id] = []
+            # The window opens with the first message, so no reply waits longer than window
+            self._timers[chat_id] = loop.call_later(self.window, self._flush, chat_id)
+        batch.append((text, context))
+        waiter = loop.create_future()
+        self._waiters[chat_id].append(waiter)
+        if len(batch) >= self.max_batch:
+            self._flush(chat_id)
+        return waiter
+    
+    def _flush(self, chat_id):
+        timer = self._timers.pop(chat_id, None)
+        if timer is not None:
+            timer.cancel()
+        items = self._batches.pop(chat_id, None)
+        waiters = self._waiters.pop(chat_id, [])
+        if not items:
+            return
+        self.stats["batches"] += 1
+        self.stats["model_calls_saved"] += len(items) - 1
+        task = asyncio.get_running_loop().create_task(self._run(chat_id, items, waiters))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _run(self, chat_id, items: List[Tuple[str, Dict]], waiters: List[asyncio.Future]):
+        try:
+            reply, result = await self.respond(chat_id, items)
+        except Exception as e:
+            logger.error(f"❌ Batch reply error for chat {chat_id}: {e}")
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(e)
+            return
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result((reply, result if waiter is waiters[-1] else None))
+    
+    async def drain(self):
+        """Answer every held batch now and wait for the replies to be sent"""
+        for chat_id in list(self._batches):
+            self._flush(chat_id)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# ========== GROUP PRE-FILTER ==========
+CHATTER_REPLY_RATE = 0.1  # odds of answering group chat with no topic or tone signal
+
+class PreFilter:
+    """Ordered cheap checks run before keyword and sentiment work.
+    
+    Stages: command/empty, length (groups), then mention or reply to the bot.
+    Whatever passes goes through detect() and analyze() once; there is no
+    second, cheaper scan for topic or tone, since one costs as much as the
+    real thing. The seeded reply draw lives here so replays decide the same way.
+    """
+    
+    def __init__(self, bot_token: Optional[str] = TELEGRAM_BOT_TOKEN,
+                 username: str = TELEGRAM_BOT_USERNAME, seed: str = SAMPLING_SEED):
+        head = (bot_token or "").split(":", 1)[0]
+        self.bot_id = int(head) if head.isdigit() else None
+        self.mention = f"@{username.lower()}" if username else None
+        self._key = seed.encode()[:64]
+        self.stats = {
+            "seen": 0, "passed": 0, "addressed": 0,
+            "rejected": {"command": 0, "length": 0},
+        }
+    
+    def sample(self, chat_id, message_id) -> float:
+        """Deterministic draw in [0, 1) from the seed, chat and message"""
+        digest = hashlib.blake2b(f"{chat_id}:{message_id}".encode(), digest_size=8, key=self._key).digest()
+        return int.from_bytes(digest, "big") / 2 ** 64
+    
+    def check(self, message: Dict, text: str, chat_type: str) -> Optional[bool]:
+        """Whether a message worth processing mentions or replies to the bot, or None to drop it"""
+        self.stats["seen"] += 1
+        if not text or text.startswith("/"):
+            return self._reject("command")
+        if chat_type == "private":
+            # DMs are always answered
+            return self._pass(False)
+        
+        # Skip very short messages in groups
+        if len(text.split()) < 3:
+            return self._reject("length")
+        
+        addressed = self._addressed(message)
+        if addressed:
+            self.stats["addressed"] += 1
+        return self._pass(addressed)
+    
+    def _addressed(self, message: Dict) -> bool:
+        """Mentions the bot or replies to one of its messages"""
+        text = message.get("text", "")  # entity offsets index the unstripped text
+        replied = (message.get("reply_to_message") or {}).get("from") or {}
+        if self.bot_id is not None and replied.get("id") == self.bot_id:
+            return True
+        for entity in message.get("entities") or ():
+            if entity.get("type") == "text_mention" and self.bot_id is not None:
+                if (entity.get("user") or {}).get("id") == self.bot_id:
+                    return True
+            elif entity.get("type") == "mention" and self.mention:
+                start = entity.get("offset", 0)
+                if text[start:start + entity.get("length", 0)].lower() == self.mention:
+                    return True
+        return False
+    
+    def _pass(self, addressed: bool) -> bool:
+        self.stats["passed"] += 1
+        return addressed
+    
+    def _reject(self, reason: str) -> None:
+        self.stats["rejected"][reason] += 1
+        return None
+    
+    def snapshot(self) -> Dict:
+        seen = self.stats["seen"]
+        rejected = sum(self.stats["rejected"].values())
+        return {
+            "seen": seen,
+            "passed": self.stats["passed"],
+            "addressed": self.stats["addressed"],
+            "rejected": dict(self.stats["rejected"]),
+            "rejected_fraction": round(rejected / seen, 3) if seen else 0.0,
+        }
+
 # ========== MAIN BOT ==========
 class JapaGenieBot:
     """AI-Powered Japa Genie Bot"""
@@ -355,11 +2529,19 @@ class JapaGenieBot:
         self.ai_engine = AIConversationEngine()
         self.sentiment = SentimentAnalyzer()
         self.visa_intel = VisaIntelligence()
-        self.feedback = FeedbackSystem(TELEGRAM_BOT_TOKEN)
+        self.prefilter = PreFilter()
+        self.feedback = FeedbackSystem()
+        self.aggregator = ChatAggregator(self._respond_to_batch)
+        self.stream_stats = {"replies": 0, "first_token_seconds": 0.0, "total_seconds": 0.0, "edits": 0}
         
-    async def process_message(self, update: Dict) -> Optional[str]:
-        """Process incoming message with AI"""
+    async def process_message(self, update: Dict) -> Union[str, Awaitable, None]:
+        """Process incoming message with AI
+        
+        Returns the reply to send, or, for a reply already on its way, an
+        awaitable of its (text, Telegram result) for the job to settle on.
+        """
         try:
+            received = time.perf_counter()
             message = update.get("message", {})
             if not message:
                 return None
@@ -370,24 +2552,31 @@ class JapaGenieBot:
             chat_type = message.get("chat", {}).get("type", "private")
             chat_title = message.get("chat", {}).get("title", "Private Chat")
             
-            if not text or text.startswith("/"):
-                return None
-            
-            # Skip very short messages in groups
-            if chat_type != "private" and len(text.split()) < 3:
+            # Cheapest checks first
+            addressed = self.prefilter.check(message, text, chat_type)
+            if addressed is None:
                 return None
             
             # Detect visa topics
+            stage_start = time.perf_counter()
             visa_keywords = self.visa_intel.detect(text)
+            stage_end = time.perf_counter()
+            metrics.observe("japa_stage_seconds", stage_end - stage_start, "keyword_detection")
             
             # Analyze sentiment
             sentiment_data = self.sentiment.analyze(text)
+            stage_start = time.perf_counter()
+            metrics.observe("japa_stage_seconds", stage_start - stage_end, "sentiment")
             
             # Build context for AI
             context = {
                 "text": text,
+                "chat_id": chat_id,
+                "message_id": message.get("message_id"),
+                "user_id": user.get("id"),
                 "user_name": user.get("first_name", "Friend"),
                 "chat_type": chat_type,
+                "addressed": addressed,
                 "keywords": visa_keywords,
                 "sentiment": sentiment_data,
                 "needs_empathy": sentiment_data.get('needs_empathy'),
@@ -403,17 +2592,29 @@ class JapaGenieBot:
                     "text": text,
                     "keywords": visa_keywords,
                     "sentiment": "stressed" if sentiment_data.get('needs_empathy') else "positive" if sentiment_data.get('needs_celebration') else "neutral",
+                    "is_question": sentiment_data.get('is_question'),
                     "chat_id": chat_id,
                     "chat_title": chat_title,
                     "chat_type": chat_type,
                     "timestamp": datetime.now().isoformat(),
                     "priority": "high" if sentiment_data.get('needs_empathy') else "normal"
                 })
+            stage_end = time.perf_counter()
+            metrics.observe("japa_stage_seconds", stage_end - stage_start, "logging")
             
             # Decide if should respond (smart rate)
             should_respond = self._should_respond(context)
+            metrics.observe("japa_stage_seconds", time.perf_counter() - stage_end, "should_respond")
             
             if should_respond:
+                # Busy groups: fold this message into the chat's pending batch
+                if chat_type != "private" and self.aggregator.enabled:
+                    return self.aggregator.add(chat_id, text, context)
+                
+                # Private chats: stream straight to the user instead of returning text
+                if chat_type == "private" and STREAM_REPLIES:
+                    return self._stream_reply(chat_id, text, context, received)
+                
                 # Generate AI response
                 response = await self.ai_engine.generate_response(text, context)
                 return response
@@ -424,14 +2625,84 @@ class JapaGenieBot:
             logger.error(f"❌ Process error: {e}")
             return None
     
+    async def _stream_reply(self, chat_id, text: str, context: Dict, received: float) -> Tuple[str, Optional[Dict]]:
+        """Send the first chunk as soon as it exists, then extend it with throttled edits
+        
+        Returns the full reply and the result of the send that opened it. If
+        that send failed, the stream is still read to the end so a retry can
+        resend the whole reply without the model.
+        """
+        dispatcher.send_typing(chat_id)
+        sent = None
+        message_id = None
+        shown = ""
+        latest = ""
+        last_edit = 0.0
+        first_token = None
+        
+        async for latest in self.ai_engine.stream_response(text, context):
+            if not latest or (sent is not None and message_id is None):
+                continue
+            if sent is None:
+                # Plain text while streaming: half-written Markdown would be rejected
+                sent = await dispatcher.send_message(chat_id, latest, parse_mode=None)
+                message_id = (sent.get("result") or {}).get("message_id")
+                if message_id is None:
+                    logger.error(f"❌ Streaming send failed: {sent.get('description')}")
+                    continue
+                shown, last_edit = latest, time.perf_counter()
+                first_token = last_edit - received
+            elif time.perf_counter() - last_edit >= STREAM_EDIT_INTERVAL and latest != shown:
+                await dispatcher.edit_message(chat_id, message_id, latest, parse_mode=None)
+                shown, last_edit = latest, time.perf_counter()
+                self.stream_stats["edits"] += 1
+        
+        if message_id is None:
+            return latest, sent
+        # Final edit applies Markdown; fall back to plain text if Telegram rejects it
+        if latest != shown or any(mark in latest for mark in "*_`["):
+            result = await dispatcher.edit_message(chat_id, message_id, latest)
+            if not result.get("ok") and latest != shown:
+                await dispatcher.edit_message(chat_id, message_id, latest, parse_mode=None)
+            self.stream_stats["edits"] += 1
+        
+        total = time.perf_counter() - received
+        self.stream_stats["replies"] += 1
+        self.stream_stats["first_token_seconds"] += first_token
+        self.stream_stats["total_seconds"] += total
+        logger.info(f"📡 Streamed reply: first token {first_token:.2f}s, total {total:.2f}s")
+        return latest, sent
+    
+    async def _respond_to_batch(self, chat_id, items: List[Tuple[str, Dict]]) -> Tuple[str, Optional[Dict]]:
+        """One model call and one reply for a burst of messages in a chat"""
+        if len(items) == 1:
+            text, context = items[0]
+        else:
+            names = list(dict.fromkeys(c.get('user_name', 'Friend') for _, c in items))
+            text = "\n".join(f"{c.get('user_name', 'Friend')}: {t}" for t, c in items)
+            context = dict(
+                items[-1][1],
+                text=text,
+                user_id=None,  # group-level conversation memory
+                user_name=", ".join(names),
+                keywords=list(dict.fromkeys(k for _, c in items for k in c.get('keywords', []))),
+                aggregated=len(items)
+            )
+        
+        response = await self.ai_engine.generate_response(text, context)
+        if not response:
+            return "", None
+        dispatcher.send_typing(chat_id)
+        return response, await dispatcher.send_message(chat_id, response, delay=random.uniform(1, 2.5))
+    
     def _should_respond(self, context: Dict) -> bool:
         """Smart decision on whether to respond"""
         chat_type = context.get('chat_type')
         has_keywords = len(context.get('keywords', [])) > 0
         sentiment = context.get('sentiment', {})
         
-        # Always respond in DMs
-        if chat_type == "private":
+        # Always respond in DMs and when someone mentions or replies to the bot
+        if chat_type == "private" or context.get('addressed'):
             return True
         
         # Always respond to stress/questions
@@ -442,52 +2713,478 @@ class JapaGenieBot:
         if sentiment.get('needs_celebration'):
             return True
         
-        # Respond to visa topics (40% rate)
+        # Weak signals below the threshold still raise the odds a little
+        lean = max(sentiment.get('stress_score', 0), sentiment.get('question_score', 0))
+        
+        # Seeded draw, so a replayed update gets the same answer
+        draw = self.prefilter.sample(context.get('chat_id'), context.get('message_id'))
+        
+        # Respond to visa topics (40% rate, up to 80% for near-questions)
         if has_keywords:
-            return random.random() < 0.4
+            return draw < 0.4 + 0.4 * lean
         
-        # Respond to general chat (10% rate)
-        return random.random() < 0.1
+        # Respond to general chat (10% rate, up to 30%)
+        return draw < CHATTER_REPLY_RATE + 0.2 * lean
 
 # Initialize bot
 bot = JapaGenieBot()
 
+# ========== UPDATE DEDUPLICATION ==========
+class UpdateDeduplicator:
+    """Drop Telegram webhook retries by update_id before any processing"""
+    
+    PURGE_INTERVAL = 60  # seconds between expiry sweeps of the shared store
+    
+    def __init__(self, ttl: float = DEDUP_TTL, max_entries: int = DEDUP_MAX_ENTRIES,
+                 db_path: Optional[str] = DEDUP_DB_PATH):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._seen = OrderedDict()  # update_id -> first seen, oldest first
+        self._db = None
+        self._lock = threading.Lock()
+        self._next_purge = 0.0
+        self.stats = {"checked": 0, "duplicates": 0}
+        if db_path:
+            self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS seen_updates (update_id INTEGER PRIMARY KEY, seen_at REAL NOT NULL)"
+            )
+    
+    def _evict(self, now: float):
+        cutoff = now - self.ttl
+        while self._seen:
+            seen_at = next(iter(self._seen.values()))
+            if seen_at >= cutoff and len(self._seen) <= self.max_entries:
+                break
+            self._seen.popitem(last=False)
+    
+    def _claim_shared(self, update_id: int, now: float) -> bool:
+        """True if this process is the first to see update_id"""
+        with self._lock:
+            if now >= self._next_purge:
+                self._next_purge = now + self.PURGE_INTERVAL
+                self._db.execute("DELETE FROM seen_updates WHERE seen_at < ?", (now - self.ttl,))
+            cursor = self._db.execute(
+                "INSERT OR IGNORE INTO seen_updates (update_id, seen_at) VALUES (?, ?)", (update_id, now)
+            )
+            return cursor.rowcount == 1
+    
+    async def is_duplicate(self, update: Dict) -> bool:
+        """Record the update and report whether it was already seen"""
+        update_id = update.get("update_id")
+        if update_id is None:
+            return False
+        self.stats["checked"] += 1
+        now = time.time()
+        
+        duplicate = update_id in self._seen
+        if not duplicate:
+            self._seen[update_id] = now
+            self._evict(now)
+            if self._db is not None:
+                duplicate = not await asyncio.to_thread(self._claim_shared, update_id, now)
+        
+        if duplicate:
+            self.stats["duplicates"] += 1
+            metrics.inc("japa_duplicate_updates_total")
+        return duplicate
+    
+    def close(self):
+        if self._db is not None:
+            with self._lock:
+                self._db.close()
+            self._db = None
+
+dedup = UpdateDeduplicator()
+
+# ========== JOB QUEUE ==========
+class MemoryQueueBackend:
+    """In-process queue: fast, lost on restart"""
+    
+    def __init__(self, max_size: int = QUEUE_MAX_SIZE, shed_policy: str = QUEUE_SHED_POLICY):
+        self.max_size = max_size
+        self.shed_policy = shed_policy
+        self._jobs: deque = deque()
+        self._ids = itertools.count(1)
+        self._ready = asyncio.Event()
+        self._delayed = 0
+        self.shed = 0
+    
+    async def put(self, payload: Dict) -> bool:
+        """Enqueue a job; False if it was shed"""
+        if len(self._jobs) >= self.max_size:
+            self.shed += 1
+            if self.shed_policy == "drop_newest":
+                return False
+            self._jobs.popleft()
+        self._jobs.append({"id": next(self._ids), "payload": payload, "attempts": 0})
+        self._ready.set()
+        return True
+    
+    async def get(self) -> Dict:
+        """Wait for the next job"""
+        while not self._jobs:
+            self._ready.clear()
+            await self._ready.wait()
+        return self._jobs.popleft()
+    
+    async def ack(self, job: Dict):
+        pass
+    
+    async def save(self, job: Dict):
+        pass  # the payload dict is the job's own
+    
+    async def retry(self, job: Dict, delay: float):
+        """Put a failed job back after a delay"""
+        self._delayed += 1
+        
+        def requeue():
+            self._delayed -= 1
+            self._jobs.append(job)
+            self._ready.set()
+        
+        asyncio.get_running_loop().call_later(delay, requeue)
+    
+    async def fail(self, job: Dict):
+        pass
+    
+    def size(self) -> int:
+        return len(self._jobs) + self._delayed
+    
+    async def close(self):
+        pass
+
+class SQLiteQueueBackend:
+    """Durable queue: jobs survive restarts and serverless freezes"""
+    
+    POLL_INTERVAL = 0.5       # seconds between checks for retries / other processes
+    VISIBILITY_TIMEOUT = 300  # seconds before a claimed but unacked job is handed out again
+    
+    def __init__(self, path: str = QUEUE_DB_PATH, max_size: int = QUEUE_MAX_SIZE,
+                 shed_policy: str = QUEUE_SHED_POLICY):
+        self.max_size = max_size
+        self.shed_policy = shed_policy
+        self.shed = 0
+        self._lock = threading.Lock()
+        self._ready = asyncio.Event()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                available_at REAL NOT NULL,
+                claimed_at REAL
+            )
+        """)
+    
+    def _run(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+    
+    def _put(self, payload: Dict) -> bool:
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (count,) = self._db.execute("SELECT COUNT(*) FROM jobs").fetchone()
+                if count >= self.max_size:
+                    self.shed += 1
+                    if self.shed_policy == "drop_newest":
+                        self._db.execute("COMMIT")
+                        return False
+                    self._db.execute(
+                        "DELETE FROM jobs WHERE id = (SELECT id FROM jobs WHERE claimed_at IS NULL ORDER BY id LIMIT 1)"
+                    )
+                self._db.execute(
+                    "INSERT INTO jobs (payload, available_at) VALUES (?, ?)",
+                    (json.dumps(payload), time.time())
+                )
+                self._db.execute("COMMIT")
+                return True
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+    
+    def _claim(self) -> Optional[Dict]:
+        now = time.time()
+        rows = self._run("""
+            UPDATE jobs SET claimed_at = ?
+            WHERE id = (
+                SELECT id FROM jobs
+                WHERE available_at <= ? AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY id LIMIT 1
+            )
+            RETURNING id, payload, attempts
+        """, (now, now, now - self.VISIBILITY_TIMEOUT))
+        if not rows:
+            return None
+        job_id, payload, attempts = rows[0]
+        return {"id": job_id, "payload": json.loads(payload), "attempts": attempts}
+    
+    async def put(self, payload: Dict) -> bool:
+        """Enqueue a job; False if it was shed"""
+        accepted = await asyncio.to_thread(self._put, payload)
+        if accepted:
+            self._ready.set()
+        return accepted
+    
+    async def get(self) -> Dict:
+        """Wait for the next job"""
+        while True:
+            self._ready.clear()
+            job = await asyncio.to_thread(self._claim)
+            if job:
+                return job
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout=self.POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+    
+    async def ack(self, job: Dict):
+        await asyncio.to_thread(self._run, "DELETE FROM jobs WHERE id = ?", (job["id"],))
+    
+    async def save(self, job: Dict):
+        """Persist payload changes of a claimed job (progress a retry resumes from)"""
+        await asyncio.to_thread(self._run, "UPDATE jobs SET payload = ? WHERE id = ?",
+                                (json.dumps(job["payload"]), job["id"]))
+    
+    async def retry(self, job: Dict, delay: float):
+        await asyncio.to_thread(
+            self._run,
+            "UPDATE jobs SET payload = ?, attempts = ?, available_at = ?, claimed_at = NULL WHERE id = ?",
+            (json.dumps(job["payload"]), job["attempts"], time.time() + delay, job["id"])
+        )
+    
+    async def fail(self, job: Dict):
+        await self.ack(job)
+    
+    def size(self) -> int:
+        return self._run("SELECT COUNT(*) FROM jobs")[0][0]
+    
+    async def close(self):
+        with self._lock:
+            self._db.close()
+
+class WorkQueue:
+    """Bounded worker pool with retries, backpressure and drain on shutdown
+    
+    A handler may return an awaitable for a side effect still in flight (a
+    delayed send). The job is then acked or retried when that settles, without
+    holding the worker; handlers store progress in the payload so a retry
+    resumes instead of repeating finished steps.
+    """
+    
+    def __init__(self, handler, backend=None, workers: int = QUEUE_WORKERS,
+                 max_attempts: int = QUEUE_MAX_ATTEMPTS, retry_base: float = QUEUE_RETRY_BASE):
+        self.handler = handler
+        self.backend = backend
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_base = retry_base
+        self._tasks: List[asyncio.Task] = []
+        self._settling: set = set()
+        self._inflight = 0
+        self._accepting = True
+        self.stats = {"submitted": 0, "processed": 0, "retried": 0, "failed": 0, "rejected": 0}
+    
+    def _make_backend(self):
+        if QUEUE_BACKEND == "sqlite":
+            return SQLiteQueueBackend()
+        return MemoryQueueBackend()
+    
+    async def start(self):
+        """Spawn the worker pool (idempotent)"""
+        if self._tasks:
+            return
+        if self.backend is None:
+            self.backend = self._make_backend()
+        self._accepting = True
+        self._tasks = [asyncio.create_task(self._worker(n)) for n in range(self.workers)]
+        logger.info(f"🧵 Job queue started: {self.workers} workers, {type(self.backend).__name__}")
+    
+    async def submit(self, payload: Dict) -> bool:
+        """Queue a job; False if rejected or shed"""
+        if not self._accepting:
+            self.stats["rejected"] += 1
+            return False
+        # Serverless runtimes may skip lifespan hooks, so start on demand
+        await self.start()
+        accepted = await self.backend.put(payload)
+        if accepted:
+            self.stats["submitted"] += 1
+        else:
+            self.stats["rejected"] += 1
+        return accepted
+    
+    async def _worker(self, n: int):
+        while True:
+            job = await self.backend.get()
+            self._inflight += 1
+            try:
+                pending = await self.handler(job["payload"])
+                if pending is None:
+                    await self.backend.ack(job)
+                    self.stats["processed"] += 1
+                else:
+                    await self.backend.save(job)
+                    task = asyncio.create_task(self._settle(job, pending))
+                    self._settling.add(task)
+                    task.add_done_callback(self._settling.discard)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                await self._failed(job, e)
+            finally:
+                self._inflight -= 1
+    
+    async def _settle(self, job: Dict, pending):
+        try:
+            await pending
+        except Exception as e:
+            await self._failed(job, e)
+        else:
+            await self.backend.ack(job)
+            self.stats["processed"] += 1
+    
+    async def _failed(self, job: Dict, error: Exception):
+        job["attempts"] += 1
+        if job["attempts"] < self.max_attempts:
+            delay = self.retry_base * 2 ** (job["attempts"] - 1) * random.uniform(0.8, 1.2)
+            logger.warning(f"🔁 Job {job['id']} failed ({error}), retry {job['attempts']} in {delay:.1f}s")
+            await self.backend.retry(job, delay)
+            self.stats["retried"] += 1
+        else:
+            logger.error(f"❌ Job {job['id']} dropped after {job['attempts']} attempts: {error}")
+            await self.backend.fail(job)
+            self.stats["failed"] += 1
+    
+    def depth(self) -> int:
+        """Jobs queued, running or waiting for their side effect to settle"""
+        return (self.backend.size() if self.backend else 0) + self._inflight + len(self._settling)
+    
+    async def stop(self, timeout: float = QUEUE_DRAIN_TIMEOUT):
+        """Stop accepting work, drain what is queued, then stop the workers"""
+        self._accepting = False
+        deadline = time.monotonic() + timeout
+        while self._tasks and self.depth() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        if self.depth():
+            logger.warning(f"⚠️ Job queue stopped with {self.depth()} jobs pending")
+        for task in self._tasks + list(self._settling):
+            task.cancel()
+        await asyncio.gather(*self._tasks, *self._settling, return_exceptions=True)
+        self._tasks = []
+        if self.backend is not None:
+            await self.backend.close()
+            self.backend = None
+
 # ========== FASTAPI ENDPOINTS ==========
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Open shared clients and workers on startup, drain and close them on shutdown"""
+    await telegram.start()
+    await job_queue.start()
+    yield
+    await job_queue.stop()
+    await bot.aggregator.drain()
+    await dispatcher.drain()
+    await telegram.close()
+    bot.feedback.writer.close()
+    dedup.close()
+
+app = FastAPI(lifespan=lifespan)
+
 @app.post("/api/webhook")
 async def telegram_webhook(request: Request):
     """Main webhook handler"""
+    started = time.perf_counter()
     try:
         update = await request.json()
         
+        # Edits, joins, stickers...: nothing to answer, so don't wake the workers
+        if not (update.get("message") or {}).get("text"):
+            return JSONResponse({"ok": True})
+        
+        # Telegram redelivers on slow acks; handle each update once
+        if await dedup.is_duplicate(update):
+            logger.info(f"♻️ Duplicate update {update.get('update_id')} dropped")
+            return JSONResponse({"ok": True})
+        
+        if PROFILE_REQUESTS and request.headers.get("x-profile") == "1":
+            update["_profile"] = True
+        
         # Process in background to avoid timeout
-        asyncio.create_task(process_and_respond(update))
+        if not await job_queue.submit(update):
+            logger.warning(f"⚠️ Update {update.get('update_id')} shed (queue full)")
         
         return JSONResponse({"ok": True})
         
     except Exception as e:
         logger.error(f"❌ Webhook error: {e}")
         return JSONResponse({"ok": True})
+    finally:
+        metrics.observe("japa_webhook_ack_seconds", time.perf_counter() - started)
+
+class DeliveryError(Exception):
+    """A reply did not reach Telegram for a reason worth retrying"""
+
+async def _sent(reply: str, sent: asyncio.Future) -> Tuple[str, Dict]:
+    return reply, await sent
+
+async def _confirm_delivery(delivery: Awaitable, update: Dict):
+    """Settle a job on its reply's (text, Telegram result)"""
+    reply, result = await delivery
+    # Nothing was sent, or a 4xx (blocked by the user, chat gone, bad markup) that
+    # will fail the same way again; 429 is retried by the dispatcher itself
+    if result is None or result.get("ok") or 400 <= (result.get("error_code") or 0) < 500:
+        return
+    update["_reply"] = reply
+    raise DeliveryError(f"update {update.get('update_id')}: {result.get('description')}")
 
 async def process_and_respond(update: Dict):
-    """Process message and send response (background task)"""
+    """Process message and queue the response (queued job).
+    
+    Only delivery is retried: a transport error or Telegram 5xx on the reply
+    fails the returned awaitable and the queue runs the job again. The reply
+    is kept on the update, so a retry resends it without logging or calling
+    the model a second time; a streamed reply is resent whole, as one message,
+    and a batch reply by the job of the batch's last message.
+    Processing errors already degrade to a fallback.
+    """
+    # Sampling is process-wide, so concurrent jobs show up in the profile too
+    profiling = update.pop("_profile", False) and profiler.start()
     try:
-        response_text = await bot.process_message(update)
+        response_text = update.get("_reply")
+        if response_text is None:
+            response_text = await bot.process_message(update)
+            if not response_text:
+                return None
+            if not isinstance(response_text, str):
+                # Already being delivered (streamed, or held for a group batch): settle on that
+                return _confirm_delivery(response_text, update)
+            update["_reply"] = response_text
         
-        if response_text:
-            message = update.get("message", {})
-            chat_id = message.get("chat", {}).get("id")
-            
-            # Show typing
-            await send_typing_action(chat_id)
-            
-            # Human-like delay
-            await asyncio.sleep(random.uniform(1, 2.5))
-            
-            # Send response
-            await send_telegram_message(chat_id, response_text)
+        message = update.get("message", {})
+        chat_id = message.get("chat", {}).get("id")
+        
+        # Show typing
+        dispatcher.send_typing(chat_id)
+        
+        # Human-like delay, held by the dispatcher's timer wheel instead of this task
+        sent = dispatcher.send_message(chat_id, response_text, delay=random.uniform(1, 2.5))
+        return _confirm_delivery(_sent(response_text, sent), update)
             
     except Exception as e:
         logger.error(f"❌ Response error: {e}")
+        raise
+    finally:
+        if profiling:
+            profiler.stop(f"update-{update.get('update_id')}")
+
+job_queue = WorkQueue(process_and_respond)
 
 @app.get("/")
 async def health():
@@ -505,40 +3202,40 @@ async def health():
 async def stats():
     """Bot statistics"""
     try:
-        with open("visa_intelligence.jsonl", "r") as f:
-            conversations = f.readlines()
+        # Running counters; only a cold start touches the log itself
+        conversation_stats = await asyncio.to_thread(bot.feedback.tracker.snapshot)
         
         return {
-            "total_conversations": len(conversations),
+            **conversation_stats,
+            "duplicate_updates_dropped": dedup.stats["duplicates"],
+            "gemini_tokens": bot.ai_engine.token_stats,
+            "streaming": bot.stream_stats,
+            "prefilter": bot.prefilter.snapshot(),
+            "circuit_breakers": {name: b.snapshot() for name, b in bot.ai_engine.breakers.items()},
+            "response_cache": dict(response_cache.stats, hit_rate=round(response_cache.hit_rate(), 3)) if response_cache else None,
             "bot": BOT_NAME,
             "ai_model": "Gemini Pro",
             "personality": "Warm, empathetic female advisor"
         }
     except:
-        return {"total_conversations": 0}
+        return {"total_conversations": 0, "duplicate_updates_dropped": dedup.stats["duplicates"]}
 
-# ========== HELPERS ==========
-async def send_telegram_message(chat_id: int, text: str):
-    """Send message"""
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendMessage"
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json={
-                "chat_id": chat_id,
-                "text": text,
-                "parse_mode": "Markdown"
-            })
-    except Exception as e:
-        logger.error(f"❌ Send error: {e}")
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Prometheus scrape endpoint"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-async def send_typing_action(chat_id: int):
-    """Show typing indicator"""
-    try:
-        url = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}/sendChatAction"
-        async with httpx.AsyncClient() as client:
-            await client.post(url, json={
-                "chat_id": chat_id,
-                "action": "typing"
-            })
-    except:
-        pass
\ No newline at end of file
+metrics.gauge("japa_queue_depth", "Work items queued or running", lambda: {
+    "jobs": job_queue.depth(), "outbound": dispatcher.depth(),
+    "aggregating": sum(len(b) for b in bot.aggregator._batches.values())
+}, "queue")
+metrics.gauge("japa_response_cache_hit_rate", "Response cache hit rate",
+              lambda: {"": response_cache.hit_rate()} if response_cache else {})
+metrics.gauge("japa_conversation_memory_bytes", "Approximate conversation memory in use",
+              lambda: {"": bot.ai_engine.conversation_history.bytes_used})
+metrics.gauge("japa_prefilter_messages", "Messages by pre-filter outcome", lambda: dict(
+    bot.prefilter.stats["rejected"], passed=bot.prefilter.stats["passed"]
+), "outcome")
+metrics.gauge("japa_gemini_breaker_state", "Circuit breaker state per model (0 closed, 1 half-open, 2 open)",
+              lambda: {name: ("closed", "half_open", "open").index(b.state)
+                       for name, b in bot.ai_engine.breakers.items()}, "model")
@@ -0,0 +1,162 @@
+"""
+Labeled regression fixtures for the text classifiers in api/bot.py.
+
+    python benchmarks/accuracy.py              # all fixtures
+    python benchmarks/accuracy.py keywords     # a subset
+
+- keywords:  VisaIntelligence.detect on whole words, plurals, overlaps and exclusions
+- sentiment: SentimentAnalyzer flags on substrings (canada/can, hardly/hard),
+             negation and contractions
+- retrieval: KnowledgeIndex.search boosts the country a query names by alias
+- prefilter: PreFilter drops commands and short group chatter, and marks
+             mentions of and replies to the bot
+
+Each case lists what must be found and what must not; exits 1 on any miss.
+"""
+import argparse
+import sys
+import tempfile
+from typing import Callable, Dict, List, Tuple
+
+from harness import import_bot
+from stubs import TelegramStub
+
+# (text, must detect, must not detect)
+KEYWORD_CASES: List[Tuple[str, List[str], List[str]]] = [
+    ("work visa application please", ["work visa", "visa application", "visa"], []),
+    ("student visa fee?", ["student visa", "visa fee", "visa"], []),
+    ("The UK Visa Fee is high", ["uk visa", "visa fee"], []),
+    ("Two student  visas for Canada PR", ["student visa", "canada pr"], []),
+    ("h-1b lottery results", ["h-1b"], []),
+    ("how to apply for a work permit", ["how to apply", "work permit"], []),
+    ("my visa debit card got declined", [], ["visa"]),
+    ("the coefficient is wrong", [], ["coe"]),
+    ("I have an interview at the embassy", ["interview", "embassy"], []),
+    ("passports and visas", ["passport", "visa"], []),
+    ("supervisable workflow", [], ["visa"]),
+    ("good morning everyone", [], ["visa"]),
+]
+
+# (text, expected is_question, is_stressed, is_positive)
+SENTIMENT_CASES: List[Tuple[str, bool, bool, bool]] = [
+    ("Canada is cold this time of the year", False, False, False),
+    ("Can I apply for a student visa with a HND", True, False, False),
+    ("hardly anyone replies here these days", False, False, False),
+    ("this is so hard and I'm struggling with the forms", False, True, False),
+    ("I'm not worried at all", False, False, False),
+    ("not happy with the embassy", False, False, False),
+    ("I don't know what to do, so stressed", False, True, False),
+    ("what's the fee for a uk visa", True, False, False),
+    ("how's the processing going for everyone", True, False, False),
+    ("where's the embassy in lagos", True, False, False),
+    ("Visa approved!!! Finally", False, False, True),
+    ("Does anyone know the IELTS score for Australia?", True, False, False),
+    ("I paid with my visa debit card and it went through", False, False, False),
+]
+
+def check_sentiment(japa) -> List[str]:
+    analyzer = japa.SentimentAnalyzer()
+    failures = []
+    for text, question, stressed, positive in SENTIMENT_CASES:
+        result = analyzer.analyze(text)
+        got = (result["is_question"], result["is_stressed"], result["is_positive"])
+        if got != (question, stressed, positive):
+            failures.append(f"{text!r}: expected question/stressed/positive "
+                            f"{(question, stressed, positive)}, got {got}")
+    return failures
+
+def check_keywords(japa) -> List[str]:
+    visa = japa.VisaIntelligence(None)
+    failures = []
+    for text, expected, forbidden in KEYWORD_CASES:
+        found = set(visa.detect(text))
+        missing = [k for k in expected if k not in found]
+        extra = [k for k in forbidden if k in found]
+        if missing or extra:
+            failures.append(f"{text!r}: missing {missing}, unexpected {extra} (got {sorted(found)})")
+    return failures
+
+# (query naming a country only by alias, country of the top chunk)
+RETRIEVAL_CASES: List[Tuple[str, str]] = [
+    ("london financial requirements", "uk"),
+    ("berlin financial requirements", "germany"),
+    ("americans financial requirements", "usa"),
+    ("ircc processing times", "canada"),
+    ("skillselect processing times", "australia"),
+]
+
+def check_retrieval(japa) -> List[str]:
+    index = japa.knowledge_index
+    failures = []
+    for query, country in RETRIEVAL_CASES:
+        top = index.search(query, k=1)
+        got = top[0]["country"] if top else None
+        if got != country:
+            failures.append(f"{query!r}: top chunk is {got}, expected {country}")
+    return failures
+
+BOT_TOKEN = "123:abc"
+
+def group_message(text: str, **extra) -> Dict:
+    return dict({"message_id": 1, "chat": {"id": -100, "type": "supergroup"}, "text": text}, **extra)
+
+# (message, chat type, expected check(): None to drop, else addressed)
+PREFILTER_CASES: List[Tuple[Dict, str, object]] = [
+    (group_message("/start"), "supergroup", None),
+    (group_message("ok thanks"), "supergroup", None),
+    (group_message("/help me please"), "private", None),
+    (group_message("hi"), "private", False),
+    (group_message("my friend told me how it went"), "supergroup", False),
+    (group_message("so stressed about the forms"), "supergroup", False),
+    (group_message("@JapaGenie how long is the wait",
+                   entities=[{"type": "mention", "offset": 0, "length": 10}]), "supergroup", True),
+    (group_message("thanks @someoneelse for the help",
+                   entities=[{"type": "mention", "offset": 7, "length": 12}]), "supergroup", False),
+    (group_message("what about the fees though",
+                   reply_to_message={"from": {"id": 123}}), "supergroup", True),
+    (group_message("what about the fees though",
+                   reply_to_message={"from": {"id": 456}}), "supergroup", False),
+]
+
+def check_prefilter(japa) -> List[str]:
+    prefilter = japa.PreFilter(bot_token=BOT_TOKEN, username="japagenie")
+    failures = []
+    for message, chat_type, expected in PREFILTER_CASES:
+        got = prefilter.check(message, message["text"].strip(), chat_type)
+        if got != expected:
+            failures.append(f"{message['text']!r} ({chat_type}): expected {expected}, got {got}")
+    return failures
+
+FIXTURES: Dict[str, Callable] = {
+    "keywords": check_keywords,
+    "sentiment": check_sentiment,
+    "retrieval": check_retrieval,
+    "prefilter": check_prefilter,
+}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Labeled classifier regression checks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Fixtures to run: {', '.join(FIXTURES)} (default: all)")
+    args = parser.parse_args(argv)
+    names = args.names or list(FIXTURES)
+    unknown = set(names) - set(FIXTURES)
+    if unknown:
+        parser.error(f"unknown fixture(s): {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="japa-accuracy-") as workdir:
+        japa = import_bot(TelegramStub(), workdir, {})
+        failures = []
+        for name in names:
+            found = FIXTURES[name](japa)
+            print(f"{name}: {'PASS' if not found else f'{len(found)} FAIL'}")
+            failures += [f"{name}: {line}" for line in found]
+    for line in failures:
+        print(f"❌ {line}", file=sys.stderr)
+    if failures:
+        return 1
+    print("✅ All labeled cases pass", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,167 @@
+"""
+Import-time and cold-start benchmark for the serverless entry point (api/bot.py).
+
+Each sample is a fresh interpreter, like a new Vercel instance:
+
+- `python -X importtime -c "import bot"`: total and heaviest imports
+- import, first health check and first ignored update through the ASGI app,
+  then whether the Gemini SDK got loaded along the way (it must not be)
+- the one-off SDK/model setup the first real reply pays for
+
+    python benchmarks/coldstart.py                     # assert the default budget
+    python benchmarks/coldstart.py --budget-ms 600 --samples 9
+    python benchmarks/coldstart.py --save              # write baselines/coldstart.json
+
+Exits 1 when the median import time is over budget or the SDK loads on the
+health/ignored-update path.
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Dict, List
+
+# No harness import: the child process must start with nothing but the stdlib loaded
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+SDK = "google.generativeai"
+
+def child_env(workdir: str) -> Dict[str, str]:
+    env = dict(os.environ)
+    env.update({
+        "TELEGRAM_BOT_TOKEN": "bench:token",
+        "TELEGRAM_API_BASE": "http://127.0.0.1:9",  # nothing on this path may call out
+        "GEMINI_API_KEY": "bench",
+        "CONVERSATION_LOG_PATH": os.path.join(workdir, "visa_intelligence.jsonl"),
+        "PYTHONWARNINGS": "ignore",
+    })
+    return env
+
+def parse_importtime(stderr: str) -> Dict:
+    """Top-level modules by cumulative microseconds from -X importtime output"""
+    top = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not name.startswith(" "):
+            top[name.strip()] = int(cumulative)
+    modules = {line.split("|")[-1].strip() for line in stderr.splitlines() if line.startswith("import time:")}
+    return {"top": top, "modules": modules}
+
+def sample_importtime(env: Dict[str, str]) -> Dict:
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import bot"],
+        cwd=ROOT / "api", env=env, capture_output=True, text=True, check=True
+    )
+    parsed = parse_importtime(result.stderr)
+    return {
+        "bot_ms": parsed["top"].get("bot", 0) / 1000,
+        "heaviest": dict(sorted(parsed["top"].items(), key=lambda kv: -kv[1])[:8]),
+        "sdk_imported": any(m == SDK or m.startswith(SDK + ".") for m in parsed["modules"]),
+    }
+
+def sample_coldstart(env: Dict[str, str]) -> Dict:
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, __file__, "--child"],
+        cwd=ROOT / "api", env=env, capture_output=True, text=True, check=True
+    )
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["process_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
+
+def child() -> None:
+    """Runs inside the fresh interpreter; prints one JSON line"""
+    import logging
+    logging.disable(logging.CRITICAL)
+    started = time.perf_counter()
+    sys.path.insert(0, str(ROOT / "api"))
+    import bot
+    imported = time.perf_counter()
+
+    import httpx
+
+    async def first_requests():
+        transport = httpx.ASGITransport(app=bot.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+            t0 = time.perf_counter()
+            (await client.get("/")).raise_for_status()
+            t1 = time.perf_counter()
+            ignored = {"update_id": 1, "edited_message": {"message_id": 1, "chat": {"id": 1, "type": "private"}}}
+            (await client.post("/api/webhook", json=ignored)).raise_for_status()
+            t2 = time.perf_counter()
+        return t1 - t0, t2 - t1
+
+    health, ignored = asyncio.run(first_requests())
+    sdk_loaded = SDK in sys.modules
+    t0 = time.perf_counter()
+    bot._load_gemini()
+    first_reply_init = time.perf_counter() - t0
+    print(json.dumps({
+        "import_ms": round((imported - started) * 1000, 1),
+        "first_health_ms": round(health * 1000, 2),
+        "first_ignored_update_ms": round(ignored * 1000, 2),
+        "sdk_loaded_before_reply": sdk_loaded,
+        "first_reply_init_ms": round(first_reply_init * 1000, 1),
+    }))
+
+def median_of(samples: List[Dict], key: str) -> float:
+    return round(statistics.median(s[key] for s in samples), 1)
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Cold-start benchmark for api/bot.py")
+    parser.add_argument("--samples", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=800.0, help="Median `import bot` budget")
+    parser.add_argument("--save", action="store_true", help="Store results as baselines/coldstart.json")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    if args.child:
+        child()
+        return 0
+
+    with tempfile.TemporaryDirectory(prefix="japa-cold-") as workdir:
+        env = child_env(workdir)
+        sample_importtime(env)  # warm the bytecode cache so samples compare like with like
+        importtimes = [sample_importtime(env) for _ in range(args.samples)]
+        coldstarts = [sample_coldstart(env) for _ in range(args.samples)]
+
+    report = {
+        "samples": args.samples,
+        "budget_ms": args.budget_ms,
+        "importtime_bot_ms": median_of(importtimes, "bot_ms"),
+        "importtime_heaviest_us": importtimes[-1]["heaviest"],
+        "sdk_imported_at_startup": any(s["sdk_imported"] for s in importtimes),
+        "import_ms": median_of(coldstarts, "import_ms"),
+        "first_health_ms": median_of(coldstarts, "first_health_ms"),
+        "first_ignored_update_ms": median_of(coldstarts, "first_ignored_update_ms"),
+        "sdk_loaded_before_reply": any(s["sdk_loaded_before_reply"] for s in coldstarts),
+        "first_reply_init_ms": median_of(coldstarts, "first_reply_init_ms"),
+        "process_ms": median_of(coldstarts, "process_ms"),
+    }
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / "coldstart.json").write_text(text + "\n")
+
+    failures = []
+    if report["importtime_bot_ms"] > args.budget_ms:
+        failures.append(f"import bot took {report['importtime_bot_ms']}ms (budget {args.budget_ms}ms)")
+    if report["sdk_imported_at_startup"] or report["sdk_loaded_before_reply"]:
+        failures.append(f"{SDK} loaded before any reply needed it")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    if failures:
+        return 1
+    print("✅ Cold start within budget", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
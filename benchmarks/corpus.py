@@ -0,0 +1,123 @@
+"""
+Synthetic Telegram traffic modelled on the japa groups the bot sits in:
+visa questions, stressed posts, celebrations and ordinary chatter, plus
+bursts where several people post in the same group within seconds.
+"""
+import random
+from typing import Dict, Iterator, List, Tuple
+
+QUESTIONS = [
+    "How long does the UK skilled worker visa take to process?",
+    "What is the proof of funds for Canada express entry?",
+    "Can I apply for a student visa with a HND?",
+    "Does anyone know the IELTS score needed for Australia 189?",
+    "Should I use WES or ICAS for my credential assessment?",
+    "Which documents do I need for the biometrics appointment?",
+    "Is it true that Germany's opportunity card doesn't need a job offer?",
+    "how much is the IHS for a 3 year tier 2 visa?",
+    "When do CAS letters usually come out for September intake?",
+    "What bank statement period does the embassy want for a visitor visa?",
+    "Anyone here done the blue card route? how long for the appointment",
+    "Do I need a police certificate for PR or only for the work permit?",
+]
+STRESSED = [
+    "I'm so worried, my visa got refused again and I don't know what to do",
+    "Really stressed about the interview tomorrow, the embassy scares me",
+    "Been waiting 14 weeks for a decision, I'm overwhelmed honestly",
+    "Confused about the sponsorship letter, nothing makes sense",
+]
+POSITIVE = [
+    "Visa approved!!! Finally, thank you all for the help",
+    "Got my CAS today, so excited",
+    "Biometrics done, everything went smoothly 🙏",
+    "My PR got accepted, can't believe it",
+]
+CHATTER = [
+    "good morning everyone",
+    "lol same here",
+    "😂😂😂",
+    "who is watching the match tonight",
+    "thanks bro",
+    "abeg share the link",
+    "I paid with my visa debit card and it went through",
+    "Canada is cold this time of the year",
+    "okay noted",
+    "hardly anyone replies here these days",
+]
+
+PRIVATE_MIX = [(QUESTIONS, 0.7), (STRESSED, 0.15), (POSITIVE, 0.05), (CHATTER, 0.1)]
+GROUP_MIX = [(QUESTIONS, 0.35), (STRESSED, 0.1), (POSITIVE, 0.1), (CHATTER, 0.45)]
+
+def messages(n: int = 1000, seed: int = 1) -> List[str]:
+    """A shuffled, group-weighted message corpus for microbenchmarks"""
+    rng = random.Random(seed)
+    return [_pick(rng, GROUP_MIX) for _ in range(n)]
+
+FILLER = [
+    "please", "guys", "abeg", "honestly", "so", "my", "friend", "said", "that", "the", "agent",
+    "told", "me", "last", "week", "and", "now", "I", "am", "not", "sure", "if", "we", "should",
+    "wait", "or", "just", "go", "ahead", "with", "it", "because", "time", "is", "running", "out",
+    "money", "family", "job", "school", "letter", "email", "portal", "update", "today", "again",
+]
+
+def varied(n: int = 1000, seed: int = 1) -> List[str]:
+    """Mostly unique messages of realistic length: one to four pool sentences
+    joined by random filler, so caching and branch prediction see new text"""
+    rng = random.Random(seed)
+    out = []
+    for _ in range(n):
+        parts = []
+        for _ in range(rng.choice((1, 1, 1, 2, 2, 3, 4))):
+            parts.append(_pick(rng, GROUP_MIX))
+            parts.append(" ".join(rng.choices(FILLER, k=rng.randint(0, 12))))
+        out.append(" ".join(p for p in parts if p))
+    return out
+
+def _pick(rng: random.Random, mix) -> str:
+    pools, weights = zip(*mix)
+    return rng.choice(rng.choices(pools, weights)[0])
+
+def make_update(update_id: int, chat_id: int, chat_type: str, user_id: int, text: str) -> Dict:
+    chat = {"id": chat_id, "type": chat_type}
+    if chat_type != "private":
+        chat["title"] = f"Japa Group {abs(chat_id) % 1000}"
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+            "chat": chat,
+            "date": 1700000000 + update_id,
+            "text": text,
+        },
+    }
+
+def synthetic(rate: float, duration: float, chats: int = 50, private_share: float = 0.3,
+              burst_size: int = 4, seed: int = 1) -> Iterator[Tuple[float, Dict]]:
+    """(offset_seconds, update) pairs, about `rate` messages per second on average.
+    
+    Arrivals are Poisson; a group arrival is a burst of 1..`burst_size`
+    messages from different users of the same chat, a few hundred ms apart.
+    """
+    rng = random.Random(seed)
+    mean_arrival = private_share + (1 - private_share) * (1 + burst_size) / 2
+    t = 0.0
+    update_id = 1
+    private_chats = max(1, int(chats * private_share))
+    group_chats = max(1, chats - private_chats)
+    while True:
+        t += rng.expovariate(rate / mean_arrival)
+        if t >= duration:
+            return
+        if rng.random() < private_share:
+            user_id = 1000 + rng.randrange(private_chats)
+            yield t, make_update(update_id, user_id, "private", user_id, _pick(rng, PRIVATE_MIX))
+            update_id += 1
+            continue
+        chat_id = -100 - rng.randrange(group_chats)
+        offset = t
+        for _ in range(rng.randint(1, burst_size)):
+            user_id = 5000 + rng.randrange(400)
+            yield offset, make_update(update_id, chat_id, "supergroup", user_id, _pick(rng, GROUP_MIX))
+            update_id += 1
+            offset += rng.uniform(0.1, 0.6)
@@ -0,0 +1,199 @@
+"""
+OutboundDispatcher under injected 429s, against the Telegram stub.
+
+    python benchmarks/dispatch.py                  # all scenarios
+    python benchmarks/dispatch.py ratelimit        # a subset
+
+- ratelimit: the stub answers every Nth sendMessage with 429 retry_after;
+             each message is still delivered once, in order per chat, and
+             nothing goes to a paused chat before retry_after has passed
+- limits:    per-chat and global rates hold while messages are queued
+- wheel:     delays that are an exact multiple of the wheel length fire on
+             time, not a full turn late
+- buckets:   idle per-chat buckets are swept once there are many chats
+- feedback:  a high-priority log entry queues the channel post and returns
+
+Exits 1 if any check fails.
+"""
+import argparse
+import asyncio
+import contextlib
+import logging
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Callable, Dict, List, Tuple
+
+from harness import import_bot
+from stubs import TelegramStub
+
+RETRY_AFTER = 1
+
+class Checks:
+    def __init__(self):
+        self.failed: List[str] = []
+
+    def __call__(self, ok: bool, label: str):
+        print(f"  {'PASS' if ok else 'FAIL'}  {label}")
+        if not ok:
+            self.failed.append(label)
+
+def sends(stub: TelegramStub) -> Dict[int, List]:
+    """Accepted sendMessage calls per chat, as (time, text) in arrival order"""
+    per_chat = defaultdict(list)
+    for call in stub.replies():
+        if call["method"] == "sendMessage":
+            per_chat[call["payload"]["chat_id"]].append((call["t"], call["payload"]["text"]))
+    return per_chat
+
+@contextlib.contextmanager
+def recorded(japa):
+    """(time, chat_id, result) for each sendMessage as the dispatcher makes it,
+    free of the jitter between the bot and the stub"""
+    attempts: List[Tuple[float, int, Dict]] = []
+    call = japa.telegram.call
+
+    async def recording(method, payload):
+        t = time.monotonic()
+        result = await call(method, payload)
+        if method == "sendMessage":
+            attempts.append((t, payload["chat_id"], result))
+        return result
+
+    japa.telegram.call = recording
+    try:
+        yield attempts
+    finally:
+        japa.telegram.call = call
+
+# ========== SCENARIOS ==========
+async def scenario_ratelimit(japa, stub: TelegramStub, check: Checks):
+    stub.rate_limit_every, stub.retry_after = 7, RETRY_AFTER
+    dispatcher = japa.OutboundDispatcher(japa.telegram, global_rate=1000, chat_rate=50, group_rate=50)
+    chats, per_chat = 20, 10
+    with recorded(japa) as attempts:
+        futures = [dispatcher.send_message(chat, f"{chat}:{n}", parse_mode=None)
+                   for n in range(per_chat) for chat in range(1, chats + 1)]
+        try:
+            results = await asyncio.wait_for(asyncio.gather(*futures), timeout=30)
+        finally:
+            stub.rate_limit_every = 0
+
+    delivered = sends(stub)
+    check(stub.rate_limited > 0 and dispatcher.stats["rate_limited"] == stub.rate_limited,
+          f"429s injected and seen ({stub.rate_limited} by the stub, {dispatcher.stats['rate_limited']} handled)")
+    check(all(r.get("ok") for r in results), "every future resolves to an accepted send")
+    check(all([text for _, text in delivered[chat]] == [f"{chat}:{n}" for n in range(per_chat)]
+              for chat in range(1, chats + 1)),
+          "each message delivered exactly once, in order per chat")
+    paused: Dict[int, float] = {}
+    early = set()
+    for t, chat, result in attempts:
+        if t < paused.get(chat, 0):
+            early.add(chat)
+        if result.get("error_code") == 429:
+            paused[chat] = t + RETRY_AFTER
+    check(not early, f"no send to a chat before its retry_after ran out ({len(early)} chats early)")
+
+async def scenario_limits(japa, stub: TelegramStub, check: Checks):
+    dispatcher = japa.OutboundDispatcher(japa.telegram, global_rate=40, chat_rate=10, group_rate=4)
+    with recorded(japa) as attempts:
+        futures = [dispatcher.send_message(chat, f"limit {n}", parse_mode=None)
+                   for n in range(20) for chat in (-1, -2, 3, 4, 5, 6, 7, 8) if chat > 0 or n < 6]
+        await asyncio.wait_for(asyncio.gather(*futures), timeout=30)
+    gaps = defaultdict(list)
+    last: Dict[int, float] = {}
+    for t, chat, _ in attempts:
+        if chat in last:
+            gaps[chat].append(t - last[chat])
+        last[chat] = t
+    # Gaps are timed where the request starts, a little after the bucket allowed it
+    group = min(gaps[-1] + gaps[-2])
+    check(group > 1 / 4 * 0.8, f"group chats at most 4/s (min gap {group:.3f}s)")
+    private = min(g for chat in (3, 4, 5) for g in gaps[chat])
+    check(private > 1 / 10 * 0.8, f"private chats at most 10/s (min gap {private:.3f}s)")
+    # Token bucket bound: any span of sends holds at most the burst (40) plus 40/s
+    times = [t for t, _, _ in attempts]
+    over = max(j - i + 1 - (40 + 40 * (times[j] - times[i]))
+               for i in range(len(times)) for j in range(i, len(times)))
+    check(over <= 2, f"global at most a 40 burst plus 40/s ({over:.1f} sends over the bound)")
+
+async def scenario_wheel(japa, stub: TelegramStub, check: Checks):
+    wheel = japa.TimerWheel(tick=0.01, slots=16)
+    fired: Dict[float, float] = {}
+    started = time.perf_counter()
+    for delay in (0.01, 0.15, 0.16, 0.17, 0.32):  # 0.16 and 0.32 are 1 and 2 full turns
+        wheel.schedule(delay, lambda d=delay: fired.setdefault(d, time.perf_counter() - started))
+    await asyncio.sleep(0.6)
+    wheel.cancel_all()
+    late = {d: round(t, 3) for d, t in fired.items() if not d - 0.001 <= t <= d + 0.05}
+    check(len(fired) == 5 and not late, f"every delay fires on its tick (late or early: {late})")
+
+async def scenario_buckets(japa, stub: TelegramStub, check: Checks):
+    dispatcher = japa.OutboundDispatcher(japa.telegram, global_rate=1e9, chat_rate=1000, group_rate=1000)
+    now = time.monotonic()
+    for chat in range(25000):  # one message each, long ago enough to have refilled
+        dispatcher._chat_bucket(chat, now + chat * 0.01)
+    kept = len(dispatcher._chat_buckets)
+    check(kept < 20000, f"idle chat buckets swept ({kept} of 25000 kept)")
+
+async def scenario_feedback(japa, stub: TelegramStub, check: Checks):
+    start = len(stub.calls)
+    feedback = japa.FeedbackSystem()
+    record = {"user_name": "Ada", "keywords": ["visa"], "text": "urgent", "priority": "high", "chat_id": -1}
+    started = time.perf_counter()
+    for _ in range(5):  # the channel allows 1/s: awaiting each post would take ~4s
+        await feedback.log_conversation(record)
+    elapsed = time.perf_counter() - started
+    feedback.writer.close()
+    check(elapsed < 0.5, f"logging 5 high-priority entries does not wait on the channel ({elapsed:.2f}s)")
+    await japa.dispatcher.drain(timeout=10)
+    posts = [c for c in stub.calls[start:] if c["payload"].get("chat_id") == feedback.feedback_channel_id]
+    check(len(posts) == 5, f"all 5 channel posts still go out ({len(posts)})")
+
+SCENARIOS: Dict[str, Callable] = {
+    "ratelimit": scenario_ratelimit,
+    "limits": scenario_limits,
+    "wheel": scenario_wheel,
+    "buckets": scenario_buckets,
+    "feedback": scenario_feedback,
+}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Outbound dispatcher checks with injected 429s")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    args = parser.parse_args(argv)
+    names = args.names or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    check = Checks()
+    stub = TelegramStub(latency=0.002).start()
+    try:
+        with tempfile.TemporaryDirectory(prefix="japa-dispatch-") as workdir:
+            japa = import_bot(stub, workdir, {})
+            logging.getLogger("bot").setLevel(logging.ERROR)  # 429 warnings are expected
+
+            async def run(name):
+                await japa.telegram.start()
+                try:
+                    await SCENARIOS[name](japa, stub, check)
+                finally:
+                    await japa.telegram.close()
+
+            for name in names:
+                print(name)
+                asyncio.run(run(name))
+    finally:
+        stub.stop()
+    if check.failed:
+        print(f"❌ {len(check.failed)} check(s) failed", file=sys.stderr)
+        return 1
+    print("✅ Dispatcher kept order and limits under 429s", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
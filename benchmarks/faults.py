@@ -0,0 +1,271 @@
+"""
+Fault injection for the Gemini circuit breakers, reply deadline and model tiers.
+
+Each scenario drives AIConversationEngine against local FakeGemini models whose
+latency and error rate are changed mid-run; nothing leaves the machine.
+
+    python benchmarks/faults.py               # all scenarios
+    python benchmarks/faults.py trip tiers    # a subset
+
+- trip:     failing model trips the breaker; later calls answer without calling it
+- recovery: after the cooldown a half-open probe succeeds and the breaker closes
+- slow:     slow calls count as failures and trip the breaker too
+- deadline: a slow model misses GEMINI_DEADLINE; the late reply still fills the cache,
+            and a late failure is consumed rather than left on an orphaned task
+- stream:   no first chunk before the deadline streams a degraded answer instead
+- broken:   a stream that fails midway is neither cached nor remembered
+- slots:    a slow stream consumer does not hold a Gemini call slot
+- setup:    a stream whose model setup fails gives back its half-open probe
+- tiers:    a tripped or saturated primary routes to the fast tier
+
+Exits 1 if any check fails.
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from harness import import_bot
+from stubs import FakeGemini, TelegramStub
+
+COOLDOWN = 0.3
+CONTEXT = {"chat_id": 1, "user_id": 1, "chat_type": "private", "user_name": "Ada", "keywords": ["uk visa"]}
+QUESTION = "How long does the UK skilled worker visa take to process?"
+
+class Checks:
+    def __init__(self):
+        self.failed: List[str] = []
+
+    def __call__(self, ok: bool, label: str):
+        print(f"  {'PASS' if ok else 'FAIL'}  {label}")
+        if not ok:
+            self.failed.append(label)
+
+def engine_with(japa, primary: FakeGemini, fast: FakeGemini = None, cache: bool = False, **breaker):
+    """Engine on fake models, breakers with a short cooldown; no cache unless asked,
+    so repeated questions keep reaching the model"""
+    japa.model = primary
+    japa.response_cache = japa.MemoryResponseCache() if cache else None
+    engine = japa.AIConversationEngine(use_system_instruction=False, fast_models=["fast"] if fast else [])
+    if fast:
+        engine.tier_models["fast"] = fast
+    options = dict(window=10, min_calls=5, failure_ratio=0.5, slow_call=1.0, cooldown=COOLDOWN)
+    options.update(breaker)
+    engine.breakers = {name: japa.CircuitBreaker(name, **options) for name in engine.tiers}
+    return engine
+
+def context(n: int) -> Dict:
+    return dict(CONTEXT, user_id=n)
+
+# ========== SCENARIOS ==========
+async def scenario_trip(japa, check: Checks):
+    primary = FakeGemini(latency=0.01, error_rate=1.0)
+    engine = engine_with(japa, primary)
+    for n in range(5):
+        await engine.generate_response(QUESTION, context(n))
+    breaker = engine.breakers[japa.GEMINI_MODEL]
+    check(breaker.state == "open", f"breaker open after 5 failures (state={breaker.state})")
+
+    calls = primary.calls
+    started = time.perf_counter()
+    replies = [await engine.generate_response(QUESTION, context(n)) for n in range(20)]
+    elapsed = time.perf_counter() - started
+    check(primary.calls == calls, f"no model calls while open ({primary.calls - calls} made)")
+    check(all(r and r != FakeGemini.REPLY for r in replies), "every caller still gets a fallback reply")
+    check(elapsed < 0.1, f"open breaker fails fast ({elapsed * 1000:.1f}ms for 20 replies)")
+
+async def scenario_recovery(japa, check: Checks):
+    primary = FakeGemini(latency=0.01, error_rate=1.0)
+    engine = engine_with(japa, primary)
+    for n in range(5):
+        await engine.generate_response(QUESTION, context(n))
+    breaker = engine.breakers[japa.GEMINI_MODEL]
+    primary.error_rate = 0.0
+    await asyncio.sleep(COOLDOWN * 1.2)
+
+    # Concurrent callers during the half-open window: one probe, the rest degrade
+    calls = primary.calls
+    replies = await asyncio.gather(*(engine.generate_response(QUESTION, context(n)) for n in range(5)))
+    check(primary.calls - calls == 1, f"one half-open probe ({primary.calls - calls} calls)")
+    check(replies.count(FakeGemini.REPLY) >= 1, "the probe's caller gets the model reply")
+    check(breaker.state == "closed", f"breaker closed after a good probe (state={breaker.state})")
+
+    primary.error_rate = 1.0
+    for n in range(5):
+        await engine.generate_response(QUESTION, context(n))
+    primary.error_rate = 0.0
+    await asyncio.sleep(COOLDOWN * 1.2)
+    primary.error_rate = 1.0
+    await engine.generate_response(QUESTION, context(0))
+    check(breaker.state == "open", f"failed probe re-opens the breaker (state={breaker.state})")
+    check(breaker.snapshot()["trips"] == 3, f"three trips counted ({breaker.snapshot()['trips']})")
+
+async def scenario_slow(japa, check: Checks):
+    primary = FakeGemini(latency=0.08)
+    engine = engine_with(japa, primary, slow_call=0.03)
+    await asyncio.gather(*(engine.generate_response(QUESTION, context(n)) for n in range(5)))
+    breaker = engine.breakers[japa.GEMINI_MODEL]
+    check(breaker.state == "open", f"slow calls trip the breaker (state={breaker.state})")
+    check(breaker.snapshot()["slow"] == 5, f"five slow calls counted ({breaker.snapshot()['slow']})")
+
+async def scenario_deadline(japa, check: Checks):
+    primary = FakeGemini(latency=0.4)
+    engine = engine_with(japa, primary, cache=True)
+    japa.GEMINI_DEADLINE = 0.05
+    try:
+        started = time.perf_counter()
+        reply = await engine.generate_response(QUESTION, context(1))
+        elapsed = time.perf_counter() - started
+        check(elapsed < 0.15, f"answered at the deadline ({elapsed * 1000:.0f}ms, model ~400ms)")
+        check(reply and reply != FakeGemini.REPLY, "deadline answer is the fallback template")
+
+        await asyncio.gather(*engine._background)
+        calls = primary.calls
+        reply = await engine.generate_response(QUESTION, context(2))
+        check(reply == FakeGemini.REPLY and primary.calls == calls, "late reply was cached for the next asker")
+
+        reply = await engine.generate_response("Roughly how long does the UK skilled worker visa take?", context(3))
+        check(reply == FakeGemini.REPLY, "a looser match answers from the cache at the deadline")
+
+        # Not cacheable (no cache) and the late call fails: someone must still await it
+        await asyncio.gather(*engine._background)
+        engine = engine_with(japa, FakeGemini(latency=0.2, error_rate=1.0))
+        unhandled = []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: unhandled.append(ctx["message"]))
+        await engine.generate_response(QUESTION, context(4))
+        check(len(engine._background) == 1, f"the late call is tracked ({len(engine._background)} tasks)")
+        await asyncio.sleep(0.6)  # past the call's own latency, tracked or not
+        gc.collect()
+        check(not unhandled, f"its failure is consumed ({unhandled})")
+    finally:
+        japa.GEMINI_DEADLINE = 0.0
+
+async def scenario_stream(japa, check: Checks):
+    primary = FakeGemini(latency=0.4)
+    engine = engine_with(japa, primary)
+    japa.GEMINI_DEADLINE = 0.05
+    try:
+        started = time.perf_counter()
+        chunks = [chunk async for chunk in engine.stream_response(QUESTION, context(1))]
+        elapsed = time.perf_counter() - started
+        check(elapsed < 0.15, f"stream degraded at the deadline ({elapsed * 1000:.0f}ms)")
+        check(len(chunks) == 1 and chunks[0] != FakeGemini.REPLY, "one fallback chunk streamed")
+
+        primary.latency = 0.02
+        chunks = [chunk async for chunk in engine.stream_response(QUESTION, context(2))]
+        check(chunks and chunks[-1] == FakeGemini.REPLY.strip(), "fast stream unaffected by the deadline")
+        breaker = engine.breakers[japa.GEMINI_MODEL].snapshot()
+        check(breaker["failures"] == 1 and breaker["calls"] == 2,
+              f"breaker saw one miss and one first chunk ({breaker})")
+    finally:
+        japa.GEMINI_DEADLINE = 0.0
+
+async def scenario_broken(japa, check: Checks):
+    primary = FakeGemini(latency=0.02, fail_after_chunks=2)
+    engine = engine_with(japa, primary, cache=True)
+    fallbacks = japa.metrics._counters["japa_replies_total"].get("fallback", 0)
+    chunks = [chunk async for chunk in engine.stream_response(QUESTION, context(1))]
+    check(chunks and FakeGemini.REPLY.startswith(chunks[-1]) and chunks[-1] != FakeGemini.REPLY.strip(),
+          f"the partial reply was streamed ({len(chunks)} updates)")
+    check(await japa.response_cache.get(QUESTION, context(2)) is None, "the cut-off reply was not cached")
+    check(not engine.conversation_history.active((1, 1)), "nor remembered as the user's conversation")
+    check(japa.metrics._counters["japa_replies_total"].get("fallback", 0) == fallbacks + 1,
+          "counted as a fallback reply")
+
+async def scenario_slots(japa, check: Checks):
+    primary = FakeGemini(latency=0.04, chunks=8)
+    engine = engine_with(japa, primary)
+    slots = japa.GEMINI_MAX_CONCURRENCY
+    updates = 0
+    async for _ in engine.stream_response(QUESTION, context(1)):
+        updates += 1
+        await asyncio.sleep(0.2)  # a throttled editMessageText; the model is done long before
+        if updates == 1:
+            check(engine._gemini_slots._value == slots and engine._inflight == 0,
+                  f"slot free while the consumer is still sending ({engine._gemini_slots._value}/{slots})")
+    check(updates < 8, f"a slow consumer gets fewer, longer updates ({updates} for 8 chunks)")
+
+async def scenario_setup(japa, check: Checks):
+    primary = FakeGemini(latency=0.01, error_rate=1.0)
+    engine = engine_with(japa, primary)
+    for n in range(5):
+        await engine.generate_response(QUESTION, context(n))
+    breaker = engine.breakers[japa.GEMINI_MODEL]
+    primary.error_rate = 0.0
+    await asyncio.sleep(COOLDOWN * 1.2)
+
+    def broken_setup(prompt, tier):
+        raise RuntimeError("model setup failed")
+
+    engine._model_and_prompt = broken_setup  # fails after admission, before any call
+    chunks = [chunk async for chunk in engine.stream_response(QUESTION, context(1))]
+    check(len(chunks) == 1 and chunks[0] != FakeGemini.REPLY, "the probe's caller gets a fallback")
+    check(breaker.state == "open", f"failed setup counts as a failed probe (state={breaker.state})")
+
+    del engine._model_and_prompt
+    await asyncio.sleep(COOLDOWN * 1.2)
+    chunks = [chunk async for chunk in engine.stream_response(QUESTION, context(2))]
+    check(chunks and chunks[-1] == FakeGemini.REPLY.strip() and breaker.state == "closed",
+          f"the next probe is admitted and closes the breaker (state={breaker.state})")
+
+async def scenario_tiers(japa, check: Checks):
+    primary = FakeGemini(latency=0.01, error_rate=1.0)
+    fast = FakeGemini(latency=0.01)
+    engine = engine_with(japa, primary, fast)
+    for n in range(5):
+        await engine.generate_response(QUESTION, context(n))
+    check(engine.breakers[japa.GEMINI_MODEL].state == "open", "primary tripped")
+    replies = [await engine.generate_response(QUESTION, context(n)) for n in range(5, 10)]
+    check(all(r == FakeGemini.REPLY for r in replies) and fast.calls >= 5,
+          f"fast tier answers while the primary is open ({fast.calls} fast calls)")
+
+    # Healthy but saturated primary: calls past GEMINI_FAST_LOAD of the slots go fast
+    primary = FakeGemini(latency=0.2)
+    fast = FakeGemini(latency=0.01)
+    engine = engine_with(japa, primary, fast)
+    load = japa.GEMINI_MAX_CONCURRENCY
+    await asyncio.gather(*(engine.generate_response(QUESTION, context(n)) for n in range(load * 2)))
+    check(primary.calls >= japa.GEMINI_FAST_LOAD * load - 1 and fast.calls > 0,
+          f"load split across tiers (primary={primary.calls}, fast={fast.calls})")
+
+SCENARIOS: Dict[str, Callable] = {
+    "trip": scenario_trip,
+    "recovery": scenario_recovery,
+    "slow": scenario_slow,
+    "deadline": scenario_deadline,
+    "stream": scenario_stream,
+    "broken": scenario_broken,
+    "slots": scenario_slots,
+    "setup": scenario_setup,
+    "tiers": scenario_tiers,
+}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Gemini fault-injection checks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Scenarios to run: {', '.join(SCENARIOS)} (default: all)")
+    args = parser.parse_args(argv)
+    names = args.names or list(SCENARIOS)
+    unknown = set(names) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+
+    check = Checks()
+    with tempfile.TemporaryDirectory(prefix="japa-faults-") as workdir:
+        japa = import_bot(TelegramStub(), workdir, {"RESPONSE_CACHE_BACKEND": "memory"})
+        logging.getLogger("bot").setLevel(logging.CRITICAL)  # injected failures are expected
+        for name in names:
+            print(name)
+            asyncio.run(SCENARIOS[name](japa, check))
+    if check.failed:
+        print(f"❌ {len(check.failed)} check(s) failed", file=sys.stderr)
+        return 1
+    print("✅ All fault scenarios behaved", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,370 @@
+"""
+Load-test harness for the webhook pipeline.
+
+Replays synthetic or recorded Telegram updates against the FastAPI app at a
+fixed rate, with a local Bot API stub in place of api.telegram.org and a fake
+Gemini model, then reports throughput, webhook ack latency, end-to-end reply
+latency and memory growth as JSON.
+
+    python benchmarks/harness.py --scenario steady
+    python benchmarks/harness.py --scenario slow-llm --save        # write baseline
+    python benchmarks/harness.py --scenario slow-llm --compare     # exit 1 on regression
+    python benchmarks/harness.py --updates recorded.jsonl --rate 20
+    python benchmarks/harness.py --scenario burst --env AGGREGATE_WINDOW=0
+
+Recorded files hold one Telegram update per line; an optional "_t" key
+(seconds from start) replays the original timing instead of --rate.
+Each run imports the bot fresh, so run one scenario per process.
+"""
+import argparse
+import asyncio
+import contextvars
+import importlib
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from corpus import synthetic
+from stubs import FakeGemini, TelegramStub
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE_DIR = Path(__file__).resolve().parent / "baselines"
+
+# Defaults per named scenario; explicit flags win
+SCENARIOS = {
+    "steady": {"rate": 20, "duration": 20, "gemini_latency": 0.8, "gemini_error_rate": 0.0},
+    "burst": {"rate": 60, "duration": 15, "gemini_latency": 0.8, "gemini_error_rate": 0.0, "burst_size": 6},
+    "slow-llm": {"rate": 20, "duration": 20, "gemini_latency": 8.0, "gemini_error_rate": 0.0},
+    "flaky-llm": {"rate": 20, "duration": 20, "gemini_latency": 1.5, "gemini_error_rate": 0.2},
+}
+DEFAULTS = {"rate": 10, "duration": 10, "gemini_latency": 0.8, "gemini_error_rate": 0.0, "burst_size": 4}
+
+# Metric -> True if higher is better; used by --compare
+REGRESSION_METRICS = {
+    "throughput_per_s": True,
+    "ack_ms.p95": False,
+    "ack_ms.p99": False,
+    "reply_s.p50": False,
+    "reply_s.p95": False,
+    "rss_growth_mb": False,
+}
+
+def percentiles(values: List[float], scale: float = 1.0) -> Dict:
+    if not values:
+        return {"count": 0}
+    ordered = sorted(values)
+
+    def at(q):
+        return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * scale, 3)
+
+    return {
+        "count": len(ordered),
+        "mean": round(sum(ordered) / len(ordered) * scale, 3),
+        "p50": at(0.50), "p90": at(0.90), "p95": at(0.95), "p99": at(0.99),
+        "max": round(ordered[-1] * scale, 3),
+    }
+
+def rss_mb() -> float:
+    """Resident set size; falls back to peak RSS where /proc is missing"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2 ** 20 if sys.platform == "darwin" else peak / 1024
+
+def load_updates(path: str, rate: float) -> List[Tuple[float, Dict]]:
+    updates = []
+    with open(path) as f:
+        for n, line in enumerate(f):
+            if line.strip():
+                update = json.loads(line)
+                updates.append((update.pop("_t", n / rate), update))
+    return updates
+
+def import_bot(stub: TelegramStub, workdir: str, env: Dict[str, str]):
+    """Import api/bot.py pointed at the stub, with logs and state in a scratch dir"""
+    os.environ.update({
+        "TELEGRAM_BOT_TOKEN": "bench:token",
+        "TELEGRAM_API_BASE": stub.base_url,
+        "GEMINI_API_KEY": "bench",
+        "GEMINI_SYSTEM_INSTRUCTION": "0",
+        "CONVERSATION_LOG_PATH": os.path.join(workdir, "visa_intelligence.jsonl"),
+        "QUEUE_DB_PATH": os.path.join(workdir, "jobs.sqlite3"),
+        "RESPONSE_CACHE_DB_PATH": os.path.join(workdir, "response_cache.sqlite3"),
+        "PROFILE_DIR": os.path.join(workdir, "profiles"),
+    })
+    os.environ.update(env)
+    sys.path.insert(0, str(ROOT / "api"))
+    module = importlib.import_module("bot")
+    logging.getLogger().setLevel(logging.WARNING)
+    return module
+
+class Tracker:
+    """Follows each update from webhook POST to the reply the stub receives"""
+
+    _update = contextvars.ContextVar("update_id", default=None)
+
+    def __init__(self, japa):
+        self.sent: Dict[int, Tuple[float, int]] = {}  # update_id -> (t, chat_id)
+        self.answered: Dict[int, bool] = {}            # update_id -> _should_respond result
+        self.acks: List[float] = []
+        self.ack_errors = 0
+        self.completed: List[float] = []
+        self._wrap(japa.bot)
+
+    def _wrap(self, bot):
+        process_message = bot.process_message
+        should_respond = bot._should_respond
+
+        async def traced_process(update):
+            token = self._update.set(update.get("update_id"))
+            try:
+                return await process_message(update)
+            finally:
+                self._update.reset(token)
+                self.completed.append(time.perf_counter())
+
+        def traced_should_respond(context):
+            result = should_respond(context)
+            update_id = self._update.get()
+            if update_id is not None:
+                self.answered[update_id] = result
+            return result
+
+        bot.process_message = traced_process
+        bot._should_respond = traced_should_respond
+
+    def reply_latencies(self, replies: List[Dict]) -> List[float]:
+        """Time from the oldest answered-but-unreplied message in a chat to the next reply"""
+        events = [(t, 0, chat_id, update_id) for update_id, (t, chat_id) in self.sent.items()
+                  if self.answered.get(update_id)]
+        events += [(c["t"], 1, c["payload"].get("chat_id"), None) for c in replies if c["method"] == "sendMessage"]
+        pending: Dict = {}
+        latencies = []
+        for t, kind, chat_id, _ in sorted(events, key=lambda e: (e[0], e[1])):
+            if kind == 0:
+                pending.setdefault(chat_id, t)
+            elif chat_id in pending:
+                latencies.append(t - pending.pop(chat_id))
+        return latencies
+
+async def drive(japa, tracker: Tracker, updates: List[Tuple[float, Dict]], stub: TelegramStub,
+                settle: float, drain_timeout: float, rss_samples: List[float]) -> Dict:
+    transport = httpx.ASGITransport(app=japa.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+
+        async def post(update):
+            update_id = update.get("update_id")
+            chat_id = (update.get("message") or {}).get("chat", {}).get("id")
+            started = time.perf_counter()
+            tracker.sent[update_id] = (started, chat_id)
+            try:
+                response = await client.post("/api/webhook", json=update)
+                response.raise_for_status()
+            except httpx.HTTPError:
+                tracker.ack_errors += 1
+            tracker.acks.append(time.perf_counter() - started)
+
+        async def sample_rss():
+            while True:
+                rss_samples.append(rss_mb())
+                await asyncio.sleep(0.5)
+
+        sampler = asyncio.create_task(sample_rss())
+        start = time.perf_counter()
+        tasks = []
+        for offset, update in updates:
+            delay = start + offset - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(post(update)))
+        await asyncio.gather(*tasks)
+        sent_done = time.perf_counter()
+
+        # Wait until queues are empty and the stub has been quiet for `settle` seconds
+        deadline = sent_done + drain_timeout
+        while time.perf_counter() < deadline:
+            calls = stub.calls
+            quiet = time.perf_counter() - (calls[-1]["t"] if calls else sent_done) >= settle
+            busy = japa.job_queue.depth() or japa.dispatcher.depth() or japa.bot.aggregator._batches
+            if quiet and not busy:
+                break
+            await asyncio.sleep(0.1)
+        sampler.cancel()
+        return {"start": start, "sent_done": sent_done, "drained": time.perf_counter()}
+
+def run(args) -> Dict:
+    stub = TelegramStub(latency=args.telegram_latency, rate_limit_every=args.rate_limit_every).start()
+    fake = FakeGemini(latency=args.gemini_latency, error_rate=args.gemini_error_rate, seed=args.seed)
+    env = dict(pair.split("=", 1) for pair in args.env)
+
+    with tempfile.TemporaryDirectory(prefix="japa-bench-") as workdir:
+        japa = import_bot(stub, workdir, env)
+        japa.model = fake
+        random.seed(args.seed)
+
+        if args.updates:
+            updates = load_updates(args.updates, args.rate)
+        else:
+            updates = list(synthetic(args.rate, args.duration, chats=args.chats,
+                                     private_share=args.private_share, burst_size=args.burst_size, seed=args.seed))
+        updates.sort(key=lambda pair: pair[0])
+
+        tracker = Tracker(japa)
+        rss_samples = [rss_mb()]
+        if args.tracemalloc:
+            tracemalloc.start()
+
+        async def main():
+            async with japa.lifespan(japa.app):
+                return await drive(japa, tracker, updates, stub, args.settle, args.drain_timeout, rss_samples)
+
+        times = asyncio.run(main())
+        rss_samples.append(rss_mb())
+        traced = tracemalloc.get_traced_memory() if args.tracemalloc else None
+        tracemalloc.stop()
+        stub.stop()
+
+    replies = stub.replies()
+    completed = tracker.completed
+    busy = (completed[-1] - times["start"]) if completed else 0.0
+    engine = japa.bot.ai_engine
+    results = {
+        "updates": len(updates),
+        "send_seconds": round(times["sent_done"] - times["start"], 3),
+        "offered_rate_per_s": round(len(updates) / (times["sent_done"] - times["start"]), 2),
+        "processed": len(completed),
+        "throughput_per_s": round(len(completed) / busy, 2) if busy else 0.0,
+        "ack_errors": tracker.ack_errors,
+        "ack_ms": percentiles(tracker.acks, 1000),
+        "answered": sum(tracker.answered.values()),
+        "reply_s": percentiles(tracker.reply_latencies(replies)),
+        "telegram": {
+            "sendMessage": sum(c["method"] == "sendMessage" for c in replies),
+            "editMessageText": sum(c["method"] == "editMessageText" for c in replies),
+            "sendChatAction": sum(c["method"] == "sendChatAction" for c in stub.calls),
+        },
+        "gemini": {
+            "calls": fake.calls,
+            "prompt_chars": fake.prompt_chars,
+            "prompt_tokens": engine.token_stats.get("prompt_tokens", 0),
+        },
+        "queue": dict(japa.job_queue.stats),
+        "aggregator": dict(japa.bot.aggregator.stats),
+        "prefilter": japa.bot.prefilter.snapshot(),
+        "rss_start_mb": round(rss_samples[0], 1),
+        "rss_peak_mb": round(max(rss_samples), 1),
+        "rss_growth_mb": round(rss_samples[-1] - rss_samples[0], 1),
+    }
+    if traced:
+        results["traced_current_mb"] = round(traced[0] / 2 ** 20, 2)
+        results["traced_peak_mb"] = round(traced[1] / 2 ** 20, 2)
+
+    return {
+        "scenario": args.scenario or "custom",
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "config": {
+            "rate": args.rate, "duration": args.duration, "chats": args.chats,
+            "private_share": args.private_share, "burst_size": args.burst_size,
+            "gemini_latency": args.gemini_latency, "gemini_error_rate": args.gemini_error_rate,
+            "telegram_latency": args.telegram_latency, "rate_limit_every": args.rate_limit_every,
+            "updates_file": args.updates, "seed": args.seed, "env": env,
+        },
+        "results": results,
+    }
+
+def _lookup(results: Dict, dotted: str) -> Optional[float]:
+    value = results
+    for part in dotted.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def compare(report: Dict, baseline: Dict, tolerance: float) -> List[str]:
+    """Metrics that got worse than the baseline by more than `tolerance` (relative)"""
+    if report["config"] != baseline["config"]:
+        print("⚠️ Config differs from the baseline; comparison is approximate", file=sys.stderr)
+    regressions = []
+    for name, higher_is_better in REGRESSION_METRICS.items():
+        new, old = _lookup(report["results"], name), _lookup(baseline["results"], name)
+        if new is None or old is None:
+            continue
+        # Small absolute slack so near-zero metrics (RSS growth, fast acks) don't flap
+        slack = max(abs(old) * tolerance, 0.5 if name == "rss_growth_mb" else 1e-3)
+        worse = new < old - slack if higher_is_better else new > old + slack
+        if worse:
+            regressions.append(f"{name}: {old} -> {new}")
+    return regressions
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Load-test the Japa Genie webhook pipeline")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), help="Named preset; flags below override it")
+    parser.add_argument("--updates", help="Replay a recorded JSONL of Telegram updates")
+    parser.add_argument("--rate", type=float, help="Messages per second")
+    parser.add_argument("--duration", type=float, help="Seconds of synthetic traffic")
+    parser.add_argument("--chats", type=int, default=50)
+    parser.add_argument("--private-share", type=float, default=0.3)
+    parser.add_argument("--burst-size", type=int)
+    parser.add_argument("--gemini-latency", type=float, help="Mean fake model latency (s)")
+    parser.add_argument("--gemini-error-rate", type=float, help="Fraction of fake model calls that raise")
+    parser.add_argument("--telegram-latency", type=float, default=0.02, help="Stub Bot API latency (s)")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Stub answers every Nth send with 429")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Bot config override")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=3.0, help="Quiet seconds that end the run")
+    parser.add_argument("--drain-timeout", type=float, default=60.0)
+    parser.add_argument("--tracemalloc", action="store_true", help="Also report traced Python allocations")
+    parser.add_argument("--output", help="Write the report here as well as stdout")
+    parser.add_argument("--save", action="store_true", help="Store the report as the scenario baseline")
+    parser.add_argument("--compare", action="store_true", help="Fail if worse than the scenario baseline")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    preset = dict(DEFAULTS, **SCENARIOS.get(args.scenario, {}))
+    for key, value in preset.items():
+        if getattr(args, key) is None:
+            setattr(args, key, value)
+    return args
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = run(args)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).write_text(text + "\n")
+
+    baseline_path = BASELINE_DIR / f"{report['scenario']}.json"
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        baseline_path.write_text(text + "\n")
+        print(f"💾 Baseline saved to {baseline_path}", file=sys.stderr)
+    if args.compare:
+        if not baseline_path.exists():
+            print(f"❌ No baseline at {baseline_path}", file=sys.stderr)
+            return 2
+        regressions = compare(report, json.loads(baseline_path.read_text()), args.tolerance)
+        for line in regressions:
+            print(f"❌ Regression {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ Within tolerance of baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
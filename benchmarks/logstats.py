@@ -0,0 +1,115 @@
+"""
+Conversation-log counters with several workers appending to one log.
+
+Forks `--workers` processes that each write `--records` records, spread
+over `--chats` chats, through their own BatchedLogWriter + ConversationStats
+on the same log, with a small rotation size so segments roll over mid-run
+and a short checkpoint interval so workers take turns syncing, then checks:
+
+- the shared checkpoint counts every record from every worker
+- its keyword and chat counts match a full rebuild from the segments
+- a fresh process restoring the checkpoint reports the same totals
+- per-chat state stays within CHAT_SLOTS, and chats_seen is within 10%
+
+    python benchmarks/logstats.py
+    python benchmarks/logstats.py --workers 8 --records 5000 --chats 100000
+
+Exits 1 if a check fails.
+"""
+import argparse
+import glob
+import gzip
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+from typing import Dict, List
+
+from harness import import_bot
+from stubs import TelegramStub
+
+KEYWORDS = ["visa", "uk visa", "work permit", "ielts", "canada pr", "embassy"]
+
+def worker(japa, path: str, checkpoint: str, n: int, records: int, chats: int, seed: int):
+    rng = random.Random(seed)
+    tracker = japa.ConversationStats(path, checkpoint)
+    writer = japa.BatchedLogWriter(path, batch_size=rng.randint(5, 50), flush_interval=0.005,
+                                   rotate_bytes=64 * 1024, tracker=tracker,
+                                   checkpoint_interval=rng.uniform(0.01, 0.05))
+    for i in range(records):
+        writer.write({
+            "timestamp": f"2026-10-18T{rng.randrange(24):02d}:00:00", "chat_id": -100 - rng.randrange(chats),
+            "user_id": i, "keywords": rng.sample(KEYWORDS, 2), "sentiment": "neutral",
+            "priority": "high" if i % 10 == 0 else "normal",
+        })
+    writer.close(timeout=60)
+
+def read_log(path: str):
+    """Every record in the rotated segments and the live log"""
+    for segment in sorted(glob.glob(glob.escape(path) + ".*.gz")) + [path]:
+        opener = gzip.open if segment.endswith(".gz") else open
+        with opener(segment, "rt") as f:
+            for line in f:
+                yield json.loads(line)
+
+def counts(stats) -> Dict:
+    return {"total": stats.total, "high_priority": stats.high_priority,
+            "keywords": dict(sorted(stats.keywords.items())), "chats": dict(sorted(stats.chats.items()))}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Multi-worker conversation log counter check")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--records", type=int, default=2000, help="Records per worker")
+    parser.add_argument("--chats", type=int, default=1000, help="Distinct chats the records spread over")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="japa-logstats-") as workdir:
+        japa = import_bot(TelegramStub(), workdir, {})
+        path = os.path.join(workdir, "conversations.jsonl")
+        checkpoint = path + ".stats.json"
+        fork = multiprocessing.get_context("fork")
+        procs = [fork.Process(target=worker, args=(japa, path, checkpoint, n, args.records, args.chats, n))
+                 for n in range(args.workers)]
+        for proc in procs:
+            proc.start()
+        for proc in procs:
+            proc.join()
+
+        restored = japa.ConversationStats(path, checkpoint)
+        restored.ensure_loaded()
+        rebuilt = japa.ConversationStats(path, os.path.join(workdir, "missing.json"))
+        rebuilt.ensure_loaded()
+        with open(checkpoint) as f:
+            saved = json.load(f)
+        segments = len([name for name in os.listdir(workdir) if name.endswith(".gz")])
+        checkpoint_bytes = os.path.getsize(checkpoint)
+        distinct = len({record["chat_id"] for record in read_log(path)})
+
+    expected = args.workers * args.records
+    report = {"workers": args.workers, "records": expected, "segments": segments,
+              "checkpoint_total": saved["total"], "rebuilt_total": rebuilt.total,
+              "checkpoint_bytes": checkpoint_bytes, "chats": distinct, "chats_seen": restored.chats_seen()}
+    print(json.dumps(report, indent=2))
+
+    failures: List[str] = []
+    if saved["total"] != expected:
+        failures.append(f"checkpoint counts {saved['total']} of {expected} records")
+    if counts(restored) != counts(rebuilt):
+        failures.append("restored checkpoint differs from a full rebuild of the log")
+    if rebuilt.total != expected:
+        failures.append(f"rebuild found {rebuilt.total} of {expected} records on disk")
+    if len(saved["chats"]) > japa.ConversationStats.CHAT_SLOTS:
+        failures.append(f"checkpoint keeps {len(saved['chats'])} chats, over CHAT_SLOTS")
+    if abs(restored.chats_seen() - distinct) > 0.1 * distinct:
+        failures.append(f"chats_seen estimates {restored.chats_seen()} of {distinct} chats")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    if failures:
+        return 1
+    print("✅ Checkpoint covers every worker's records", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Conversation memory under 100k distinct users, against its byte budget.
+
+Drives ConversationMemory.add the way replies do (user turn, model turn,
+detected keywords) for `--users` distinct (chat, user) keys, with
+tracemalloc on, and checks:
+
+- bytes_used never exceeds max_bytes (checked every 1000 users)
+- the real allocation (tracemalloc) stays within `--tolerance` of max_bytes,
+  i.e. the per-conversation size estimate does not under-count
+- once over budget, the least recently seen conversations are the ones evicted
+
+    python benchmarks/memory.py                         # 100k users, 16 MB budget
+    python benchmarks/memory.py --users 20000 --max-mb 4
+    python benchmarks/memory.py --save                  # write baselines/memory.json
+
+Exits 1 if a check fails.
+"""
+import argparse
+import gc
+import json
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict
+
+from corpus import varied
+from harness import BASELINE_DIR, import_bot
+from stubs import FakeGemini, TelegramStub
+
+def run(japa, users: int, max_bytes: int, turns: int) -> Dict:
+    texts = varied(5000, seed=3)
+    visa = japa.VisaIntelligence(None)
+    keywords = [visa.detect(text) for text in texts]
+    encoded = [text.encode() for text in texts]
+    reply = FakeGemini.REPLY.encode()
+
+    gc.collect()
+    tracemalloc.start()
+    baseline = tracemalloc.get_traced_memory()[0]
+    memory = japa.ConversationMemory(max_bytes=max_bytes)
+    over_budget = 0
+    peak_accounted = 0
+    started = time.perf_counter()
+    for n in range(users):
+        key = (-100 - n % 500, 10_000 + n)  # users spread over 500 group chats
+        for turn in range(turns):
+            i = (n * turns + turn) % len(texts)
+            # Fresh strings, as if decoded from a webhook, so tracemalloc sees them
+            memory.add(key, "user", encoded[i].decode(), keywords[i])
+            memory.add(key, "model", reply.decode())
+        if n % 1000 == 999:
+            peak_accounted = max(peak_accounted, memory.bytes_used)
+            over_budget += memory.bytes_used > max_bytes
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    traced = tracemalloc.get_traced_memory()[0] - baseline
+    tracemalloc.stop()
+
+    oldest_kept = min(key[1] for key in memory._conversations) - 10_000 if len(memory) else users
+    return {
+        "users": users,
+        "turns_per_user": turns * 2,
+        "max_bytes": max_bytes,
+        "conversations_kept": len(memory),
+        "bytes_used": memory.bytes_used,
+        "peak_bytes_used": peak_accounted,
+        "checks_over_budget": over_budget,
+        "traced_bytes": traced,
+        "traced_over_accounted": round(traced / max(memory.bytes_used, 1), 3),
+        "evicted": dict(memory.stats),
+        "oldest_kept_user": oldest_kept,
+        "us_per_add": round(elapsed / (users * turns * 2) * 1e6, 3),
+    }
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ConversationMemory budget check")
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--turns", type=int, default=2, help="User/model turn pairs per user")
+    parser.add_argument("--max-mb", type=float, default=16.0)
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="Allowed excess of traced memory over max_bytes")
+    parser.add_argument("--save", action="store_true", help="Store results as baselines/memory.json")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix="japa-memory-") as workdir:
+        japa = import_bot(TelegramStub(), workdir, {})
+        max_bytes = int(args.max_mb * 2 ** 20)
+        report = run(japa, args.users, max_bytes, args.turns)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        (BASELINE_DIR / "memory.json").write_text(text + "\n")
+
+    failures = []
+    if report["checks_over_budget"] or report["bytes_used"] > max_bytes:
+        failures.append(f"bytes_used over max_bytes ({report['peak_bytes_used']} > {max_bytes})")
+    if report["traced_bytes"] > max_bytes * (1 + args.tolerance):
+        failures.append(f"traced {report['traced_bytes']} bytes, budget {max_bytes} "
+                        f"(+{args.tolerance:.0%}): the size estimate under-counts")
+    kept = report["conversations_kept"]
+    if kept < args.users and report["oldest_kept_user"] != args.users - kept:
+        failures.append(f"eviction not least-recent-first (oldest kept user {report['oldest_kept_user']}, "
+                        f"expected {args.users - kept})")
+    for failure in failures:
+        print(f"❌ {failure}", file=sys.stderr)
+    if failures:
+        return 1
+    print("✅ Conversation memory within budget", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,304 @@
+"""
+Microbenchmarks for the per-message hot path, each against the code it replaced.
+
+    python benchmarks/micro.py                  # all benchmarks
+    python benchmarks/micro.py keywords logs    # a subset
+    python benchmarks/micro.py --save           # write baselines/micro.json
+    python benchmarks/micro.py --compare        # exit 1 if a current path got slower
+
+- keywords:  VisaIntelligence.detect vs the old per-phrase substring loop, on varied text
+- sentiment: SentimentAnalyzer.analyze vs the old substring lists
+- retrieval: KnowledgeIndex.search time and prompt size vs the whole knowledge base
+- logs:      event-loop stall at 1k msgs/s, blocking append vs BatchedLogWriter,
+             on the temp dir and with SLOW_DISK_MS added to every write
+- prefilter: PreFilter.check then detect + analyze, vs detect + analyze alone
+- http:      per-request httpx clients vs the pooled TelegramAPI, against the stub
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+import httpx
+
+from corpus import messages, varied
+from harness import BASELINE_DIR, import_bot, percentiles
+from stubs import TelegramStub
+
+# ========== REPLACED IMPLEMENTATIONS ==========
+OLD_KEYWORDS = [
+    "visa", "immigration", "immigrate", "migrate", "relocation", "relocate",
+    "work permit", "residence permit", "green card", "citizenship", "passport",
+    "student visa", "tourist visa", "business visa", "work visa", "family visa",
+    "skilled worker", "express entry", "provincial nominee", "h-1b", "l-1 visa",
+    "eu blue card", "schengen", "tier 2", "skilled independent",
+    "visa application", "visa renewal", "sponsorship", "documentation",
+    "consulate", "embassy", "interview", "biometrics", "medical exam",
+    "police clearance", "background check", "coe", "certificate of eligibility",
+    "canada pr", "usa green card", "uk visa", "australia pr", "germany visa",
+    "japan visa", "residence card", "permanent residence", "temporary residence",
+    "how to apply", "visa requirements", "processing time", "visa fee",
+    "ielts", "language test", "proof of funds", "job offer", "invitation letter",
+]
+
+def old_detect(text: str) -> List[str]:
+    text_lower = text.lower()
+    detected = []
+    for keyword in OLD_KEYWORDS:
+        if keyword in text_lower:
+            if keyword == "visa" and ("credit" in text_lower or "debit" in text_lower):
+                continue
+            detected.append(keyword)
+    return list(set(detected))
+
+def old_sentiment(text: str) -> Dict:
+    text_lower = text.lower()
+    stress_words = ['stressed', 'worried', 'anxious', 'scared', 'nervous', 'overwhelmed',
+                    'frustrated', 'confused', 'difficult', 'hard', 'struggling']
+    positive_words = ['excited', 'happy', 'approved', 'accepted', 'got it', 'success',
+                      'yes!', 'finally', 'approved', 'thank you']
+    question_words = ['how', 'what', 'when', 'where', 'why', 'can', 'should', 'would',
+                      'is it', 'do i', 'help', '?']
+    return {
+        'is_stressed': any(word in text_lower for word in stress_words),
+        'is_positive': any(word in text_lower for word in positive_words),
+        'is_question': any(word in text_lower for word in question_words),
+    }
+
+def old_log(path: str, data: Dict, disk_ms: float = 0.0):
+    with open(path, "a") as f:
+        f.write(json.dumps(data) + "\n")
+    if disk_ms:
+        time.sleep(disk_ms / 1000)  # like a blocking write, releases the GIL
+
+# ========== HELPERS ==========
+def per_call_us(fn: Callable, inputs: List, repeat: int = 5) -> float:
+    """Best-of-`repeat` mean microseconds per call"""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for item in inputs:
+            fn(item)
+        best = min(best, time.perf_counter() - started)
+    return round(best / len(inputs) * 1e6, 3)
+
+async def loop_stall(produce: Callable, rate: int = 1000, seconds: float = 2.0) -> Dict:
+    """Run `produce` `rate` times a second and measure how late a 1ms ticker wakes up"""
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.001)
+            lags.append(max(0.0, time.perf_counter() - started - 0.001))
+
+    async def producer():
+        n = 0
+        start = time.perf_counter()
+        while n < rate * seconds:
+            produce(n)
+            n += 1
+            wait = start + n / rate - time.perf_counter()
+            if wait > 0:
+                await asyncio.sleep(wait)
+        done.set()
+
+    await asyncio.gather(ticker(), producer())
+    result = percentiles(lags, 1000)
+    result["total_stall_ms"] = round(sum(lags) * 1000, 1)
+    return result
+
+# ========== BENCHMARKS ==========
+def bench_keywords(japa) -> Dict:
+    corpus = varied(5000)
+    visa = japa.VisaIntelligence()
+    return {
+        "messages": len(corpus),
+        "old_us_per_msg": per_call_us(old_detect, corpus),
+        "current_us_per_msg": per_call_us(visa.detect, corpus),
+        "old_hit_rate": round(sum(bool(old_detect(m)) for m in corpus) / len(corpus), 3),
+        "current_hit_rate": round(sum(bool(visa.detect(m)) for m in corpus) / len(corpus), 3),
+    }
+
+def bench_sentiment(japa) -> Dict:
+    corpus = messages(5000)
+    analyzer = japa.SentimentAnalyzer()
+    return {
+        "messages": len(corpus),
+        "old_us_per_msg": per_call_us(old_sentiment, corpus),
+        "current_us_per_msg": per_call_us(analyzer.analyze, corpus),
+        "old_question_rate": round(sum(old_sentiment(m)["is_question"] for m in corpus) / len(corpus), 3),
+        "current_question_rate": round(sum(analyzer.analyze(m)["is_question"] for m in corpus) / len(corpus), 3),
+    }
+
+def bench_retrieval(japa) -> Dict:
+    visa = japa.VisaIntelligence()
+    corpus = [m for m in messages(2000) if visa.detect(m)]
+    queries = [(m, visa.detect(m)) for m in corpus]
+    index = japa.knowledge_index
+    sizes = [len(index.render(index.search(m, keywords))) for m, keywords in queries]
+    return {
+        "queries": len(queries),
+        "current_us_per_search": per_call_us(lambda q: index.search(*q), queries),
+        "old_knowledge_chars": len(japa.IMMIGRATION_KNOWLEDGE),
+        "current_knowledge_chars": percentiles(sizes),
+    }
+
+def bench_prefilter(japa) -> Dict:
+    bot = japa.JapaGenieBot()
+    updates = [{"message_id": n, "chat": {"id": -100 - n % 20, "type": "supergroup"}, "text": text}
+               for n, text in enumerate(messages(5000))]
+
+    def full(message):
+        text = message["text"].strip()
+        if text and not text.startswith("/") and len(text.split()) >= 3:
+            bot.visa_intel.detect(text)
+            bot.sentiment.analyze(text)
+
+    def filtered(message):
+        text = message["text"].strip()
+        if bot.prefilter.check(message, text, "supergroup") is not None:
+            bot.visa_intel.detect(text)
+            bot.sentiment.analyze(text)
+
+    old_us = per_call_us(full, updates)
+    current_us = per_call_us(filtered, updates)
+    snapshot = bot.prefilter.snapshot()
+    seen = snapshot["seen"]
+    return {
+        "messages": len(updates),
+        "old_us_per_msg": old_us,
+        "current_us_per_msg": current_us,
+        "rejected_fraction": snapshot["rejected_fraction"],
+        "rejected": {k: round(v / seen, 3) for k, v in snapshot["rejected"].items()},
+    }
+
+# Added per write on the "slow disk" run: a busy volume, where the old blocking
+# append paid this on the event loop for every message
+SLOW_DISK_MS = 0.5
+
+def bench_logs(japa, workdir: str) -> Dict:
+    record = {"user_id": 1, "user_name": "Ada", "text": "How long does the UK visa take?",
+              "keywords": ["visa"], "sentiment": "neutral", "chat_id": -100, "priority": "normal"}
+
+    class SlowDiskWriter(japa.BatchedLogWriter):
+        def _open_locked(self) -> int:
+            time.sleep(SLOW_DISK_MS / 1000)  # once per batch
+            return super()._open_locked()
+
+    def run(disk_ms: float, writer_class) -> Dict:
+        old_path = os.path.join(workdir, f"old-{disk_ms}.jsonl")
+        writer = writer_class(os.path.join(workdir, f"batched-{disk_ms}.jsonl"))
+        old = asyncio.run(loop_stall(lambda n: old_log(old_path, dict(record, n=n), disk_ms)))
+        current = asyncio.run(loop_stall(lambda n: writer.write(dict(record, n=n))))
+        writer.close()
+        return {"old_stall_ms": old, "current_stall_ms": current}
+
+    result = dict(rate=1000, **run(0.0, japa.BatchedLogWriter))
+    result["slow_disk"] = dict(disk_ms=SLOW_DISK_MS, **run(SLOW_DISK_MS, SlowDiskWriter))
+    return result
+
+def bench_http(japa) -> Dict:
+    stub = TelegramStub().start()
+    url = f"{stub.base_url}/botbench/sendMessage"
+    requests = 300
+    payload = {"chat_id": 1, "text": "hello"}
+
+    async def per_request():
+        async def send():
+            async with httpx.AsyncClient() as client:
+                await client.post(url, json=payload)
+        await asyncio.gather(*(send() for _ in range(requests)))
+
+    async def pooled():
+        api = japa.TelegramAPI("bench", stub.base_url)
+        await api.start()
+        try:
+            await asyncio.gather(*(api.send_message(1, "hello") for _ in range(requests)))
+        finally:
+            await api.close()
+
+    def timed(coro_fn):
+        started = time.perf_counter()
+        asyncio.run(coro_fn())
+        return round(time.perf_counter() - started, 3)
+
+    try:
+        return {"requests": requests, "old_seconds": timed(per_request), "current_seconds": timed(pooled)}
+    finally:
+        stub.stop()
+
+BENCHMARKS = {
+    "keywords": bench_keywords,
+    "sentiment": bench_sentiment,
+    "retrieval": bench_retrieval,
+    "prefilter": bench_prefilter,
+    "logs": bench_logs,
+    "http": bench_http,
+}
+
+# Current-path metric per benchmark (lower is better) checked by --compare
+REGRESSION_METRICS = {
+    "keywords": ("current_us_per_msg",),
+    "sentiment": ("current_us_per_msg",),
+    "retrieval": ("current_us_per_search",),
+    "prefilter": ("current_us_per_msg",),
+    "logs": ("current_stall_ms", "p99"),
+    "http": ("current_seconds",),
+}
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Japa Genie hot-path microbenchmarks")
+    parser.add_argument("names", nargs="*", metavar="name",
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument("--save", action="store_true", help="Store results as baselines/micro.json")
+    parser.add_argument("--compare", action="store_true", help="Fail if slower than baselines/micro.json")
+    parser.add_argument("--tolerance", type=float, default=0.5)
+    args = parser.parse_args(argv)
+    names = args.names or list(BENCHMARKS)
+    unknown = set(names) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(sorted(unknown))}")
+
+    with tempfile.TemporaryDirectory(prefix="japa-micro-") as workdir:
+        stub = TelegramStub()  # only for the base URL; the bot makes no calls here
+        japa = import_bot(stub, workdir, {})
+        results = {}
+        for name in names:
+            bench = BENCHMARKS[name]
+            results[name] = bench(japa, workdir) if name == "logs" else bench(japa)
+            print(f"{name}: {json.dumps(results[name])}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+    baseline_path = BASELINE_DIR / "micro.json"
+    if args.save:
+        BASELINE_DIR.mkdir(exist_ok=True)
+        saved = json.loads(baseline_path.read_text()) if baseline_path.exists() else {}
+        saved.update(results)
+        baseline_path.write_text(json.dumps(saved, indent=2) + "\n")
+    if args.compare:
+        if not baseline_path.exists():
+            print(f"❌ No baseline at {baseline_path}", file=sys.stderr)
+            return 2
+        baseline = json.loads(baseline_path.read_text())
+        regressions = []
+        for name in names:
+            new, old = results[name], baseline.get(name, {})
+            for key in REGRESSION_METRICS[name]:
+                new, old = new.get(key, {}), old.get(key, {})
+            if isinstance(old, (int, float)) and new > old * (1 + args.tolerance):
+                regressions.append(f"{name}: {old} -> {new}")
+        for line in regressions:
+            print(f"❌ Regression {line}", file=sys.stderr)
+        if regressions:
+            return 1
+        print("✅ Within tolerance of baseline", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
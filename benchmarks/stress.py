@@ -0,0 +1,164 @@
+"""
+Delivery stress test: 10k webhook updates, none lost, none answered twice.
+
+Drives the real webhook -> queue -> dispatcher pipeline against the Telegram
+stub (which fails every Nth send with a 502) and a fast fake model, with a
+share of updates redelivered the way Telegram does on slow acks. Group
+batching and streamed private replies run with their default settings.
+
+    python benchmarks/stress.py                          # 10k updates, memory queue
+    python benchmarks/stress.py --env QUEUE_BACKEND=sqlite --updates 3000
+    python benchmarks/stress.py --fail-every 0           # no injected failures
+
+Checks, exiting 1 on any failure:
+
+- every distinct update is processed exactly once; redeliveries are dropped
+- each chat gets exactly one sendMessage per answered private update and
+  per group batch reply, and every answered group message is in a batch
+- no job is shed or dropped, and every injected 502 was retried
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import tempfile
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from corpus import synthetic
+from harness import Tracker, drive, import_bot
+from stubs import FakeGemini, TelegramStub
+
+# No rate limits to wait out; batching and streaming keep their defaults
+ENV = {
+    "TELEGRAM_GLOBAL_RATE": "100000",
+    "TELEGRAM_CHAT_RATE": "1000",
+    "TELEGRAM_GROUP_RATE": "1000",
+    "QUEUE_MAX_SIZE": "100000",
+    "QUEUE_RETRY_BASE": "0.05",
+    "QUEUE_MAX_ATTEMPTS": "5",
+}
+
+def with_redeliveries(updates: List[Tuple[float, Dict]], share: float, seed: int) -> List[Tuple[float, Dict]]:
+    """Repeat `share` of the updates a little later, like Telegram retrying a slow ack"""
+    rng = random.Random(seed)
+    repeats = [(offset + rng.uniform(0.05, 1.0), json.loads(json.dumps(update)))
+               for offset, update in updates if rng.random() < share]
+    return sorted(updates + repeats, key=lambda pair: pair[0])
+
+def run(args) -> Tuple[Dict, List[str]]:
+    stub = TelegramStub(latency=0.005, fail_every=args.fail_every).start()
+    fake = FakeGemini(latency=0.02, seed=args.seed)
+    env = dict(ENV, **dict(pair.split("=", 1) for pair in args.env))
+
+    with tempfile.TemporaryDirectory(prefix="japa-stress-") as workdir:
+        japa = import_bot(stub, workdir, env)
+        japa.model = fake
+        random.seed(args.seed)
+        updates = list(synthetic(args.rate, args.updates / args.rate, chats=args.chats, seed=args.seed))
+        distinct = {update["update_id"] for _, update in updates}
+        updates = with_redeliveries(updates, args.redeliver, args.seed)
+
+        tracker = Tracker(japa)
+        processed: Counter = Counter()
+        process_message = japa.bot.process_message
+
+        async def counted(update):
+            processed[update.get("update_id")] += 1
+            return await process_message(update)
+
+        japa.bot.process_message = counted
+
+        batches: Counter = Counter()   # chat_id -> batch replies
+        batched: Counter = Counter()   # chat_id -> messages answered by a batch
+        respond = japa.bot.aggregator.respond
+
+        async def counted_batch(chat_id, items):
+            reply, result = await respond(chat_id, items)
+            batched[chat_id] += len(items)
+            batches[chat_id] += bool(reply)
+            return reply, result
+
+        japa.bot.aggregator.respond = counted_batch
+
+        async def main():
+            async with japa.lifespan(japa.app):
+                await drive(japa, tracker, updates, stub, args.settle, args.drain_timeout, [])
+                queue = dict(japa.job_queue.stats, shed=japa.job_queue.backend.shed)
+            return queue
+
+        queue = asyncio.run(main())
+        stub.stop()
+
+    answered_per_chat: Counter = Counter()
+    for update_id, answered in tracker.answered.items():
+        if answered:
+            answered_per_chat[tracker.sent[update_id][1]] += 1
+    # Group messages get one reply per batch; everything else one reply each
+    expected_per_chat = Counter({chat: n - batched[chat] + batches[chat] for chat, n in answered_per_chat.items()})
+    unbatched = sum(n != batched[chat] for chat, n in answered_per_chat.items() if chat < 0 and japa.bot.aggregator.enabled)
+    # Feedback channel posts share the dispatcher but are not replies (and are not retried)
+    channel = japa.bot.feedback.feedback_channel_id
+    sends_per_chat = Counter(c["payload"]["chat_id"] for c in stub.replies()
+                             if c["method"] == "sendMessage" and c["payload"]["chat_id"] != channel)
+    failed_replies = sum(payload["chat_id"] != channel for payload in stub.failed)
+    wrong_chats = {chat: (expected_per_chat[chat], sends_per_chat[chat])
+                   for chat in set(expected_per_chat) | set(sends_per_chat)
+                   if expected_per_chat[chat] != sends_per_chat[chat]}
+
+    report = {
+        "updates": len(distinct),
+        "posted": len(updates),
+        "processed": sum(processed.values()),
+        "answered": sum(answered_per_chat.values()),
+        "batches": sum(batches.values()),
+        "batched_messages": sum(batched.values()),
+        "sendMessage": sum(sends_per_chat.values()),
+        "injected_502": len(stub.failed),
+        "injected_502_on_replies": failed_replies,
+        "ack_errors": tracker.ack_errors,
+        "queue": queue,
+    }
+    failures = []
+    if set(processed) != distinct:
+        failures.append(f"{len(distinct - set(processed))} updates never processed")
+    if any(n > 1 for n in processed.values()):
+        failures.append(f"{sum(n > 1 for n in processed.values())} updates processed more than once")
+    if wrong_chats:
+        sample = dict(list(wrong_chats.items())[:5])
+        failures.append(f"{len(wrong_chats)} chats with expected replies != sent, e.g. {sample}")
+    if unbatched:
+        failures.append(f"{unbatched} group chats with answered messages outside any batch")
+    if queue["failed"] or queue["rejected"] or queue["shed"]:
+        failures.append(f"jobs lost: failed={queue['failed']} rejected={queue['rejected']} shed={queue['shed']}")
+    if queue["retried"] < failed_replies:
+        failures.append(f"{failed_replies} replies got a 502 but only {queue['retried']} retries")
+    if tracker.ack_errors:
+        failures.append(f"{tracker.ack_errors} webhook acks failed")
+    return report, failures
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="No-update-lost stress test for the webhook pipeline")
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=500.0, help="Messages per second")
+    parser.add_argument("--chats", type=int, default=200)
+    parser.add_argument("--fail-every", type=int, default=40, help="Stub answers every Nth send with 502")
+    parser.add_argument("--redeliver", type=float, default=0.05, help="Share of updates posted twice")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Bot config override")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--settle", type=float, default=3.0)
+    parser.add_argument("--drain-timeout", type=float, default=120.0)
+    args = parser.parse_args(argv)
+
+    report, failures = run(args)
+    print(json.dumps(report, indent=2))
+    for line in failures:
+        print(f"❌ {line}", file=sys.stderr)
+    if failures:
+        return 1
+    print("✅ No update lost or answered twice", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
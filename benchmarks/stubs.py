@@ -0,0 +1,162 @@
+"""
+Local stand-ins for the bot's external services.
+
+- TelegramStub: a real HTTP server (uvicorn on 127.0.0.1) speaking enough of
+  the Bot API for the bot, recording every call and optionally answering
+  429s or 502s.
+- FakeGemini: drop-in for google.generativeai.GenerativeModel with tunable
+  latency, error rate and streaming.
+"""
+import asyncio
+import random
+import socket
+import threading
+import time
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+# ========== TELEGRAM STUB ==========
+class TelegramStub:
+    """Bot API stub on a background thread; calls are recorded with perf_counter times"""
+    
+    def __init__(self, latency: float = 0.0, rate_limit_every: int = 0, retry_after: int = 1,
+                 fail_every: int = 0):
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every  # answer every Nth sendMessage with a 429
+        self.retry_after = retry_after
+        self.fail_every = fail_every              # answer every Nth sendMessage with a 502
+        self.rate_limited = 0
+        self.failed: List[Dict] = []              # payloads answered with a 502
+        self.calls: List[Dict] = []
+        self.connections = 0
+        self._lock = threading.Lock()
+        self._message_ids = 0
+        self._sends = 0
+        self.port = self._free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self._server: Optional[uvicorn.Server] = None
+        self._thread: Optional[threading.Thread] = None
+    
+    @staticmethod
+    def _free_port() -> int:
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            return sock.getsockname()[1]
+    
+    def _app(self) -> FastAPI:
+        app = FastAPI()
+        
+        @app.post("/bot{token}/{method}")
+        async def bot_api(token: str, method: str, request: Request):
+            payload = await request.json()
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            with self._lock:
+                if method == "sendMessage":
+                    self._sends += 1
+                    if self.fail_every and self._sends % self.fail_every == 0:
+                        self.failed.append(payload)
+                        return JSONResponse({"ok": False, "error_code": 502, "description": "Bad Gateway"},
+                                            status_code=502)
+                    if self.rate_limit_every and self._sends % self.rate_limit_every == 0:
+                        self.rate_limited += 1
+                        return JSONResponse({
+                            "ok": False, "error_code": 429, "description": "Too Many Requests",
+                            "parameters": {"retry_after": self.retry_after}
+                        }, status_code=429)
+                self._message_ids += 1
+                self.calls.append({"t": time.perf_counter(), "method": method, "payload": payload})
+                return {"ok": True, "result": {"message_id": self._message_ids}}
+        
+        return app
+    
+    def start(self):
+        config = uvicorn.Config(self._app(), host="127.0.0.1", port=self.port, log_level="error", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("Telegram stub did not start")
+            time.sleep(0.01)
+        return self
+    
+    def stop(self):
+        if self._server is not None:
+            self._server.should_exit = True
+            self._thread.join(5)
+    
+    def replies(self) -> List[Dict]:
+        with self._lock:
+            return [c for c in self.calls if c["method"] in ("sendMessage", "editMessageText")]
+
+# ========== FAKE GEMINI ==========
+class _Usage:
+    def __init__(self, prompt_tokens: int, output_tokens: int):
+        self.prompt_token_count = prompt_tokens
+        self.candidates_token_count = output_tokens
+
+class _Response:
+    def __init__(self, text: str, prompt: str):
+        self.text = text
+        self.usage_metadata = _Usage(len(prompt) // 4, len(text) // 4)
+
+class _Stream:
+    def __init__(self, chunks: List[str], delay: float, prompt: str, fail_after: int = 0):
+        self._chunks = chunks
+        self._delay = delay
+        self._fail_after = fail_after
+        self.usage_metadata = _Usage(len(prompt) // 4, sum(map(len, chunks)) // 4)
+    
+    async def __aiter__(self):
+        for n, chunk in enumerate(self._chunks):
+            await asyncio.sleep(self._delay)
+            if self._fail_after and n == self._fail_after:
+                raise RuntimeError("fake Gemini stream broke")
+            yield _Response(chunk, "")
+
+class FakeGemini:
+    """GenerativeModel stand-in: lognormal latency around mean, random failures"""
+    
+    REPLY = ("Hey! I totally get it - so the UK Skilled Worker route usually takes about 3 weeks, "
+             "or 5 days with priority. Get your documents ready early and you'll be fine! 😊")
+    
+    def __init__(self, latency: float = 0.8, error_rate: float = 0.0, chunks: int = 4, seed: int = 7,
+                 fail_after_chunks: int = 0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.chunks = chunks
+        self.fail_after_chunks = fail_after_chunks  # streams break after this many chunks
+        self.calls = 0
+        self.prompt_chars = 0
+        self._random = random.Random(seed)
+    
+    def _delay(self) -> float:
+        return self.latency * self._random.lognormvariate(0, 0.35) if self.latency else 0.0
+    
+    async def generate_content_async(self, prompt: str, stream: bool = False):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        delay = self._delay()
+        if self._random.random() < self.error_rate:
+            await asyncio.sleep(delay)
+            raise RuntimeError("fake Gemini error")
+        if stream:
+            size = -(-len(self.REPLY) // self.chunks)
+            parts = [self.REPLY[i:i + size] for i in range(0, len(self.REPLY), size)]
+            await asyncio.sleep(delay / 2)
+            return _Stream(parts, delay / 2 / len(parts), prompt, self.fail_after_chunks)
+        await asyncio.sleep(delay)
+        return _Response(self.REPLY, prompt)
+    
+    def generate_content(self, prompt: str):
+        self.calls += 1
+        self.prompt_chars += len(prompt)
+        time.sleep(self._delay())
+        if self._random.random() < self.error_rate:
+            raise RuntimeError("fake Gemini error")
+        return _Response(self.REPLY, prompt)